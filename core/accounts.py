@@ -0,0 +1,85 @@
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import QuerySet
+from .models import InstructorProfile, StudentProfile
+
+BLACKLIST_APP = 'rest_framework_simplejwt.token_blacklist'
+PROFILE_MODELS = {'student': StudentProfile, 'instructor': InstructorProfile}
+BATCH_SIZE = 500
+
+
+def saves_role(update_fields):
+    """Whether a save with these update_fields can change the role."""
+    return update_fields is None or 'role' in update_fields
+
+
+def loaded_role(user):
+    """The role the user has in the database; read only for instances not loaded by a query."""
+    if '_loaded_role' not in user.__dict__:
+        user._loaded_role = get_user_model().objects.filter(pk=user.pk).values_list('role', flat=True).first()
+    return user._loaded_role
+
+
+def blacklist_tokens(user_ids):
+    """
+    Blacklist the outstanding JWTs of the users with one read and one INSERT,
+    skipping tokens blacklisted already, and drop their cached tokens. The
+    blacklist itself is only kept when its app is installed.
+    """
+    user_ids = list(user_ids)
+    for user_id in user_ids:
+        cache.delete(f"user_token_{user_id}")
+    if not user_ids or not apps.is_installed(BLACKLIST_APP):
+        return 0
+    from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+    tokens = OutstandingToken.objects.filter(user_id__in=user_ids, blacklistedtoken__isnull=True).values_list('id', flat=True)
+    return len(BlacklistedToken.objects.bulk_create(
+        [BlacklistedToken(token_id=token_id) for token_id in tokens], ignore_conflicts=True,
+    ))
+
+
+def _users(users):
+    """A queryset for a queryset, or an iterable of users or ids."""
+    if isinstance(users, QuerySet):
+        return users
+    return get_user_model().objects.filter(pk__in=[getattr(user, 'pk', user) for user in users])
+
+
+def change_role(users, role):
+    """
+    Give users a new role with the same end state as saving each of them (see
+    core.signals): the old role's profile is deleted, the new one's created
+    and their tokens blacklisted. One transaction with one UPDATE and bulk
+    profile and blacklist writes, whatever the number of users. Returns the
+    number of users whose role changed.
+    """
+    with transaction.atomic():
+        changing = list(_users(users).exclude(role=role).select_for_update().values_list('id', 'role'))
+        if not changing:
+            return 0
+        user_ids = [user_id for user_id, _ in changing]
+        get_user_model().objects.filter(pk__in=user_ids).update(role=role)
+        for old_role, profile in PROFILE_MODELS.items():
+            if old_role != role:
+                profile.objects.filter(user_id__in=[user_id for user_id, was in changing if was == old_role]).delete()
+        if role in PROFILE_MODELS:
+            PROFILE_MODELS[role].objects.bulk_create(
+                [PROFILE_MODELS[role](user_id=user_id) for user_id in user_ids], ignore_conflicts=True, batch_size=BATCH_SIZE,
+            )
+        blacklist_tokens(user_ids)
+    return len(changing)
+
+
+def set_active(users, active):
+    """
+    Activate or deactivate users with one UPDATE; deactivated users also have
+    their tokens blacklisted. Returns the number of users that changed.
+    """
+    with transaction.atomic():
+        user_ids = list(_users(users).exclude(is_active=active).values_list('id', flat=True))
+        get_user_model().objects.filter(pk__in=user_ids).update(is_active=active)
+        if not active:
+            blacklist_tokens(user_ids)
+    return len(user_ids)
@@ -1,9 +1,14 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import Group
-from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import render
+from django.urls import path
 from django import forms
 from .models import *
+from .accounts import change_role, set_active
+from .forms import RosterImportForm
+from .roster import RosterFormatError, import_roster
 
 admin.site.site_header = "Learn it Admin"
 admin.site.site_title = "Learn it Admin Portal"
@@ -48,13 +53,63 @@ class CustomUserAdmin(UserAdmin):
     # Optional: Make password readonly in the admin panel to prevent unwanted errors
     readonly_fields = ("password",)
 
-    def save_model(self, request, obj, form, change):
-        if change:
-            original = User.objects.get(pk=obj.pk)
-            if original.role != obj.role:
-                cache.delete(f"user_token_{obj.pk}")  # Invalidate token
-        
-        super().save_model(request, obj, form, change)
+    actions = ("make_students", "make_instructors", "make_admins", "activate_users", "deactivate_users")
+
+    # Bulk actions skip the per-user signals; core.accounts applies the same changes set-based
+    def set_role(self, request, queryset, role):
+        changed = change_role(queryset, role)
+        self.message_user(request, f"{changed} users are now {dict(User.ROLE_CHOICES)[role].lower()}s.", messages.SUCCESS)
+
+    @admin.action(description="Make selected users students", permissions=["change"])
+    def make_students(self, request, queryset):
+        self.set_role(request, queryset, 'student')
+
+    @admin.action(description="Make selected users instructors", permissions=["change"])
+    def make_instructors(self, request, queryset):
+        self.set_role(request, queryset, 'instructor')
+
+    @admin.action(description="Make selected users admins", permissions=["change"])
+    def make_admins(self, request, queryset):
+        self.set_role(request, queryset, 'admin')
+
+    @admin.action(description="Activate selected users", permissions=["change"])
+    def activate_users(self, request, queryset):
+        self.message_user(request, f"{set_active(queryset, True)} users activated.", messages.SUCCESS)
+
+    @admin.action(description="Deactivate selected users", permissions=["change"])
+    def deactivate_users(self, request, queryset):
+        self.message_user(request, f"{set_active(queryset, False)} users deactivated.", messages.SUCCESS)
+
+    def get_urls(self):
+        return [
+            path('import-roster/', self.admin_site.admin_view(self.import_roster_view), name='core_user_import_roster'),
+        ] + super().get_urls()
+
+    def import_roster_view(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        report = None
+        form = RosterImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            data = form.cleaned_data
+            try:
+                report = import_roster(data['roster'], data['roster'].name, data['courses'], data['track'])
+            except RosterFormatError as error:
+                form.add_error('roster', str(error))
+            else:
+                messages.success(
+                    request,
+                    f"{report.created} students created, {report.existing} already registered, "
+                    f"{report.enrolled} enrollments added, {report.error_count} rows rejected.",
+                )
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import students',
+            'form': form,
+            'report': report,
+        }
+        return render(request, 'admin/core/user/import_roster.html', context)
 
 admin.site.register(User, CustomUserAdmin)
 
@@ -1,8 +1,8 @@
-from .models import Track, Course, Category
+from django.utils.functional import SimpleLazyObject
+from .navigation import get_navigation
 
 def header_context(request):
+    # Lazy so pages that don't draw the menu (admin, redirects) never touch the cache
     return {
-        'tracks': Track.objects.all(),
-        'courses': Course.objects.all(),
-        'cats': Category.objects.all(),
+        'navigation': SimpleLazyObject(get_navigation),
     }
@@ -0,0 +1,48 @@
+import logging
+import random
+import time
+from functools import wraps
+from django.db import OperationalError, connection
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = 0.05  # Seconds, the cap of the first random wait, doubled on every retry
+RETRY_MAX_DELAY = 1.0  # Longest single wait between two tries
+# Seconds after which no new try starts. A try can still wait busy_timeout
+# (5 s), so a retried write gives up within about 15 s, under gunicorn's 30 s
+# worker timeout
+RETRY_BUDGET = 10
+
+
+def is_contention(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def retry_on_lock(func):
+    """
+    Run a write again when SQLite reports the database locked or busy, even
+    after waiting its busy_timeout (see SQLITE_PRAGMAS): a random pause of up
+    to RETRY_DELAY * 2**n seconds (full
+    jitter, so workers that collided don't collide again), capped at
+    RETRY_MAX_DELAY, until RETRY_BUDGET seconds have passed. Only retried
+    outside a transaction: inside one, the error belongs to whoever owns the
+    outermost block.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        deadline = time.monotonic() + RETRY_BUDGET
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as error:
+                if connection.in_atomic_block or not is_contention(error):
+                    raise
+                pause = random.uniform(0, min(RETRY_DELAY * 2 ** attempt, RETRY_MAX_DELAY))
+                if time.monotonic() + pause >= deadline:
+                    raise
+                attempt += 1
+                logger.warning("Database busy in %s, retry %s", func.__qualname__, attempt)
+                time.sleep(pause)
+    return wrapper
@@ -0,0 +1,135 @@
+import hashlib
+import math
+from functools import wraps
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import HttpResponse, QueryDict
+from django.utils.translation import get_language
+from django.views.decorators.http import condition
+from .throttle import Admission, client_ip, take
+from .utils import get_cache_version
+
+PAGES_CACHE = 'pages'
+PAGE_TIMEOUT = 60 * 60
+
+
+def public_query(request, params):
+    """The query string reduced to params, in their order; tracking tags (utm_*, gclid ...) are dropped."""
+    query = QueryDict(mutable=True)
+    for name in params:
+        if name in request.GET:
+            query.setlist(name, request.GET.getlist(name))
+    return QueryDict(query.urlencode())
+
+
+def page_cache_key(request):
+    path = hashlib.md5(f"{request.path}?{request.GET.urlencode()}".encode()).hexdigest()
+    return f"{PAGES_CACHE}:{get_cache_version(PAGES_CACHE)}:{get_language()}:{path}"
+
+
+def is_cacheable(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        # The page rendered a CSRF token, which must never be shared between visitors
+        and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+    )
+
+
+def cache_public_page(view=None, *, params=()):
+    """
+    Serve the same HTML to every anonymous visitor from the shared cache.
+
+    Only anonymous GET/HEAD requests without pending flash messages are
+    cached, and pages that set cookies or use a CSRF token are skipped.
+    Entries are dropped by bumping the 'pages' cache version whenever
+    content those pages show changes (see core.signals).
+
+    The view only sees the query parameters listed in params, and the entry is
+    keyed on those, so campaign links with a unique tag per click share it:
+    @cache_public_page(params=('after', 'before'))
+    """
+    if view is None:
+        return lambda view: cache_public_page(view, params=params)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated or len(messages.get_messages(request)):
+            return view(request, *args, **kwargs)
+
+        request.GET = public_query(request, params)
+        key = page_cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = view(request, *args, **kwargs)
+        if is_cacheable(request, response):
+            cache.set(key, (response.content, response['Content-Type']), PAGE_TIMEOUT)
+        return response
+    return wrapper
+
+
+def conditional_page(last_modified_func):
+    """
+    ETag / Last-Modified validators for a page from last_modified_func(request, *args, **kwargs).
+
+    The function runs once per request (it should be a single cheap query);
+    repeat visitors and caches then get a 304 without the page being rendered.
+    """
+    def last_modified(request, *args, **kwargs):
+        if not hasattr(request, '_page_last_modified'):
+            request._page_last_modified = last_modified_func(request, *args, **kwargs)
+        return request._page_last_modified
+
+    def etag(request, *args, **kwargs):
+        modified = last_modified(request, *args, **kwargs)
+        if modified is None:
+            return None
+        return hashlib.md5(f"{request.path}:{get_language()}:{modified.timestamp()}".encode()).hexdigest()
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def _refuse(status, wait):
+    response = HttpResponse("Too many requests, please try again shortly.", status=status, content_type='text/plain')
+    response['Retry-After'] = str(max(1, math.ceil(wait)))
+    return response
+
+
+def shed_form_posts(scope):
+    """
+    Turn away anonymous form floods before the form is even validated.
+
+    POSTs first take a token from a per-IP and a site-wide bucket in the throttle
+    cache (PUBLIC_FORM_RATE_PER_IP, PUBLIC_FORM_RATE_GLOBAL) and get a 429 when
+    either is empty. Admitted ones then need one of PUBLIC_FORM_CONCURRENCY
+    site-wide slots, waiting in a queue of PUBLIC_FORM_QUEUE for at most
+    PUBLIC_FORM_QUEUE_TIMEOUT seconds, or get a 503. GETs are never limited.
+    """
+    slots = Admission(scope)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'POST':
+                return view(request, *args, **kwargs)
+
+            wait = take(f"throttle:{scope}:ip:{client_ip(request)}", *settings.PUBLIC_FORM_RATE_PER_IP)
+            if not wait:
+                wait = take(f"throttle:{scope}:all", *settings.PUBLIC_FORM_RATE_GLOBAL)
+            if wait:
+                return _refuse(429, wait)
+
+            slot = slots.enter(settings.PUBLIC_FORM_CONCURRENCY, settings.PUBLIC_FORM_QUEUE, settings.PUBLIC_FORM_QUEUE_TIMEOUT)
+            if slot is None:
+                return _refuse(503, settings.PUBLIC_FORM_QUEUE_TIMEOUT)
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                slots.leave(slot)
+        return wrapper
+    return decorator
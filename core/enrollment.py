@@ -0,0 +1,126 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import CourseGroup, Enrollment, TrackEnrollment
+from .rollups import record_created
+
+BATCH_SIZE = 500
+
+
+class CourseFull(Exception):
+    """No upcoming group of the course has a free seat."""
+
+
+def _pk(value):
+    return getattr(value, 'pk', value)
+
+
+def has_room(seats=1):
+    return Q(capacity__isnull=True) | Q(seats_taken__lte=F('capacity') - seats)
+
+
+def upcoming_groups(course_ids, today=None):
+    """Groups of the given courses that have not started yet, earliest first."""
+    today = today or timezone.localdate()
+    return CourseGroup.objects.filter(course_id__in=course_ids, start_date__gte=today).order_by('course_id', 'start_date', 'id')
+
+
+def reserve_seats(course_id, count, groups=None):
+    """
+    Take count seats in the earliest upcoming groups of a course, spilling over
+    into later groups as they fill up. Returns [(group_id, seats)], which adds
+    up to less than count when the course runs out of seats.
+
+    groups is [(group_id, capacity, seats_taken)] as read beforehand. Seats are
+    taken with UPDATE ... WHERE seats_taken <= capacity - n, so parallel workers
+    can never overfill a group: a worker that loses the race re-reads the
+    counter and tries again with what is left.
+    """
+    if groups is None:
+        groups = upcoming_groups([course_id]).values_list('id', 'capacity', 'seats_taken')
+    taken = []
+    for group_id, capacity, seats_taken in groups:
+        while count:
+            seats = count if capacity is None else min(count, capacity - seats_taken)
+            if seats <= 0:
+                break
+            if CourseGroup.objects.filter(has_room(seats), id=group_id).update(seats_taken=F('seats_taken') + seats):
+                taken.append((group_id, seats))
+                count -= seats
+                break
+            seats_taken = CourseGroup.objects.filter(id=group_id).values_list('seats_taken', flat=True).first()
+            if seats_taken is None:  # Deleted meanwhile
+                break
+        if not count:
+            break
+    return taken
+
+
+def release_seats(group_id, seats=1):
+    CourseGroup.objects.filter(id=group_id, seats_taken__gte=seats).update(seats_taken=F('seats_taken') - seats)
+
+
+def enroll(user, course):
+    """
+    Enroll a user in the earliest upcoming group of a course with a free seat.
+    Returns the existing enrollment if there is one, raises CourseFull otherwise.
+    """
+    user_id, course_id = _pk(user), _pk(course)
+    existing = Enrollment.objects.filter(user_id=user_id, course_id=course_id).first()
+    if existing is not None:
+        return existing
+    # Read outside the transaction so that its first statement is the write
+    groups = list(upcoming_groups([course_id]).values_list('id', 'capacity', 'seats_taken'))
+    try:
+        with transaction.atomic():
+            taken = reserve_seats(course_id, 1, groups)
+            if not taken:
+                raise CourseFull(course_id)
+            return Enrollment.objects.create(user_id=user_id, course_id=course_id, group_id=taken[0][0])
+    except IntegrityError:
+        # A parallel request enrolled the same user first; the seat was rolled back
+        return Enrollment.objects.get(user_id=user_id, course_id=course_id)
+
+
+def enroll_in_courses(users, course_ids):
+    """
+    Enroll users (instances or ids) in the given courses with one bulk insert,
+    placing them in the earliest upcoming groups with free seats. Existing
+    enrollments are left alone; users who don't fit in a course, and courses
+    without upcoming groups, are skipped. Returns the new enrollments.
+    """
+    user_ids = [_pk(user) for user in users]
+    course_ids = list(course_ids)
+    enrolled = set(
+        Enrollment.objects.filter(user_id__in=user_ids, course_id__in=course_ids).values_list('user_id', 'course_id')
+    )
+    groups = {}
+    for group_id, course_id, capacity, seats_taken in upcoming_groups(course_ids).values_list('id', 'course_id', 'capacity', 'seats_taken'):
+        groups.setdefault(course_id, []).append((group_id, capacity, seats_taken))
+
+    enrollments = []
+    with transaction.atomic():
+        for course_id, candidates in groups.items():
+            pending = [user_id for user_id in user_ids if (user_id, course_id) not in enrolled]
+            if not pending:
+                continue
+            seats = (group_id for group_id, count in reserve_seats(course_id, len(pending), candidates) for _ in range(count))
+            enrollments += [
+                Enrollment(user_id=user_id, course_id=course_id, group_id=group_id)
+                for user_id, group_id in zip(pending, seats)
+            ]
+        # No ignore_conflicts: a duplicate from a parallel request must roll the seats back too
+        Enrollment.objects.bulk_create(enrollments, batch_size=BATCH_SIZE)
+        record_created(Enrollment, enrollments)  # bulk_create sends no signals
+    return enrollments
+
+
+def enroll_in_track(track, users):
+    """Enroll users (instances or ids) in a track and all of its courses, all or nothing."""
+    user_ids = [_pk(user) for user in users]
+    with transaction.atomic():
+        TrackEnrollment.objects.bulk_create(
+            [TrackEnrollment(user_id=user_id, track_id=_pk(track)) for user_id in user_ids],
+            ignore_conflicts=True, batch_size=BATCH_SIZE,
+        )
+        return enroll_in_courses(user_ids, track.courses.values_list('id', flat=True))
@@ -1,5 +1,8 @@
+import os
 from django import forms
-from .models import TalentRequest, Contact
+from .models import TalentRequest, Contact, Course, Track
+from .navigation import get_navigation
+from .roster import READERS
 
 class TalentRequestForm(forms.ModelForm):
     class Meta:
@@ -30,4 +33,72 @@ class ContactForm(forms.ModelForm):
             }),
             'message': forms.Textarea(attrs={'rows': 4, 'placeholder': 'Your Information Message'}),
             'company_name': forms.TextInput(attrs={'placeholder': 'Company Name'}),
-        }
\ No newline at end of file
+        }
+
+# Catalog listing filters (GET)
+class TrackFilterForm(forms.Form):
+    min_price = forms.DecimalField(required=False, min_value=0, decimal_places=2, widget=forms.NumberInput(attrs={'placeholder': 'Min price'}))
+    max_price = forms.DecimalField(required=False, min_value=0, decimal_places=2, widget=forms.NumberInput(attrs={'placeholder': 'Max price'}))
+
+    # Filter on the price after discount (a generated, indexed column)
+    price_field = 'final_price'
+
+    def filter(self, queryset):
+        # Invalid values are dropped from cleaned_data and simply not applied
+        self.is_valid()
+        data = self.cleaned_data
+        if data.get('min_price') is not None:
+            queryset = queryset.filter(**{f'{self.price_field}__gte': data['min_price']})
+        if data.get('max_price') is not None:
+            queryset = queryset.filter(**{f'{self.price_field}__lte': data['max_price']})
+        return queryset
+
+
+class CourseFilterForm(TrackFilterForm):
+    category = forms.TypedChoiceField(required=False, coerce=int, empty_value=None)
+    level = forms.ChoiceField(required=False, choices=[('', 'Any level')] + Course.LEVEL_CHOICES)
+    currency = forms.ChoiceField(required=False, choices=[('', 'Any currency')] + Course.CURRENCY_CHOICES)
+    status = forms.ChoiceField(required=False, choices=[('', 'Any status')] + Course.STATUS_CHOICES)
+    min_rating = forms.IntegerField(required=False, min_value=1, max_value=5, widget=forms.NumberInput(attrs={'placeholder': 'Min rating'}))
+    sort = forms.ChoiceField(required=False, choices=[
+        ('', 'Newest'), ('rating', 'Top rated'), ('price', 'Price: low to high'), ('-price', 'Price: high to low'),
+    ])
+
+    # Keyset orderings; each ends with the primary key so it is unique
+    orderings = {
+        '': ('-id',),
+        'rating': ('-rating_average', '-id'),
+        'price': ('final_price', 'id'),
+        '-price': ('-final_price', '-id'),
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Categories come from the cached navigation, no extra query
+        self.fields['category'].choices = [('', 'Any category')] + [(cat['id'], cat['name']) for cat in get_navigation()['cats']]
+
+    def filter(self, queryset):
+        queryset = super().filter(queryset)
+        for field in ('category', 'level', 'currency', 'status'):
+            if self.cleaned_data.get(field):
+                queryset = queryset.filter(**{field: self.cleaned_data[field]})
+        if self.cleaned_data.get('min_rating'):
+            queryset = queryset.filter(rating_average__gte=self.cleaned_data['min_rating'])
+        return queryset
+
+    def ordering(self):
+        self.is_valid()
+        return self.orderings[self.cleaned_data.get('sort') or '']
+
+
+# Admin roster import
+class RosterImportForm(forms.Form):
+    roster = forms.FileField(help_text='CSV or XLSX with a header row: email, and optionally username, first_name, last_name, phone1, phone2.')
+    courses = forms.ModelMultipleChoiceField(queryset=Course.objects.only('id', 'title').order_by('title'), required=False, help_text='Enroll every student in these courses.')
+    track = forms.ModelChoiceField(queryset=Track.objects.only('id', 'title').order_by('title'), required=False, help_text='Enroll every student in this track and its courses.')
+
+    def clean_roster(self):
+        roster = self.cleaned_data['roster']
+        if os.path.splitext(roster.name)[1].lower() not in READERS:
+            raise forms.ValidationError('Upload a .csv or .xlsx file.')
+        return roster
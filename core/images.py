@@ -0,0 +1,210 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+
+class ImageSpec:
+    """An image field resized off-request to a fixed thumbnail size."""
+
+    def __init__(self, model, field, size):
+        self.model_label = model
+        self.field = field
+        self.digest_field = f'{field}_digest'
+        self.size = size
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    def rendition_name(self, digest):
+        width, height = self.size
+        return f'thumbnails/{width}x{height}/{digest}.jpg'
+
+
+# Fields handled by the pipeline; each model has a matching <field>_digest column
+IMAGE_SPECS = [
+    ImageSpec('core.Course', 'thumbnail', (410, 378)),
+    ImageSpec('core.Track', 'image', (800, 500)),
+    ImageSpec('core.Event', 'thumbnail', (410, 378)),
+    ImageSpec('core.User', 'profile_picture', (300, 300)),
+]
+
+_executor = None
+
+
+def specs_for(model):
+    return [spec for spec in IMAGE_SPECS if spec.model_label == model._meta.label]
+
+
+def file_digest(fieldfile):
+    """SHA-256 of the file content, read in chunks."""
+    digest = hashlib.sha256()
+    if fieldfile._committed:
+        with fieldfile.storage.open(fieldfile.name, 'rb') as source:
+            for chunk in iter(lambda: source.read(64 * 1024), b''):
+                digest.update(chunk)
+    else:
+        for chunk in fieldfile.file.chunks():
+            digest.update(chunk)
+        fieldfile.file.seek(0)
+    return digest.hexdigest()
+
+
+def render_thumbnail(spec, source_name, digest):
+    """Write the cropped thumbnail for one source image, unless it already exists."""
+    target = spec.rendition_name(digest)
+    if default_storage.exists(target):
+        return target
+
+    with default_storage.open(source_name, 'rb') as source:
+        image = Image.open(source)
+        image = ImageOps.exif_transpose(image)
+        # Scale to cover the box and crop the overflow, keeping the aspect ratio
+        image = ImageOps.fit(image, spec.size, Image.Resampling.LANCZOS)
+
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    output = BytesIO()
+    image.save(output, format='JPEG', quality=85, optimize=True, progressive=True)
+    default_storage.save(target, ContentFile(output.getvalue()))
+    return target
+
+
+def _run(spec, source_name, digest):
+    try:
+        render_thumbnail(spec, source_name, digest)
+    except Exception:
+        logger.exception("Could not render thumbnail for %s", source_name)
+
+
+def schedule(spec, source_name, digest):
+    """
+    Render a thumbnail in the worker pool once the current transaction commits.
+    With IMAGE_WORKERS = 0 the thumbnail is rendered inline (tests, scripts).
+    """
+    global _executor
+    workers = getattr(settings, 'IMAGE_WORKERS', 2)
+    if not workers:
+        transaction.on_commit(lambda: _run(spec, source_name, digest))
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnails')
+    transaction.on_commit(lambda: _executor.submit(_run, spec, source_name, digest))
+
+
+def prepare(instance):
+    """
+    Called before an instance is saved: refresh the digest of new or unhashed
+    images and remember which thumbnails need rendering after the save.
+    Unchanged files are neither read nor re-encoded.
+    """
+    pending = []
+    for spec in specs_for(type(instance)):
+        fieldfile = getattr(instance, spec.field)
+        if not fieldfile:
+            setattr(instance, spec.digest_field, '')
+            continue
+        if fieldfile._committed and getattr(instance, spec.digest_field):
+            continue
+        try:
+            digest = file_digest(fieldfile)
+        except OSError:
+            logger.warning("Missing image file %s", fieldfile.name)
+            continue
+        setattr(instance, spec.digest_field, digest)
+        pending.append((spec, digest))
+    instance._pending_thumbnails = pending
+
+
+def dispatch(instance):
+    """Called after an instance is saved, when the file names are final."""
+    for spec, digest in getattr(instance, '_pending_thumbnails', []):
+        schedule(spec, getattr(instance, spec.field).name, digest)
+    instance._pending_thumbnails = []
+
+
+def thumbnail_url(instance, field):
+    """The thumbnail URL once it has been rendered, the original upload until then."""
+    fieldfile = getattr(instance, field)
+    if not fieldfile:
+        return ''
+    for spec in specs_for(type(instance)):
+        if spec.field == field:
+            digest = getattr(instance, spec.digest_field)
+            if digest and default_storage.exists(spec.rendition_name(digest)):
+                return default_storage.url(spec.rendition_name(digest))
+    return fieldfile.url
+
+
+# Responsive variants
+# Resized copies at a few standard widths, generated on first request by the
+# image_variant view and stored under the source digest, so the URL of a
+# variant never changes and can be cached forever.
+VARIANT_WIDTHS = (320, 640, 960)
+VARIANT_FORMATS = {
+    # extension: (Pillow format, MIME type, save options), best compression first
+    'avif': ('AVIF', 'image/avif', {'quality': 50}),
+    'webp': ('WEBP', 'image/webp', {'quality': 75, 'method': 4}),
+}
+
+
+def variant_formats():
+    """Formats this Pillow build can encode (AVIF needs Pillow 11.2+ or the plugin)."""
+    Image.init()  # Registers the optional encoders in Image.SAVE
+    return [ext for ext, (name, _, _) in VARIANT_FORMATS.items() if name in Image.SAVE]
+
+
+def variant_name(digest, width, ext):
+    return f'variants/{digest[:2]}/{digest}/{width}.{ext}'
+
+
+def find_source(digest):
+    """(spec, storage name) of the upload with this digest, from any pipeline field."""
+    for spec in IMAGE_SPECS:
+        name = spec.model.objects.filter(**{spec.digest_field: digest}).values_list(spec.field, flat=True).first()
+        if name:
+            return spec, name
+    return None, None
+
+
+def variant_size(spec, width, image):
+    """width wide at the aspect ratio of the spec, scaled down to fit the source (never upscaled)."""
+    spec_width, spec_height = spec.size
+    height = width * spec_height / spec_width
+    scale = min(1, image.width / width, image.height / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def render_variant(spec, source_name, digest, width, ext):
+    """Crop like the spec's thumbnail, so every srcset candidate shows the same picture."""
+    target = variant_name(digest, width, ext)
+    if default_storage.exists(target):
+        return target
+
+    pil_format, _, options = VARIANT_FORMATS[ext]
+    with default_storage.open(source_name, 'rb') as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image = ImageOps.fit(image, variant_size(spec, width, image), Image.Resampling.LANCZOS)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or image.mode == 'P' else 'RGB')
+
+    output = BytesIO()
+    image.save(output, format=pil_format, **options)
+    if not default_storage.exists(target):  # Another request may have rendered it meanwhile
+        default_storage.save(target, ContentFile(output.getvalue()))
+    return target
@@ -0,0 +1,80 @@
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from multiprocessing import Pool
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def modes():
+    """(name, pragmas, BEGIN statement, busy timeout): sqlite3 defaults, then this project's settings."""
+    options = settings.DATABASES['default'].get('OPTIONS', {})
+    return [
+        ('default', {}, 'BEGIN', 5),
+        ('tuned', settings.SQLITE_PRAGMAS, f"BEGIN {options.get('transaction_mode') or ''}".strip(), options.get('timeout', 5)),
+    ]
+
+
+def prepare(path):
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE entry (id INTEGER PRIMARY KEY, body TEXT NOT NULL);
+        CREATE TABLE counter (id INTEGER PRIMARY KEY, value INTEGER NOT NULL);
+        INSERT INTO counter VALUES (1, 0);
+    """)
+    conn.close()
+
+
+def work(path, pragmas, begin, timeout, seconds, write_share, seed):
+    """One worker process: a mix of reads and read-then-write transactions, like a gunicorn worker."""
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    for name, value in pragmas.items():
+        conn.execute(f'PRAGMA {name}={value}')
+    rng = random.Random(seed)
+    reads = writes = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            if rng.random() < write_share:
+                conn.execute(begin)
+                value = conn.execute('SELECT value FROM counter WHERE id = 1').fetchone()[0]
+                conn.execute('INSERT INTO entry (body) VALUES (?)', ('x' * 200,))
+                conn.execute('UPDATE counter SET value = ? WHERE id = 1', (value + 1,))
+                conn.execute('COMMIT')
+                writes += 1
+            else:
+                conn.execute('SELECT COUNT(*), MAX(id) FROM entry WHERE id > ?', (rng.randrange(1000),)).fetchone()
+                reads += 1
+        except sqlite3.OperationalError:
+            errors += 1
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+    conn.close()
+    return reads, writes, errors
+
+
+class Command(BaseCommand):
+    help = "Compare concurrent read/write throughput of SQLite with default settings and with SQLITE_PRAGMAS"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Processes hitting the database at once')
+        parser.add_argument('--seconds', type=float, default=5.0, help='Run time per mode')
+        parser.add_argument('--writes', type=float, default=0.2, help='Share of operations that write')
+
+    def handle(self, *args, workers, seconds, writes, **options):
+        path = os.path.join(tempfile.gettempdir(), 'learnit_benchmark.sqlite3')
+        self.stdout.write(f"{'mode':<8} {'reads/s':>10} {'writes/s':>10} {'errors':>8}")
+        for mode, pragmas, begin, timeout in modes():
+            prepare(path)
+            with Pool(workers) as pool:
+                results = pool.starmap(work, [(path, pragmas, begin, timeout, seconds, writes, seed) for seed in range(workers)])
+            reads, written, errors = (sum(column) for column in zip(*results))
+            self.stdout.write(f"{mode:<8} {reads / seconds:>10.0f} {written / seconds:>10.0f} {errors:>8}")
+        prepare(path)
+        os.remove(path)
+        self.stdout.write(self.style.SUCCESS("Benchmark done."))
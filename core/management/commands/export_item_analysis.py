@@ -0,0 +1,46 @@
+import csv
+from django.core.management.base import BaseCommand, CommandError
+from core import quizzes
+from core.models import Quiz
+
+COLUMNS = (
+    'question_id', 'question', 'attempts', 'difficulty', 'discrimination',
+    'answer_id', 'answer', 'is_correct', 'chosen', 'share',
+)
+
+
+def _number(value):
+    return '' if value is None else f'{value:.4f}'
+
+
+class Command(BaseCommand):
+    help = "Export a quiz's item analysis as CSV, one row per answer"
+
+    def add_arguments(self, parser):
+        parser.add_argument('quiz', type=int)
+        parser.add_argument('--output', help='File to write, standard output by default')
+
+    def handle(self, quiz, output=None, **options):
+        if not Quiz.objects.filter(pk=quiz).exists():
+            raise CommandError("No such quiz.")
+        try:
+            stream = open(output, 'w', newline='', encoding='utf-8') if output else self.stdout
+        except OSError as error:
+            raise CommandError(error)
+        writer = csv.writer(stream)
+        writer.writerow(COLUMNS)
+        for item in quizzes.item_analysis(quiz):
+            question = item['question']
+            for answer in item['answers'] or [None]:
+                writer.writerow([
+                    question.id, question.question_text, item['attempts'],
+                    _number(item['difficulty']), _number(item['discrimination']),
+                    *(
+                        (answer['answer'].id, answer['answer'].answer_text, answer['answer'].is_correct,
+                         answer['chosen'], _number(answer['share']))
+                        if answer else ('', '', '', '', '')
+                    ),
+                ])
+        if output:
+            stream.close()
+            self.stdout.write(self.style.SUCCESS(f"Wrote the item analysis to {output}."))
@@ -0,0 +1,33 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Quiz
+from core.quizzes import grade_many
+
+
+class Command(BaseCommand):
+    help = "Grade a JSON Lines file of quiz submissions: one {\"user\": id, \"responses\": {question: answers}} per line"
+
+    def add_arguments(self, parser):
+        parser.add_argument('quiz', type=int)
+        parser.add_argument('path')
+
+    def handle(self, quiz, path, **options):
+        if not Quiz.objects.filter(pk=quiz).exists():
+            raise CommandError("No such quiz.")
+
+        def submissions(lines):
+            for number, line in enumerate(lines, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                    yield int(row['user']), row.get('responses') or {}
+                except (ValueError, KeyError, TypeError):
+                    self.stderr.write(f"Line {number}: not a submission, skipped")
+
+        try:
+            with open(path, encoding='utf-8') as lines:
+                graded = grade_many(quiz, submissions(lines))
+        except OSError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(f"Graded {graded} submissions."))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Track
+from core.roster import BATCH_SIZE, RosterFormatError, import_roster
+
+
+class Command(BaseCommand):
+    help = "Create student accounts from a CSV/XLSX roster, optionally enrolling them"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--course', type=int, action='append', default=[], help='Course id to enroll in (repeatable)')
+        parser.add_argument('--track', type=int, help='Track id to enroll in')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, path, course, track, batch_size, **options):
+        if track is not None:
+            track = Track.objects.filter(pk=track).first()
+            if track is None:
+                raise CommandError("No such track.")
+        try:
+            with open(path, 'rb') as roster:
+                report = import_roster(roster, path, course, track, batch_size=batch_size)
+        except (OSError, RosterFormatError) as error:
+            raise CommandError(error)
+
+        for line, message in report.errors:
+            self.stderr.write(f"Line {line}: {message}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{report.created} students created, {report.existing} already registered, "
+            f"{report.enrolled} enrollments added, {report.error_count} rows rejected."
+        ))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from core.models import Installment
+
+
+class Command(BaseCommand):
+    help = "Mark pending installments past their due date as overdue (run daily)"
+
+    def handle(self, *args, **options):
+        updated = Installment.objects.mark_overdue()
+        self.stdout.write(self.style.SUCCESS(f"Marked {updated} installments overdue."))
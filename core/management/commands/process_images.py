@@ -0,0 +1,25 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from core import images
+
+
+class Command(BaseCommand):
+    help = "Hash images without a digest and render any missing thumbnails"
+
+    def handle(self, *args, **options):
+        rendered = 0
+        for spec in images.IMAGE_SPECS:
+            queryset = spec.model.objects.exclude(**{spec.field: ''}).exclude(**{f'{spec.field}__isnull': True})
+            for pk, name, digest in queryset.values_list('pk', spec.field, spec.digest_field).iterator():
+                if not digest:
+                    instance = spec.model(pk=pk, **{spec.field: name})
+                    try:
+                        digest = images.file_digest(getattr(instance, spec.field))
+                    except OSError:
+                        self.stderr.write(f"Missing file {name}")
+                        continue
+                    spec.model.objects.filter(pk=pk).update(**{spec.digest_field: digest})
+                if not default_storage.exists(spec.rendition_name(digest)):
+                    images.render_thumbnail(spec, name, digest)
+                    rendered += 1
+        self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} thumbnails."))
@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from core import payments
+
+
+class Command(BaseCommand):
+    help = "Apply received payment gateway callbacks, retrying failed ones with backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep polling instead of exiting when the queue is empty')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds between polls with --loop')
+
+    def handle(self, *args, loop, interval, **options):
+        total = 0
+        while True:
+            applied = payments.process_due()
+            total += applied
+            if applied == payments.BATCH_SIZE:
+                continue  # More may be waiting
+            if not loop:
+                break
+            time.sleep(interval)
+        self.stdout.write(self.style.SUCCESS(f"Applied {total} payment events."))
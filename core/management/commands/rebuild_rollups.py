@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from core import rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily business dashboard rollups from payments, installments and enrollments"
+
+    def handle(self, *args, **options):
+        rows = rollups.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} daily rollup rows."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from core import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index for courses and tracks"
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            raise CommandError("The search index needs SQLite FTS5.")
+        with transaction.atomic():
+            total = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} documents."))
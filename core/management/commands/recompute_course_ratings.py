@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum, Q
+from core.models import Course, CourseReview, RATING_STARS
+
+
+class Command(BaseCommand):
+    help = "Recompute every course's rating count, sum, average and histogram from its reviews"
+
+    def handle(self, *args, **options):
+        histogram = {f'rating_{star}': Count('id', filter=Q(rating=star)) for star in RATING_STARS}
+        rows = (
+            CourseReview.objects.filter(rating__in=RATING_STARS)
+            .values('course_id')
+            .annotate(rating_count=Count('id'), rating_sum=Sum('rating'), **histogram)
+        )
+        fields = ['rating_count', 'rating_sum', 'rating_average', *histogram]
+
+        with transaction.atomic():
+            Course.objects.update(**{field: 0 for field in fields})
+            courses = []
+            for row in rows.iterator():
+                course = Course(pk=row.pop('course_id'), **row)
+                course.rating_average = course.rating_sum / course.rating_count
+                courses.append(course)
+            Course.objects.bulk_update(courses, fields, batch_size=500)
+
+        self.stdout.write(self.style.SUCCESS(f"Recomputed ratings for {len(courses)} reviewed courses."))
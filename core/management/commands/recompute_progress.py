@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from core import progress
+
+
+class Command(BaseCommand):
+    help = "Recount lesson totals, completed lessons and progress for every enrollment"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, action='append', help='Limit to this course id (repeatable)')
+
+    def handle(self, *args, **options):
+        updated = progress.recompute(options['course'])
+        self.stdout.write(self.style.SUCCESS(f"Recomputed progress for {updated} enrollments."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from core import quizzes
+from core.models import Quiz
+
+
+class Command(BaseCommand):
+    help = "Rebuild per-question and per-answer item counters from the stored quiz attempts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quiz', type=int, action='append', help='Limit to this quiz id (repeatable)')
+
+    def handle(self, *args, **options):
+        quiz_ids = options['quiz'] or Quiz.objects.values_list('id', flat=True)
+        counted = sum(quizzes.recompute_item_stats(quiz_id) for quiz_id in quiz_ids)
+        self.stdout.write(self.style.SUCCESS(f"Recounted {counted} quiz attempts."))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from core.models import CourseGroup, Enrollment
+
+
+class Command(BaseCommand):
+    help = "Recount every course group's taken seats from its enrollments"
+
+    def handle(self, *args, **options):
+        enrolled = (
+            Enrollment.objects.filter(group_id=OuterRef('pk'))
+            .order_by().values('group_id').annotate(total=Count('id')).values('total')
+        )
+        try:
+            with transaction.atomic():
+                updated = CourseGroup.objects.update(seats_taken=Coalesce(Subquery(enrolled, output_field=IntegerField()), 0))
+        except IntegrityError:
+            raise CommandError("Some groups hold more students than their capacity; raise their capacity first.")
+
+        self.stdout.write(self.style.SUCCESS(f"Recounted seats for {updated} groups."))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from core.recaptcha import stub_server, stub_url
+
+
+class Command(BaseCommand):
+    help = "Serve a local stand-in for Google's reCAPTCHA siteverify endpoint, for load tests"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+
+    def handle(self, *args, host, port, **options):
+        server = stub_server(host, port)
+        self.stdout.write(self.style.SUCCESS(
+            f"Accepting any token not starting with 'invalid'. Set RECAPTCHA_VERIFY_URL={stub_url(server)}"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:20
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_seats(apps, schema_editor):
+    CourseGroup = apps.get_model('core', 'CourseGroup')
+    Enrollment = apps.get_model('core', 'Enrollment')
+    for row in Enrollment.objects.values('group_id').annotate(total=Count('id')):
+        CourseGroup.objects.filter(pk=row['group_id']).update(seats_taken=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_image_digests'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coursegroup',
+            name='capacity',
+            field=models.PositiveIntegerField(blank=True, help_text='Maximum number of students, empty for unlimited', null=True),
+        ),
+        migrations.AddField(
+            model_name='coursegroup',
+            name='seats_taken',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_seats, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='coursegroup',
+            index=models.Index(fields=['course', 'start_date', 'id'], name='group_course_start_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='coursegroup',
+            constraint=models.CheckConstraint(condition=models.Q(('capacity__isnull', True), ('seats_taken__lte', models.F('capacity')), _connector='OR'), name='group_seats_within_capacity'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_lessons(apps, schema_editor):
+    Course = apps.get_model('core', 'Course')
+    CourseLesson = apps.get_model('core', 'CourseLesson')
+    for row in CourseLesson.objects.values('section__course').annotate(total=Count('id')):
+        Course.objects.filter(pk=row['section__course']).update(lesson_count=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_course_group_capacity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='lesson_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='enrollment',
+            name='completed_lessons',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='LessonCompletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('completed_at', models.DateTimeField(auto_now_add=True)),
+                ('enrollment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='completions', to='core.enrollment')),
+                ('lesson', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='completions', to='core.courselesson')),
+            ],
+            options={
+                'unique_together': {('enrollment', 'lesson')},
+            },
+        ),
+        migrations.RunPython(count_lessons, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_installment_status_due_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCourseStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('enrollments', models.IntegerField(default=0)),
+                ('payments', models.IntegerField(default=0, help_text='Completed payments created that day')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, help_text='Amount of completed payments created that day', max_digits=14)),
+                ('refunds', models.DecimalField(decimal_places=2, default=0, help_text='Amount of refunded payments created that day', max_digits=14)),
+                ('installments_due', models.DecimalField(decimal_places=2, default=0, help_text='Installments falling due that day', max_digits=14)),
+                ('installments_collected', models.DecimalField(decimal_places=2, default=0, help_text='Installments paid that day', max_digits=14)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='core.course')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily course stats',
+                'unique_together': {('day', 'course')},
+            },
+        ),
+    ]
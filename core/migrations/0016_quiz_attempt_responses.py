@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_payment_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizattempt',
+            name='responses',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='quizattempt',
+            name='score',
+            field=models.IntegerField(help_text='Percentage of questions answered correctly'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+COLUMNS = {
+    # Matching runs on the normalized columns; snippets are cut from the text as written
+    'forward': "title, body, extra, title_text UNINDEXED, body_text UNINDEXED, extra_text UNINDEXED",
+    'backward': "title, body, extra",
+}
+COPIED = {
+    # Rows indexed before this migration only have the normalized text; rebuild_search_index restores the rest
+    'forward': ("title, body, extra, title_text, body_text, extra_text", "title, body, extra, title, body, extra"),
+    'backward': ("title, body, extra", "title, body, extra"),
+}
+
+
+def recreate_search_index(direction):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        schema_editor.execute(f"""
+            CREATE VIRTUAL TABLE core_search_index_new USING fts5(
+                {COLUMNS[direction]},
+                tokenize = 'unicode61 remove_diacritics 2',
+                prefix = '2 3'
+            )
+        """)
+        schema_editor.execute("INSERT INTO core_search_index_new(core_search_index_new, rank) VALUES ('rank', 'bm25(10.0, 4.0, 1.0)')")
+        columns, values = COPIED[direction]
+        schema_editor.execute(f"INSERT INTO core_search_index_new(rowid, {columns}) SELECT rowid, {values} FROM core_search_index")
+        schema_editor.execute("DROP TABLE core_search_index")
+        schema_editor.execute("ALTER TABLE core_search_index_new RENAME TO core_search_index")
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_course_rating_not_editable'),
+    ]
+
+    operations = [
+        migrations.RunPython(recreate_search_index('forward'), recreate_search_index('backward')),
+    ]
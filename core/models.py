@@ -1,8 +1,14 @@
-from django.db import models
-from django.db.models import Avg
+from django.conf import settings
+from django.utils import timezone
+from django.db import models, transaction
+from django.db.models import F, Q, Case, When, Value
+from django.db.models.functions import Cast, Coalesce, Least, Round
+from django.db.models.lookups import GreaterThan
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, MaxValueValidator
-from datetime import timedelta, datetime
+from django.core.exceptions import ValidationError
+from datetime import timedelta
+from decimal import Decimal
 
 
 
@@ -56,6 +62,7 @@ class User(AbstractUser):
     ]
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default="student")
     profile_picture = models.ImageField(upload_to='profile_pics/', blank=True, null=True)
+    profile_picture_digest = models.CharField(max_length=64, blank=True, default='', editable=False, db_index=True) # SHA-256 of the file, see core.images
     headline = models.CharField(max_length=100, blank=True, null=True)
     phone1 = models.CharField(max_length=15, blank=True, null=True)
     phone2 = models.CharField(max_length=15, blank=True, null=True)
@@ -85,6 +92,14 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored role so the role-change signals need no extra query
+        if 'role' in instance.__dict__:
+            instance._loaded_role = instance.__dict__['role']
+        return instance
+
 class StudentProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, limit_choices_to={'role': 'student'})
     rate = models.PositiveSmallIntegerField(default=1) # later for recruitment in need talents section
@@ -116,6 +131,7 @@ class Track(models.Model):
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
     image = models.ImageField(upload_to="track_images/", null=True, blank=True)
+    image_digest = models.CharField(max_length=64, blank=True, default='', editable=False, db_index=True) # SHA-256 of the file, see core.images
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, null=True, blank=True) # Website Price / Each Course Group has its own prices
     discount = models.DecimalField(
         max_digits=5, 
@@ -125,7 +141,19 @@ class Track(models.Model):
         default=0,
         null=True, blank=True
     )
+    # Price after discount, computed and indexed by the database
+    final_price = models.GeneratedField(
+        expression=Round(Coalesce('price', 0) * (100 - Coalesce('discount', 0)) / 100, 2),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        db_persist=True,
+    )
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, blank=True, null=True) # Also touched when its FAQs or course list change
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['final_price', 'id'], name='track_final_price_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -143,13 +171,63 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
-# Resize image before upload
-from PIL import Image
-from io import BytesIO
-from django.core.files import File
+class CourseQuerySet(models.QuerySet):
+    def published(self):
+        return self.filter(status='published')
+
+    def with_base_price(self):
+        """
+        Annotate base_price: final_price converted to settings.BASE_CURRENCY
+        with the rates in settings.CURRENCY_RATES, so mixed-currency catalogs
+        can be filtered and sorted in one query.
+        """
+        rates = [When(currency=code, then=Value(rate)) for code, rate in settings.CURRENCY_RATES.items()]
+        return self.annotate(
+            base_price=Round(
+                F('final_price') * Case(*rates, default=Value(1), output_field=models.DecimalField()),
+                2,
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            )
+        )
+
+    def for_listing(self):
+        # Cards only need the title, thumbnail and badges; skip the large text columns
+        return self.defer('description', 'excerpt')
+
+    def with_detail(self):
+        """Load the whole course graph used by the course page in a fixed number of queries."""
+        return self.select_related('category').prefetch_related(
+            models.Prefetch('outcomes', queryset=CourseLearningOutcome.objects.order_by('position', 'id')),
+            models.Prefetch('requirements', queryset=CourseRequirement.objects.order_by('position', 'id')),
+            models.Prefetch('syllabuses', queryset=CourseSyllabus.objects.order_by('position', 'id')),
+            models.Prefetch(
+                'coursesection_set',
+                queryset=CourseSection.objects.order_by('position', 'id').prefetch_related(
+                    models.Prefetch('courselesson_set', queryset=CourseLesson.objects.order_by('position', 'id'))
+                ),
+            ),
+            models.Prefetch('coursefaq_set', queryset=CourseFAQ.objects.order_by('position', 'id')),
+            models.Prefetch('groups', queryset=CourseGroup.objects.select_related('instructor').order_by('start_date', 'id')),
+        )
+
+# Models with counters written only by UPDATE ... F() statements (signals, services)
+class MaintainedFields:
+    MAINTAINED_FIELDS = ()
+
+    def save(self, *args, **kwargs):
+        # A full save of an existing row leaves the counters alone, so a stale
+        # instance (admin form, shell) never overwrites them
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            skipped = {*self.MAINTAINED_FIELDS, *self.get_deferred_fields()}
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in skipped and field.attname not in skipped
+            ]
+        super().save(*args, **kwargs)
+
 
 # Course Model
-class Course(models.Model):
+class Course(MaintainedFields, models.Model):
     LEVEL_CHOICES = [
         ('beginner', 'Beginner'),
         ('intermediate', 'Intermediate'),
@@ -179,47 +257,62 @@ class Course(models.Model):
         help_text="Enter discount percentage (0 to 100)",
         default=0
     )
+    # Price after discount, computed and indexed by the database
+    final_price = models.GeneratedField(
+        expression=Round(F('price') * (100 - F('discount')) / 100, 2),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        db_persist=True,
+    )
     tracks = models.ManyToManyField(Track,  blank=True, related_name='courses')
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
     students = models.ManyToManyField(User, related_name='courses', limit_choices_to={'role':'student'}, blank=True)
     thumbnail = models.ImageField(upload_to='course_thumbnails/', blank=True, null=True)
+    thumbnail_digest = models.CharField(max_length=64, blank=True, default='', editable=False, db_index=True) # SHA-256 of the file, see core.images
     duration = models.PositiveIntegerField(help_text='Duration in minutes')
     level = models.CharField(max_length=20, choices=LEVEL_CHOICES)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
     countdown_date = models.DateField(null=True, blank=True) # in advertising on landingpage
+    # Review aggregates, maintained by CourseReview signals (see rating_updates)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_average = models.FloatField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+    lesson_count = models.PositiveIntegerField(default=0, editable=False) # Maintained by CourseLesson signals, see core.progress
     featured = models.BooleanField(default=0) # Badge on course card
     best_seller = models.BooleanField(default=0) # Badge on course card
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
-
-    # Handle thumbnail image before save
-    def save(self, *args, **kwargs):
-        if self.thumbnail:
-            img = Image.open(self.thumbnail)
+    updated_at = models.DateTimeField(auto_now=True) # Also touched when outcomes, syllabus, sections, FAQs ... change
 
-            # Force resize (will stretch if needed)
-            img = img.resize((410, 378), Image.Resampling.LANCZOS)
-
-            # Convert RGBA to RGB to support JPEG
-            if img.mode in ("RGBA", "P"):
-                img = img.convert("RGB")
-
-            # Save resized image to BytesIO
-            thumb_io = BytesIO()
-            img_format = img.format or 'JPEG'  # Default to JPEG if format is None
-            img.save(thumb_io, format=img_format)
-
-            # Replace the file in the model
-            self.thumbnail.save(self.thumbnail.name, File(thumb_io), save=False)
-
-        super().save(*args, **kwargs)
+    objects = CourseQuerySet.as_manager()
 
+    MAINTAINED_FIELDS = (
+        'rating_count', 'rating_sum', 'rating_average', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5',
+        'lesson_count',
+    )
 
+    class Meta:
+        indexes = [
+            # Catalog listings: newest first, filtered by status plus one optional facet
+            models.Index(fields=['status', 'id'], name='course_status_id_idx'),
+            models.Index(fields=['status', 'category', 'id'], name='course_status_category_idx'),
+            models.Index(fields=['status', 'level', 'id'], name='course_status_level_idx'),
+            models.Index(fields=['status', 'currency', 'id'], name='course_currency_id_idx'),
+            models.Index(fields=['status', 'rating_average', 'id'], name='course_status_rating_idx'),
+            models.Index(fields=['status', 'final_price', 'id'], name='course_status_final_price_idx'),
+            models.Index(fields=['status', 'currency', 'final_price', 'id'], name='course_currency_final_idx'),
+        ]
 
     @property
     def average_rating(self):
-        avg_rating = self.reviews.aggregate(avg_score=Avg('score'))['avg_score']
-        return round(avg_rating, 1) if avg_rating else 0  # Round to 1 decimal place
+        return round(self.rating_average, 1)  # Round to 1 decimal place
+
+    @property
+    def rating_histogram(self):
+        return {star: getattr(self, f'rating_{star}') for star in RATING_STARS}
 
     def discounted_price(self):
         """Calculate the price after discount."""
@@ -312,17 +405,43 @@ class CourseFAQ(models.Model):
 #         return f"{self.track.title} - {self.start_date}"
 
 # Group for each single course -- start new course round
-class CourseGroup(models.Model):
+class CourseGroup(MaintainedFields, models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name="groups")
     instructor = models.ForeignKey(User, on_delete=models.CASCADE, limit_choices_to={'role': 'instructor'}, related_name='instructors', null=True, blank=True)
     students = models.ManyToManyField(User, related_name='students', limit_choices_to={'role': 'student'})
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, null=True, blank=True)
     start_date = models.DateField()
     end_date = models.DateField()
+    capacity = models.PositiveIntegerField(null=True, blank=True, help_text='Maximum number of students, empty for unlimited')
+    # Maintained by core.enrollment with conditional UPDATEs, never saved from an instance
+    seats_taken = models.PositiveIntegerField(default=0, editable=False)
+
+    MAINTAINED_FIELDS = ('seats_taken',)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['course', 'start_date', 'id'], name='group_course_start_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(capacity__isnull=True) | models.Q(seats_taken__lte=F('capacity')),
+                name='group_seats_within_capacity',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.course.title} - {self.start_date} - {self.instructor.first_name} {self.instructor.last_name}"
 
+    def clean(self):
+        if self.capacity is not None and self.capacity < self.seats_taken:
+            raise ValidationError({'capacity': f'{self.seats_taken} seats are already taken.'})
+
+    @property
+    def seats_left(self):
+        if self.capacity is None:
+            return None
+        return max(self.capacity - self.seats_taken, 0)
+
 # Full Track Enrollments Model
 class TrackEnrollment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, limit_choices_to={'role': 'student'})
@@ -337,21 +456,38 @@ class TrackEnrollment(models.Model):
         return f"{self.user.username} - {self.track.title}"
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        for course in self.track.courses.all():
-            # Pick any available group (or skip if none)
-            course_group = CourseGroup.objects.filter(course=course).first()
-            if course_group:
-                Enrollment.objects.get_or_create(user=self.user, course=course, group=course_group)
+        from .enrollment import enroll_in_courses
+        # Enroll in every course of the track, or in none of them
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            enroll_in_courses([self.user_id], self.track.courses.values_list('id', flat=True))
+
 
 
+# Rows counted in the business dashboard rollups (DailyCourseStats)
+class RollupTracked:
+    ROLLUP_FIELDS = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what is counted in the rollups so that saves can apply a delta;
+        # if any field is deferred, core.rollups reads the stored values instead
+        if all(field in instance.__dict__ for field in cls.ROLLUP_FIELDS):
+            instance._rollup_values = {field: instance.__dict__[field] for field in cls.ROLLUP_FIELDS}
+        return instance
+
 
 # Enrollments Model (Course)
-class Enrollment(models.Model):
+class Enrollment(RollupTracked, MaintainedFields, models.Model):
+    ROLLUP_FIELDS = ('course_id', 'enrolled_at')
+    MAINTAINED_FIELDS = ('completed_lessons', 'progress')  # Moved by core.progress
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, limit_choices_to={'role': 'student'})
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
     group = models.ForeignKey(CourseGroup, on_delete=models.CASCADE)
     progress = models.DecimalField(max_digits=5, decimal_places=2, default=0.00, help_text='Percentage completion', null=True, blank=True)
+    completed_lessons = models.PositiveIntegerField(default=0, editable=False) # Counter behind progress, see core.progress
     enrolled_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -360,8 +496,34 @@ class Enrollment(models.Model):
     def __str__(self):
         return f"{self.course.title} - {self.user.first_name} {self.user.last_name}"
 
+
+def progress_expression(completed, total):
+    """SQL for a progress percentage (0-100, two decimals) from completed and total lesson counts."""
+    percent = Cast(
+        models.ExpressionWrapper(completed * Value(100.0) / total, output_field=models.FloatField()),
+        models.DecimalField(max_digits=9, decimal_places=4),
+    )
+    return Case(
+        When(GreaterThan(total, 0), then=Least(Round(percent, 2), Value(Decimal('100')))),
+        default=Value(Decimal('0')),
+        output_field=models.DecimalField(max_digits=5, decimal_places=2),
+    )
+
+
+# Lessons a student has finished, one row per enrollment and lesson
+class LessonCompletion(models.Model):
+    enrollment = models.ForeignKey(Enrollment, on_delete=models.CASCADE, related_name='completions')
+    lesson = models.ForeignKey(CourseLesson, on_delete=models.CASCADE, related_name='completions')
+    completed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('enrollment', 'lesson')
+
+    def __str__(self):
+        return f"{self.enrollment_id} - {self.lesson_id}"
+
 # Payments Model
-class Payment(models.Model):
+class Payment(RollupTracked, models.Model):
     PAYMENT_METHOD_CHOICES = [
         ('credit_card', 'Credit Card'),
         ('paypal', 'PayPal'),
@@ -392,6 +554,8 @@ class Payment(models.Model):
     paid_installments = models.PositiveIntegerField(default=0)
     installment_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
 
+    ROLLUP_FIELDS = ('course_id', 'status', 'amount', 'created_at')
+
     
     def __str__(self):
         return f"{self.course.title} - {self.user.first_name} {self.user.last_name} - {self.payment_type} - {self.amount}"
@@ -401,20 +565,37 @@ class Payment(models.Model):
         return self.paid_installments == self.total_installments
 
     def create_installments(self):
-        # Create installments based on the total installments and the installment amount
-        for i in range(self.total_installments):
-            due_date = self.created_at.date() + timedelta(days=30*(i+3))  # Installment due date set every 3 months
-            Installment.objects.create(
+        from .rollups import record_created
+        # Create installments based on the total installments and the installment amount, in one INSERT
+        start = timezone.localdate(self.created_at)
+        installments = Installment.objects.bulk_create([
+            Installment(
                 payment=self,
                 installment_number=i+1,
                 amount=self.installment_amount,
-                due_date=due_date
+                due_date=start + timedelta(days=30*(i+3)),  # First one due after 3 months, then monthly
             )
+            for i in range(self.total_installments)
+        ])
+        record_created(Installment, installments)  # bulk_create sends no signals
+        return installments
 
     
 
+class InstallmentQuerySet(models.QuerySet):
+    def overdue(self, today=None):
+        """Unpaid installments past their due date, whether or not the sweep has marked them yet."""
+        today = today or timezone.localdate()
+        return self.filter(Q(status='overdue') | Q(status='pending', due_date__lt=today))
+
+    def mark_overdue(self, today=None):
+        """Flag pending installments past their due date, in one UPDATE over (status, due_date)."""
+        today = today or timezone.localdate()
+        return self.filter(status='pending', due_date__lt=today).update(status='overdue')
+
+
 # CourseGroup Installment 
-class Installment(models.Model):
+class Installment(RollupTracked, models.Model):
     INSTALLMENT_STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('paid', 'Paid'),
@@ -427,24 +608,154 @@ class Installment(models.Model):
     status = models.CharField(max_length=20, choices=INSTALLMENT_STATUS_CHOICES, default='pending')
     paid_at = models.DateTimeField(null=True, blank=True)
 
+    objects = InstallmentQuerySet.as_manager()
+
+    ROLLUP_FIELDS = ('payment_id', 'status', 'amount', 'due_date', 'paid_at')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'due_date'], name='installment_status_due_idx'),
+        ]
+
     def __str__(self):
         return f"User: {self.payment.user.first_name} {self.payment.user.last_name} - Installment {self.installment_number} for {self.payment.course.title} - Amount: {self.amount}"
 
     def is_overdue(self):
-        return self.due_date < datetime.today().date() and self.status != 'paid'
+        return self.status != 'paid' and self.due_date < timezone.localdate()
+
+
+# Payment gateway callbacks, stored as received and applied by core.payments
+class PaymentEvent(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+    gateway = models.CharField(max_length=20, default='paymob')
+    transaction_id = models.CharField(max_length=255, unique=True) # Gateway retries of the same transaction are dropped
+    reference = models.CharField(max_length=255, blank=True, default='') # Our merchant order id, events of one reference are applied in order
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at', 'id'], name='payment_event_queue_idx'),
+            models.Index(fields=['reference', 'id'], name='payment_event_reference_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.gateway} {self.transaction_id} ({self.status})"
+
+
+# Side effects of a form save (staff emails, CRM pushes), written in the same
+# transaction and delivered later by core.outbox
+class OutboxMessage(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+    topic = models.CharField(max_length=50) # Picks the handler, see core.outbox.HANDLERS
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim = models.CharField(max_length=32, blank=True, default='') # Worker batch currently holding the message
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at', 'id'], name='outbox_queue_idx'),
+            models.Index(fields=['claim'], name='outbox_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} #{self.pk} ({self.status})"
+
+
+# Business dashboard rollups, one row per course and day, kept current by core.rollups
+class DailyCourseStats(models.Model):
+    day = models.DateField()
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='daily_stats')
+    enrollments = models.IntegerField(default=0)
+    payments = models.IntegerField(default=0, help_text='Completed payments created that day')
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text='Amount of completed payments created that day')
+    refunds = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text='Amount of refunded payments created that day')
+    installments_due = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text='Installments falling due that day')
+    installments_collected = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text='Installments paid that day')
+
+    class Meta:
+        unique_together = ('day', 'course')
+        verbose_name_plural = 'Daily course stats'
+
+    def __str__(self):
+        return f"{self.course_id} - {self.day}"
 
 
 # Course Reviews Model
+RATING_STARS = range(1, 6)
+
+def rating_updates(added=None, removed=None):
+    """
+    Course.objects.update() kwargs that add and/or remove one rating from a
+    course's aggregates in a single statement. Ratings outside 1-5 are not counted.
+    """
+    added = added if added in RATING_STARS else None
+    removed = removed if removed in RATING_STARS else None
+    count = (added is not None) - (removed is not None)
+    total = (added or 0) - (removed or 0)
+
+    updates = {}
+    for star, step in ((added, 1), (removed, -1)):
+        if star is not None:
+            field = f'rating_{star}'
+            updates[field] = updates.get(field, F(field)) + step
+    if not updates:
+        return {}
+
+    # SET expressions all see the old row, so the average is built from old values + delta
+    new_count = F('rating_count') + count
+    new_sum = F('rating_sum') + total
+    updates.update(
+        rating_count=new_count,
+        rating_sum=new_sum,
+        rating_average=Case(
+            When(rating_count=-count, then=Value(0.0)),
+            default=models.ExpressionWrapper(new_sum * 1.0 / new_count, output_field=models.FloatField()),
+            output_field=models.FloatField(),
+        ),
+    )
+    return updates
+
 class CourseReview(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
-    rating = models.PositiveIntegerField(default=0)
+    rating = models.PositiveIntegerField(default=0, validators=[MinValueValidator(1), MaxValueValidator(5)])
     review = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
         return f"{self.course.title} - {self.user.first_name} {self.user.last_name} - {self.rating}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what is counted in the course aggregates so edits can apply a delta
+        instance._loaded_rating = (instance.__dict__.get('course_id'), instance.__dict__.get('rating'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Course aggregates are updated by post_save, inside this transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 # Track Certificates Model
 class TrackCertificate(models.Model):
@@ -480,21 +791,54 @@ class Quiz(models.Model):
         verbose_name_plural = "Quizzes"
 
 # Quiz Question Model
-class QuizQuestion(models.Model):
+class QuizQuestion(MaintainedFields, models.Model):
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name="questions")
     question_text = models.TextField()
+    # Item analysis running sums, updated as attempts are graded (see core.quizzes)
+    attempt_count = models.PositiveIntegerField(default=0, editable=False)
+    correct_count = models.PositiveIntegerField(default=0, editable=False)
+    score_sum = models.BigIntegerField(default=0, editable=False) # Attempt scores
+    score_square_sum = models.BigIntegerField(default=0, editable=False)
+    correct_score_sum = models.BigIntegerField(default=0, editable=False) # Scores of attempts that got this question right
+
+    MAINTAINED_FIELDS = ('attempt_count', 'correct_count', 'score_sum', 'score_square_sum', 'correct_score_sum')
+
+    @property
+    def difficulty(self):
+        """Share of attempts answering correctly (the item's p-value), None before any attempt."""
+        if not self.attempt_count:
+            return None
+        return self.correct_count / self.attempt_count
+
+    @property
+    def discrimination(self):
+        """Point-biserial correlation between getting this question right and the attempt score."""
+        n, right = self.attempt_count, self.correct_count
+        if not n or right in (0, n):
+            return None
+        variance = self.score_square_sum / n - (self.score_sum / n) ** 2
+        if variance <= 0:
+            return None
+        mean_right = self.correct_score_sum / right
+        mean_wrong = (self.score_sum - self.correct_score_sum) / (n - right)
+        p = right / n
+        return (mean_right - mean_wrong) / variance ** 0.5 * (p * (1 - p)) ** 0.5
 
 # Quiz Answer Model
-class QuizAnswer(models.Model):
+class QuizAnswer(MaintainedFields, models.Model):
     question = models.ForeignKey(QuizQuestion, on_delete=models.CASCADE, related_name="answers")
     answer_text = models.CharField(max_length=255)
     is_correct = models.BooleanField(default=False)
+    chosen_count = models.PositiveIntegerField(default=0, editable=False) # Attempts that picked this answer
+
+    MAINTAINED_FIELDS = ('chosen_count',)
 
 # Quiz Attempt Model
 class QuizAttempt(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="quiz_attempts")
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name="attempts")
-    score = models.IntegerField()
+    score = models.IntegerField(help_text='Percentage of questions answered correctly')
+    responses = models.JSONField(default=dict, blank=True) # {question id: [chosen answer ids]}, see core.quizzes
     completed_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -513,6 +857,7 @@ class Event(models.Model):
     type = models.CharField(max_length=20, choices=TYPE_CHOICES)
     location = models.CharField(max_length=250, null=True, blank=True)
     thumbnail = models.ImageField(upload_to='events_photos/', blank=True, null=True)
+    thumbnail_digest = models.CharField(max_length=64, blank=True, default='', editable=False, db_index=True) # SHA-256 of the file, see core.images
     start_date = models.DateTimeField()
     end_date = models.DateTimeField()
     
@@ -0,0 +1,44 @@
+from django.core.cache import cache
+from .models import Track, Course, Category
+from .utils import get_cache_version
+
+NAVIGATION_CACHE = 'navigation'
+NAVIGATION_TIMEOUT = 60 * 60 * 24
+
+# (version, data) of the last navigation loaded by this process
+_local = (None, None)
+
+
+def build_navigation():
+    """Load only the columns the header and footer menus need."""
+    courses = list(Course.objects.order_by('id').values('id', 'title'))
+    titles = {course['id']: course for course in courses}
+
+    tracks = list(Track.objects.order_by('id').values('id', 'title'))
+    members = {track['id']: [] for track in tracks}
+    for track_id, course_id in Course.tracks.through.objects.order_by('track_id', 'course_id').values_list('track_id', 'course_id'):
+        members[track_id].append(titles[course_id])
+    for track in tracks:
+        track['courses'] = members[track['id']]
+
+    return {
+        'tracks': tracks,
+        'courses': courses,
+        'cats': list(Category.objects.order_by('id').values('id', 'name')),
+    }
+
+
+def get_navigation():
+    global _local
+    version = get_cache_version(NAVIGATION_CACHE)
+    local_version, data = _local
+    if local_version == version:
+        return data
+
+    key = f"{NAVIGATION_CACHE}:{version}"
+    data = cache.get(key)
+    if data is None:
+        data = build_navigation()
+        cache.set(key, data, NAVIGATION_TIMEOUT)
+    _local = (version, data)
+    return data
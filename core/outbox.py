@@ -0,0 +1,108 @@
+import logging
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+from .models import Contact, OutboxMessage, TalentRequest
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+RETRY_DELAY = 30  # Seconds before the first retry, doubled on every failure
+LEASE = 300  # Seconds a claimed batch is held before another worker may take it over
+
+
+def enqueue(topic, **payload):
+    """
+    Record a side effect to deliver later. Call it inside the transaction of
+    the change it reports, so both commit or neither does.
+    """
+    return OutboxMessage.objects.create(topic=topic, payload=payload)
+
+
+# Handlers turn a payload into the emails to send; an empty list means nothing to do
+def contact_received(payload):
+    contact = Contact.objects.filter(pk=payload['id']).first()
+    if contact is None or not settings.STAFF_NOTIFICATION_EMAILS:
+        return []
+    body = (
+        f"From: {contact.username} <{contact.email}>\nPhone: {contact.phone}\n"
+        f"Company: {contact.company_name}\n\n{contact.message}"
+    )
+    return [EmailMessage(
+        f"Contact message from {contact.username}", body,
+        to=settings.STAFF_NOTIFICATION_EMAILS, reply_to=[contact.email],
+    )]
+
+
+def talent_requested(payload):
+    talent = TalentRequest.objects.select_related('country').filter(pk=payload['id']).first()
+    if talent is None or not settings.STAFF_NOTIFICATION_EMAILS:
+        return []
+    body = (
+        f"From: {talent.user_name} <{talent.email}>\nPhone: {talent.phone}\n"
+        f"Company: {talent.company_name} ({talent.country or 'no country'})\n"
+        f"Position: {talent.position}\nSalary range: {talent.salary_range or '-'}\n\n{talent.job_description}"
+    )
+    return [EmailMessage(
+        f"Talent request: {talent.position} at {talent.company_name}", body,
+        to=settings.STAFF_NOTIFICATION_EMAILS, reply_to=[talent.email],
+    )]
+
+
+HANDLERS = {
+    'contact_received': contact_received,
+    'talent_requested': talent_requested,
+}
+
+
+def claim(limit=BATCH_SIZE, now=None):
+    """
+    Take up to limit due messages for this worker, oldest first, in one UPDATE.
+    A worker that dies mid-batch loses its claim after LEASE seconds.
+    """
+    now = now or timezone.now()
+    token = uuid.uuid4().hex
+    due = OutboxMessage.objects.filter(status='pending', next_attempt_at__lte=now).order_by('id').values('id')[:limit]
+    OutboxMessage.objects.filter(id__in=due, status='pending', next_attempt_at__lte=now).update(
+        claim=token, next_attempt_at=now + timedelta(seconds=LEASE),
+    )
+    return list(OutboxMessage.objects.filter(claim=token, status='pending').order_by('id'))
+
+
+def retry_later(message, error):
+    attempts = message.attempts + 1
+    updates = {'attempts': attempts, 'claim': '', 'last_error': f'{type(error).__name__}: {error}'}
+    if attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        updates['status'] = 'failed'
+        logger.error("Giving up on outbox message %s after %s attempts", message.pk, attempts)
+    else:
+        updates['next_attempt_at'] = timezone.now() + timedelta(seconds=RETRY_DELAY * 2 ** (attempts - 1))
+    OutboxMessage.objects.filter(pk=message.pk, claim=message.claim).update(**updates)
+
+
+def deliver(messages):
+    """
+    Send a claimed batch through one SMTP connection, opened on the first email
+    and reopened only after an error. Returns the number of messages delivered.
+    """
+    connection = get_connection()
+    delivered = []
+    try:
+        for message in messages:
+            try:
+                emails = HANDLERS[message.topic](message.payload)
+                if emails:
+                    connection.open()  # No-op while the connection is up
+                    connection.send_messages(emails)
+            except Exception as error:
+                logger.exception("Could not deliver outbox message %s", message.pk)
+                connection.close()  # Start the next message on a fresh connection
+                retry_later(message, error)
+            else:
+                delivered.append(message.pk)
+    finally:
+        connection.close()
+    OutboxMessage.objects.filter(id__in=delivered).update(status='sent', sent_at=timezone.now(), claim='', last_error='')
+    return len(delivered)
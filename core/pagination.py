@@ -0,0 +1,109 @@
+import base64
+import json
+from decimal import InvalidOperation
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import GeneratedField, Q
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination over a unique ordering, e.g. ('-id',) or ('final_price', 'id').
+
+    Pages are fetched with a WHERE on the last seen row instead of OFFSET, so
+    every page costs the same index range scan no matter how deep it is.
+    The last ordering field must be unique (normally the primary key).
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    def encode_cursor(self, obj):
+        values = [str(getattr(obj, name)) for name, _ in self.fields]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        except (TypeError, ValueError):
+            return None
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            return None
+        # Cursors come from the query string: anything that isn't a value of
+        # the ordering field means "start from the first page"
+        if not all(isinstance(value, str) for value in values):
+            return None
+        try:
+            return [self.field_value(name, value) for value, (name, _) in zip(values, self.fields)]
+        except (FieldDoesNotExist, ValidationError, InvalidOperation, TypeError, ValueError):
+            return None
+
+    def field_value(self, name, value):
+        field = self.queryset.model._meta.get_field(name)
+        if isinstance(field, GeneratedField):
+            field = field.output_field  # GeneratedField.to_python passes strings through
+        value = field.to_python(value)
+        field.run_validators(value)  # e.g. digits a DecimalField can't hold
+        return value
+
+    def seek(self, values, forward=True):
+        # Lexicographic "row comes after values": (a > x) OR (a = x AND b > y) ...
+        condition = Q()
+        for i, (name, descending) in enumerate(self.fields):
+            lookup = 'lt' if descending == forward else 'gt'
+            term = Q(**{f'{name}__{lookup}': values[i]})
+            for j, (previous, _) in enumerate(self.fields[:i]):
+                term &= Q(**{previous: values[j]})
+            condition |= term
+        return condition
+
+    def page(self, after=None, before=None):
+        after = self.decode_cursor(after) if after else None
+        before = self.decode_cursor(before) if before else None
+
+        if before is not None:
+            reverse = tuple(name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering)
+            rows = list(self.queryset.filter(self.seek(before, forward=False)).order_by(*reverse)[:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return KeysetPage(
+                rows,
+                next_cursor=self.encode_cursor(rows[-1]) if rows else None,
+                previous_cursor=self.encode_cursor(rows[0]) if rows and has_previous else None,
+            )
+
+        queryset = self.queryset
+        if after is not None:
+            queryset = queryset.filter(self.seek(after))
+        rows = list(queryset.order_by(*self.ordering)[:self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        return KeysetPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1]) if rows and has_next else None,
+            previous_cursor=self.encode_cursor(rows[0]) if rows and after is not None else None,
+        )
@@ -0,0 +1,183 @@
+import hashlib
+import hmac
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from .enrollment import CourseFull, enroll
+from .models import Payment, PaymentEvent
+
+logger = logging.getLogger(__name__)
+
+# Fields of a Paymob transaction covered by its HMAC, in signing order
+PAYMOB_HMAC_FIELDS = (
+    'amount_cents', 'created_at', 'currency', 'error_occured', 'has_parent_transaction', 'id',
+    'integration_id', 'is_3d_secure', 'is_auth', 'is_capture', 'is_refunded', 'is_standalone_payment',
+    'is_voided', 'order.id', 'owner', 'pending', 'source_data.pan', 'source_data.sub_type',
+    'source_data.type', 'success',
+)
+BATCH_SIZE = 100
+RETRY_DELAY = 30  # Seconds before the first retry, doubled on every failure
+
+
+class AmountMismatch(Exception):
+    """A successful transaction for a different amount than the one due; never applied."""
+
+
+def _lookup(data, path):
+    for key in path.split('.'):
+        data = data.get(key) if isinstance(data, dict) else None
+    return data
+
+
+def _signed_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return '' if value is None else str(value)
+
+
+def paymob_signature(transaction_data, secret=None):
+    message = ''.join(_signed_value(_lookup(transaction_data, field)) for field in PAYMOB_HMAC_FIELDS)
+    key = secret if secret is not None else settings.PAYMOB_HMAC_SECRET
+    return hmac.new(key.encode(), message.encode(), hashlib.sha512).hexdigest()
+
+
+def verify_paymob(transaction_data, signature):
+    if not settings.PAYMOB_HMAC_SECRET or not signature:
+        return False
+    return hmac.compare_digest(paymob_signature(transaction_data), signature.lower())
+
+
+def merchant_order_id(payment, installment=None):
+    """The reference to register a Paymob order with, so its callbacks find the payment."""
+    if installment is not None:
+        return f'{payment.pk}-{installment.installment_number}'
+    return str(payment.pk)
+
+
+def parse_reference(reference):
+    """(payment id, installment number or None) from a merchant order id."""
+    payment_id, _, number = reference.partition('-')
+    return int(payment_id), int(number) if number else None
+
+
+def receive(transaction_data, gateway='paymob'):
+    """
+    Store a verified callback in the inbox, in one INSERT. Gateway retries of a
+    transaction already received are dropped by the unique transaction_id.
+    """
+    PaymentEvent.objects.bulk_create([
+        PaymentEvent(
+            gateway=gateway,
+            transaction_id=str(transaction_data['id']),
+            reference=str(_lookup(transaction_data, 'order.merchant_order_id') or ''),
+            payload=transaction_data,
+        )
+    ], ignore_conflicts=True)
+
+
+def due_events(now=None):
+    """Pending events ready for an attempt, oldest first, at most one per reference."""
+    now = now or timezone.now()
+    earlier = PaymentEvent.objects.filter(reference=OuterRef('reference'), status='pending', id__lt=OuterRef('id'))
+    return PaymentEvent.objects.filter(status='pending', next_attempt_at__lte=now).filter(~Exists(earlier)).order_by('id')
+
+
+def enroll_student(payment):
+    try:
+        enroll(payment.student_id, payment.course_id)
+    except CourseFull:
+        logger.warning("Payment %s is complete but course %s has no free seat", payment.pk, payment.course_id)
+
+
+def check_amount(transaction_data, amount, currency, what):
+    expected = (int(amount * 100), currency)
+    paid = (transaction_data.get('amount_cents'), transaction_data.get('currency'))
+    if paid != expected:
+        raise AmountMismatch(
+            f"{what} is due {expected[1]} {expected[0]} cents, transaction {transaction_data.get('id')} paid {paid[1]} {paid[0]} cents"
+        )
+
+
+def apply(transaction_data, reference):
+    """
+    Update the payment (or installment) the transaction is for. Safe to call
+    twice. Raises AmountMismatch, leaving everything unpaid, when a successful
+    transaction is not for the amount due, in the course's currency.
+    """
+    payment_id, number = parse_reference(reference)
+    payment = Payment.objects.select_for_update().get(pk=payment_id)
+    paid = transaction_data.get('success') is True and not transaction_data.get('pending')
+
+    if transaction_data.get('is_refunded') or transaction_data.get('is_voided'):
+        if payment.status == 'completed':
+            payment.status = 'refunded'
+            payment.save(update_fields=['status'])
+        return
+
+    if number is None:
+        if paid and payment.status != 'completed':
+            check_amount(transaction_data, payment.amount, payment.course.currency, f'Payment {payment.pk}')
+            payment.status = 'completed'
+            payment.transaction_id = payment.transaction_id or str(transaction_data['id'])
+            payment.save(update_fields=['status', 'transaction_id'])
+            enroll_student(payment)
+        elif not paid and payment.status == 'pending':
+            payment.status = 'failed'
+            payment.save(update_fields=['status'])
+        return
+
+    installment = payment.installments.select_for_update().get(installment_number=number)
+    if not paid or installment.status == 'paid':
+        return
+    check_amount(transaction_data, installment.amount, payment.course.currency, f'Installment {number} of payment {payment.pk}')
+    installment.status = 'paid'
+    installment.paid_at = timezone.now()
+    installment.save(update_fields=['status', 'paid_at'])
+    payment.paid_installments += 1
+    if payment.is_completed():
+        payment.status = 'completed'
+    payment.save(update_fields=['paid_installments', 'status'])
+    if payment.paid_installments == 1:  # Access starts with the first installment
+        enroll_student(payment)
+
+
+def retry_later(event, error):
+    attempts = event.attempts + 1
+    updates = {'attempts': attempts, 'last_error': f'{type(error).__name__}: {error}'}
+    if isinstance(error, AmountMismatch):
+        updates['status'] = 'failed'  # Retrying can't change the amount; left for staff to review
+    elif attempts >= settings.PAYMENT_EVENT_MAX_ATTEMPTS:
+        updates['status'] = 'failed'
+        logger.error("Giving up on payment event %s after %s attempts", event.pk, attempts)
+    else:
+        updates['next_attempt_at'] = timezone.now() + timedelta(seconds=RETRY_DELAY * 2 ** (attempts - 1))
+    PaymentEvent.objects.filter(pk=event.pk, status='pending').update(**updates)
+
+
+def process(event):
+    """
+    Apply one event. The claim (pending -> processed) and the payment changes
+    commit together, so an event is applied exactly once even with several
+    workers, and a failure leaves it pending for a later attempt.
+    """
+    try:
+        with transaction.atomic():
+            claimed = PaymentEvent.objects.filter(pk=event.pk, status='pending', attempts=event.attempts).update(
+                status='processed', processed_at=timezone.now(), last_error='',
+            )
+            if not claimed:
+                return False
+            apply(event.payload, event.reference)
+    except Exception as error:
+        logger.exception("Could not apply payment event %s", event.pk)
+        retry_later(event, error)
+        return False
+    return True
+
+
+def process_due(limit=BATCH_SIZE):
+    """Work through up to limit due events; returns how many were applied."""
+    return sum(process(event) for event in due_events()[:limit])
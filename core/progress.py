@@ -0,0 +1,71 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from .models import Course, CourseLesson, Enrollment, LessonCompletion, progress_expression
+
+
+def course_lessons():
+    """Lesson total of the enrollment's course, for Enrollment updates."""
+    return Subquery(Course.objects.filter(pk=OuterRef('course_id')).values('lesson_count')[:1])
+
+
+def shift_progress(enrollments, step):
+    """Add step completed lessons to the enrollments and move progress along, in one UPDATE."""
+    completed = F('completed_lessons') + step
+    return enrollments.update(completed_lessons=completed, progress=progress_expression(completed, course_lessons()))
+
+
+def refresh_progress(enrollments):
+    """Recompute progress from the counters, e.g. after a course's lesson total changed."""
+    return enrollments.update(progress=progress_expression(F('completed_lessons'), course_lessons()))
+
+
+def complete_lesson(enrollment, lesson):
+    """
+    Record that a student finished a lesson of their course. Returns False if it
+    was already recorded. Progress moves by one lesson without recounting.
+    """
+    if lesson.section.course_id != enrollment.course_id:
+        raise ValueError("The lesson is not part of the enrolled course.")
+    try:
+        with transaction.atomic():
+            LessonCompletion.objects.create(enrollment_id=enrollment.pk, lesson_id=lesson.pk)
+            shift_progress(Enrollment.objects.filter(pk=enrollment.pk), 1)
+    except IntegrityError:
+        return False
+    return True
+
+
+def uncomplete_lesson(enrollment, lesson):
+    with transaction.atomic():
+        deleted, _ = LessonCompletion.objects.filter(enrollment_id=enrollment.pk, lesson_id=lesson.pk).delete()
+        if deleted:
+            shift_progress(Enrollment.objects.filter(pk=enrollment.pk), -1)
+    return bool(deleted)
+
+
+def recompute(course_ids=None):
+    """
+    Recount lesson totals, completed lessons and progress from scratch, for when
+    the curriculum changed without signals (bulk edits, lessons moved between
+    courses). Three set-based UPDATEs whatever the number of enrollments.
+    """
+    courses = Course.objects.all()
+    enrollments = Enrollment.objects.all()
+    if course_ids is not None:
+        courses = courses.filter(pk__in=course_ids)
+        enrollments = enrollments.filter(course_id__in=course_ids)
+
+    lessons = (
+        CourseLesson.objects.filter(section__course=OuterRef('pk'))
+        .order_by().values('section__course').annotate(total=Count('id')).values('total')
+    )
+    # Only completions of lessons that are still part of the course count
+    completed = (
+        LessonCompletion.objects.filter(enrollment=OuterRef('pk'), lesson__section__course=OuterRef('course_id'))
+        .order_by().values('enrollment').annotate(total=Count('id')).values('total')
+    )
+    with transaction.atomic():
+        courses.update(lesson_count=Coalesce(Subquery(lessons), 0))
+        enrollments.update(completed_lessons=Coalesce(Subquery(completed), 0))
+        return refresh_progress(enrollments)
@@ -0,0 +1,212 @@
+from collections import defaultdict
+from itertools import islice
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, FilteredRelation, Q, Value, When
+from .models import QuizAnswer, QuizAttempt, QuizQuestion
+from .utils import bump_cache_version, get_cache_version
+
+ANSWER_KEY_TIMEOUT = 24 * 3600
+BATCH_SIZE = 500
+# QuizQuestion counters, in the order item_deltas() lists them
+ITEM_FIELDS = QuizQuestion.MAINTAINED_FIELDS
+
+
+def quiz_cache(quiz_id):
+    return f'quiz:{quiz_id}'
+
+
+def invalidate_answer_key(quiz_id):
+    bump_cache_version(quiz_cache(quiz_id))
+
+
+def load_answer_key(quiz_id):
+    """{question_id: frozenset(correct answer ids)} for every question, in one query."""
+    rows = (
+        QuizQuestion.objects.filter(quiz_id=quiz_id)
+        .annotate(correct=FilteredRelation('answers', condition=Q(answers__is_correct=True)))
+        .values_list('id', 'correct__id')
+    )
+    key = {}
+    for question_id, answer_id in rows:
+        key.setdefault(question_id, set())
+        if answer_id is not None:
+            key[question_id].add(answer_id)
+    return {question_id: frozenset(answers) for question_id, answers in key.items()}
+
+
+def answer_key(quiz_id):
+    """The cached answer key, reloaded after its questions or answers change."""
+    cache_key = f'{quiz_cache(quiz_id)}:answer-key:{get_cache_version(quiz_cache(quiz_id))}'
+    key = cache.get(cache_key)
+    if key is None:
+        key = load_answer_key(quiz_id)
+        cache.set(cache_key, key, ANSWER_KEY_TIMEOUT)
+    return key
+
+
+def normalize(responses):
+    """{str(question id): sorted answer ids} from ids or lists of ids, as posted or uploaded."""
+    normalized = {}
+    for question_id, chosen in (responses or {}).items():
+        chosen = chosen if isinstance(chosen, (list, tuple, set)) else [chosen]
+        try:
+            normalized[str(int(question_id))] = sorted({int(answer_id) for answer_id in chosen if answer_id not in (None, '')})
+        except (TypeError, ValueError):
+            continue
+    return normalized
+
+
+def score(key, responses):
+    """Percentage of questions whose chosen answers are exactly the correct ones."""
+    if not key:
+        return 0
+    correct = sum(
+        1 for question_id, answers in key.items()
+        if answers and frozenset(responses.get(str(question_id), ())) == answers
+    )
+    return round(100 * correct / len(key))
+
+
+def item_deltas(key, attempts):
+    """
+    What graded attempts, as (responses, score) pairs, add to the item counters:
+    ({question_id: [deltas in ITEM_FIELDS order]}, {answer_id: times chosen}).
+    """
+    questions = defaultdict(lambda: [0] * len(ITEM_FIELDS))
+    answers = defaultdict(int)
+    for responses, attempt_score in attempts:
+        for question_id, correct in key.items():
+            chosen = responses.get(str(question_id), ())
+            counters = questions[question_id]
+            counters[0] += 1
+            counters[2] += attempt_score
+            counters[3] += attempt_score * attempt_score
+            if correct and frozenset(chosen) == correct:
+                counters[1] += 1
+                counters[4] += attempt_score
+            for answer_id in chosen:
+                answers[answer_id] += 1
+    return questions, answers
+
+
+def _increments(deltas):
+    """F(field) + the row's delta, as a CASE over the ids unless every row moves by the same amount."""
+    if len(set(deltas.values())) == 1:
+        return Value(next(iter(deltas.values())))
+    return Case(*(When(id=pk, then=Value(delta)) for pk, delta in deltas.items()), default=Value(0))
+
+
+def apply_item_deltas(questions, answers):
+    """Add the deltas to the counters with one UPDATE for the questions and one for the answers."""
+    if questions:
+        QuizQuestion.objects.filter(id__in=questions).update(**{
+            field: F(field) + _increments({pk: counters[i] for pk, counters in questions.items()})
+            for i, field in enumerate(ITEM_FIELDS)
+        })
+    answers = {pk: count for pk, count in answers.items() if count}
+    if answers:
+        # Chosen ids that are not answers of the quiz match no row and are ignored
+        QuizAnswer.objects.filter(id__in=answers, question_id__in=questions).update(
+            chosen_count=F('chosen_count') + _increments(answers)
+        )
+
+
+def grade(user, quiz, responses):
+    """
+    Score a submission against the cached key, store the attempt and add it to
+    the item counters, in one INSERT and two UPDATEs. A second attempt by the
+    same user raises IntegrityError and counts nothing.
+    """
+    quiz_id = getattr(quiz, 'pk', quiz)
+    key = answer_key(quiz_id)
+    responses = normalize(responses)
+    with transaction.atomic():
+        attempt = QuizAttempt.objects.create(
+            user_id=getattr(user, 'pk', user), quiz_id=quiz_id,
+            score=score(key, responses), responses=responses,
+        )
+        apply_item_deltas(*item_deltas(key, [(responses, attempt.score)]))
+    return attempt
+
+
+def _grade_batch(key, quiz_id, attempts):
+    graded = {attempt.user_id: attempt for attempt in attempts}  # The last submission of a user wins
+    with transaction.atomic():
+        done = set(QuizAttempt.objects.filter(quiz_id=quiz_id, user_id__in=graded).values_list('user_id', flat=True))
+        attempts = [attempt for user_id, attempt in graded.items() if user_id not in done]
+        # ignore_conflicts only guards against a parallel grader; skipped rows were read above
+        QuizAttempt.objects.bulk_create(attempts, ignore_conflicts=True)
+        apply_item_deltas(*item_deltas(key, [(attempt.responses, attempt.score) for attempt in attempts]))
+    return len(attempts)
+
+
+def grade_many(quiz, submissions, batch_size=BATCH_SIZE):
+    """
+    Grade (user, responses) pairs, e.g. an exam-day upload, with one key lookup
+    and, per batch, one read of existing attempts, one INSERT and two counter
+    UPDATEs. Users who already have an attempt are skipped. Returns the number
+    of submissions graded.
+    """
+    quiz_id = getattr(quiz, 'pk', quiz)
+    key = answer_key(quiz_id)
+    attempts = []
+    graded = 0
+    for user, responses in submissions:
+        responses = normalize(responses)
+        attempts.append(QuizAttempt(
+            user_id=getattr(user, 'pk', user), quiz_id=quiz_id, score=score(key, responses), responses=responses,
+        ))
+        if len(attempts) >= batch_size:
+            graded += _grade_batch(key, quiz_id, attempts)
+            attempts = []
+    if attempts:
+        graded += _grade_batch(key, quiz_id, attempts)
+    return graded
+
+
+def recompute_item_stats(quiz_id, batch_size=BATCH_SIZE):
+    """
+    Rebuild a quiz's item counters from its stored attempts, against the current
+    answer key, e.g. after a key correction. Attempts are streamed in batches and
+    folded into per-batch deltas, so memory stays flat and each batch costs two
+    UPDATEs whatever its size. Returns the number of attempts counted.
+    """
+    key = load_answer_key(quiz_id)
+    rows = QuizAttempt.objects.filter(quiz_id=quiz_id).values_list('responses', 'score').iterator(chunk_size=batch_size)
+    counted = 0
+    with transaction.atomic():
+        QuizQuestion.objects.filter(quiz_id=quiz_id).update(**{field: 0 for field in ITEM_FIELDS})
+        QuizAnswer.objects.filter(question__quiz_id=quiz_id).update(chosen_count=0)
+        while batch := list(islice(rows, batch_size)):
+            apply_item_deltas(*item_deltas(key, [(normalize(responses), attempt_score) for responses, attempt_score in batch]))
+            counted += len(batch)
+    return counted
+
+
+def item_analysis(quiz_id):
+    """
+    Per question difficulty, discrimination and answer distribution, read from
+    the counters in two queries, in question order.
+    """
+    questions = list(QuizQuestion.objects.filter(quiz_id=quiz_id).order_by('id'))
+    answers = defaultdict(list)
+    for answer in QuizAnswer.objects.filter(question__quiz_id=quiz_id).order_by('id'):
+        answers[answer.question_id].append(answer)
+    return [
+        {
+            'question': question,
+            'attempts': question.attempt_count,
+            'difficulty': question.difficulty,
+            'discrimination': question.discrimination,
+            'answers': [
+                {
+                    'answer': answer,
+                    'chosen': answer.chosen_count,
+                    'share': answer.chosen_count / question.attempt_count if question.attempt_count else None,
+                }
+                for answer in answers[question.id]
+            ],
+        }
+        for question in questions
+    ]
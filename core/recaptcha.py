@@ -0,0 +1,96 @@
+import hashlib
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = 10  # Keep-alive connections per process, enough for every worker thread
+_session = None
+
+
+def session():
+    """The process-wide session, so verifications reuse open TLS connections."""
+    global _session
+    if _session is None:
+        pooled = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=POOL_SIZE)
+        pooled.mount('https://', adapter)
+        pooled.mount('http://', adapter)
+        _session = pooled
+    return _session
+
+
+def _cache_key(token):
+    return f"recaptcha:{hashlib.sha256(token.encode()).hexdigest()}"
+
+
+def verify(token, remote_ip=None):
+    """
+    Whether Google accepts a reCAPTCHA response token. The call is bounded by
+    RECAPTCHA_TIMEOUT; when Google can't be reached or answers garbage, the
+    verdict is RECAPTCHA_FAIL_OPEN. Tokens are single use: a refused token
+    and an accepted one, now spent, are both remembered as refused for a
+    while, so replays are turned away without a round trip to Google.
+    """
+    if not token:
+        return False
+    key = _cache_key(token)
+    if cache.get(key) is not None:
+        return False
+    data = {'secret': settings.RECAPTCHA_SECRET_KEY, 'response': token}
+    if remote_ip:
+        data['remoteip'] = remote_ip
+    try:
+        response = session().post(settings.RECAPTCHA_VERIFY_URL, data=data, timeout=settings.RECAPTCHA_TIMEOUT)
+        response.raise_for_status()
+        verdict = response.json().get('success') is True
+    except (requests.RequestException, ValueError) as error:
+        logger.warning("reCAPTCHA verification failed: %s", error)
+        return settings.RECAPTCHA_FAIL_OPEN  # Not cached, the next submit tries again
+    cache.set(key, 'spent' if verdict else 'refused', settings.RECAPTCHA_CACHE_TIMEOUT)
+    return verdict
+
+
+# For ASGI views; runs in a worker thread so the event loop is never blocked
+verify_async = sync_to_async(verify, thread_sensitive=False)
+
+
+# Local stand-in for Google's siteverify endpoint, for tests and load tests
+STUB_REJECTED = 'invalid'  # Tokens starting with this are refused
+
+
+class StubVerifier(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like Google
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        form = parse_qs(self.rfile.read(length).decode())
+        token = (form.get('response') or [''])[0]
+        success = bool(token) and not token.startswith(STUB_REJECTED)
+        result = {'success': success} if success else {'success': False, 'error-codes': ['invalid-input-response']}
+        body = json.dumps(result).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def stub_server(host='127.0.0.1', port=0):
+    """A StubVerifier server, not yet serving; point RECAPTCHA_VERIFY_URL at stub_url(server)."""
+    return ThreadingHTTPServer((host, port), StubVerifier)
+
+
+def stub_url(server):
+    host, port = server.server_address[:2]
+    return f'http://{host}:{port}/recaptcha/api/siteverify'
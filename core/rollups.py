@@ -0,0 +1,176 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+from .models import DailyCourseStats, Enrollment, Installment, Payment
+
+ROLLUP_MODELS = (Payment, Installment, Enrollment)
+STATS_FIELDS = ('enrollments', 'payments', 'revenue', 'refunds', 'installments_due', 'installments_collected')
+REBUILD_BATCH = 1000
+
+
+def _day(value):
+    if value is None:
+        return None
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+def snapshot(instance):
+    return {field: getattr(instance, field) for field in type(instance).ROLLUP_FIELDS}
+
+
+def stored_values(instance):
+    """The counted values as the database has them, before a save."""
+    model = type(instance)
+    if instance.pk is None:
+        return None
+    return model._base_manager.filter(pk=instance.pk).values(*model.ROLLUP_FIELDS).first()
+
+
+# What one row adds to the rollups, as (day, course_id, field, amount)
+def payment_contributions(values, courses):
+    day = _day(values['created_at'])
+    if values['status'] == 'completed':
+        return [(day, values['course_id'], 'payments', 1), (day, values['course_id'], 'revenue', values['amount'])]
+    if values['status'] == 'refunded':
+        return [(day, values['course_id'], 'refunds', values['amount'])]
+    return []
+
+
+def installment_contributions(values, courses):
+    course_id = courses.get(values['payment_id'])
+    rows = [(values['due_date'], course_id, 'installments_due', values['amount'])]
+    if values['status'] == 'paid':
+        rows.append((_day(values['paid_at']), course_id, 'installments_collected', values['amount']))
+    return rows
+
+
+def enrollment_contributions(values, courses):
+    return [(_day(values['enrolled_at']), values['course_id'], 'enrollments', 1)]
+
+
+CONTRIBUTIONS = {
+    Payment: payment_contributions,
+    Installment: installment_contributions,
+    Enrollment: enrollment_contributions,
+}
+
+
+def deltas(model, removed=(), added=()):
+    """{(day, course_id): {field: delta}} for rows leaving and entering the rollups."""
+    courses = {}
+    if model is Installment:
+        payment_ids = {values['payment_id'] for values in (*removed, *added)}
+        courses = dict(Payment.objects.filter(pk__in=payment_ids).values_list('id', 'course_id'))
+    changes = defaultdict(lambda: defaultdict(int))
+    for sign, rows in ((-1, removed), (1, added)):
+        for values in rows:
+            for day, course_id, field, amount in CONTRIBUTIONS[model](values, courses):
+                if day is not None and course_id is not None and amount:
+                    changes[day, course_id][field] += sign * amount
+    return changes
+
+
+def apply(changes):
+    """Add the deltas to the rollup rows: one INSERT for missing rows, then one UPDATE per row."""
+    changes = {key: {field: amount for field, amount in fields.items() if amount} for key, fields in changes.items()}
+    changes = {key: fields for key, fields in changes.items() if fields}
+    if not changes:
+        return
+    # Both steps stay correct when parallel requests touch the same rows
+    DailyCourseStats.objects.bulk_create(
+        [DailyCourseStats(day=day, course_id=course_id) for day, course_id in changes], ignore_conflicts=True,
+    )
+    for (day, course_id), fields in changes.items():
+        DailyCourseStats.objects.filter(day=day, course_id=course_id).update(
+            **{field: F(field) + amount for field, amount in fields.items()}
+        )
+
+
+def record_change(instance, deleted=False):
+    """Move the rollups from the instance's previous values to its current ones."""
+    model = type(instance)
+    old = getattr(instance, '_rollup_values', None)
+    new = None if deleted else snapshot(instance)
+    if old != new:
+        apply(deltas(model, removed=[old] if old else [], added=[new] if new else []))
+    instance._rollup_values = new
+
+
+def record_created(model, instances):
+    """For rows written with bulk_create, which sends no signals."""
+    rows = [snapshot(instance) for instance in instances]
+    apply(deltas(model, added=rows))
+    for instance, values in zip(instances, rows):
+        instance._rollup_values = values
+
+
+def rebuild():
+    """Recompute every rollup row from the ledger, set-based; returns the number of rows."""
+    changes = defaultdict(lambda: defaultdict(int))
+
+    def merge(rows, day_field, fields):
+        for row in rows.iterator():
+            key = (row[day_field], row['course_id'])
+            for field in fields:
+                changes[key][field] += row[field] or 0
+
+    merge(
+        Enrollment.objects.annotate(day=TruncDate('enrolled_at')).values('day', 'course_id').annotate(enrollments=Count('id')).order_by(),
+        'day', ['enrollments'],
+    )
+    merge(
+        Payment.objects.annotate(day=TruncDate('created_at')).values('day', 'course_id').annotate(
+            payments=Count('id', filter=Q(status='completed')),
+            revenue=Sum('amount', filter=Q(status='completed')),
+            refunds=Sum('amount', filter=Q(status='refunded')),
+        ).order_by(),
+        'day', ['payments', 'revenue', 'refunds'],
+    )
+    merge(
+        Installment.objects.values('due_date', course_id=F('payment__course_id')).annotate(installments_due=Sum('amount')).order_by(),
+        'due_date', ['installments_due'],
+    )
+    merge(
+        Installment.objects.filter(status='paid', paid_at__isnull=False).annotate(day=TruncDate('paid_at'))
+        .values('day', course_id=F('payment__course_id')).annotate(installments_collected=Sum('amount')).order_by(),
+        'day', ['installments_collected'],
+    )
+
+    with transaction.atomic():
+        DailyCourseStats.objects.all().delete()
+        DailyCourseStats.objects.bulk_create(
+            (DailyCourseStats(day=day, course_id=course_id, **fields) for (day, course_id), fields in changes.items() if day),
+            batch_size=REBUILD_BATCH,
+        )
+    return len(changes)
+
+
+# Dashboard reads, over the rollup rows only
+def monthly(start=None, end=None, course_ids=None):
+    """Per course and month totals of every rollup field, between two dates inclusive."""
+    rows = DailyCourseStats.objects.all()
+    if start:
+        rows = rows.filter(day__gte=start)
+    if end:
+        rows = rows.filter(day__lte=end)
+    if course_ids is not None:
+        rows = rows.filter(course_id__in=course_ids)
+    return (
+        rows.annotate(month=TruncMonth('day')).values('month', 'course_id', 'course__title')
+        .annotate(**{field: Sum(field) for field in STATS_FIELDS}).order_by('month', 'course__title')
+    )
+
+
+def collections(start=None, end=None):
+    """Installments due vs collected between two dates, and what is still outstanding."""
+    rows = DailyCourseStats.objects.all()
+    if start:
+        rows = rows.filter(day__gte=start)
+    if end:
+        rows = rows.filter(day__lte=end)
+    totals = rows.aggregate(due=Sum('installments_due'), collected=Sum('installments_collected'))
+    due, collected = totals['due'] or Decimal('0'), totals['collected'] or Decimal('0')
+    return {'due': due, 'collected': collected, 'outstanding': due - collected}
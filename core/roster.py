@@ -0,0 +1,176 @@
+import csv
+import io
+import os
+from itertools import islice
+from zipfile import BadZipFile
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+from .enrollment import enroll_in_courses, enroll_in_track
+from .models import User, StudentProfile
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+COLUMNS = {'username', 'email', 'first_name', 'last_name', 'phone1', 'phone2'}
+ALIASES = {'phone': 'phone1', 'mobile': 'phone1', 'first': 'first_name', 'last': 'last_name'}
+
+
+class RosterFormatError(ValueError):
+    """The file itself can't be read as a roster."""
+
+
+class RosterReport:
+    """Outcome of an import: counters plus the first (line, message) errors."""
+
+    def __init__(self):
+        self.created = 0
+        self.existing = 0
+        self.enrolled = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+# Readers yield each row as a list of strings, without loading the whole file
+def csv_rows(file):
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        yield from csv.reader(text)
+    finally:
+        text.detach()  # Leave the upload open for its owner
+
+
+def xlsx_cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # Numbers typed into Excel, e.g. phones, come back as floats
+    return str(value)
+
+
+def xlsx_rows(file):
+    try:
+        workbook = load_workbook(file, read_only=True, data_only=True)
+    except (InvalidFileException, BadZipFile, KeyError, ValueError, OSError) as error:
+        raise RosterFormatError(f"Could not read the .xlsx file: {error}")
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield [xlsx_cell(value) for value in row]
+    finally:
+        workbook.close()
+
+
+READERS = {'.csv': csv_rows, '.xlsx': xlsx_rows}
+
+
+def column_name(header):
+    name = header.strip().lower().replace(' ', '_')
+    return ALIASES.get(name, name)
+
+
+def read_roster(file, name):
+    """Yield (line number, {column: value}) for the non-empty rows of a roster."""
+    reader = READERS.get(os.path.splitext(name)[1].lower())
+    if reader is None:
+        raise RosterFormatError("Upload a .csv or .xlsx file.")
+    rows = reader(file)
+    columns = [column_name(header) for header in next(rows, [])]
+    if 'email' not in columns:
+        raise RosterFormatError("The first row must name the columns, including an email column.")
+    for line, values in enumerate(rows, start=2):
+        row = {column: value.strip() for column, value in zip(columns, values) if column in COLUMNS}
+        if any(row.values()):
+            yield line, row
+
+
+def build_user(row):
+    """An unsaved student for one row; raises ValidationError."""
+    email = row.get('email', '').lower()
+    validate_email(email)
+    user = User(
+        username=row.get('username') or email,
+        email=email,
+        first_name=row.get('first_name', ''),
+        last_name=row.get('last_name', ''),
+        phone1=row.get('phone1') or None,
+        phone2=row.get('phone2') or None,
+        role='student',
+        password=make_password(None),  # Trainees set their own through password reset
+    )
+    # Field validators only: uniqueness is checked per batch, in one query
+    user.clean_fields(exclude=['password', 'gender', 'date_of_birth'])
+    return user
+
+
+def import_batch(rows, report, course_ids=(), track=None):
+    candidates = {}
+    emails = set()
+    for line, row in rows:
+        try:
+            user = build_user(row)
+        except ValidationError as error:
+            report.error(line, '; '.join(error.messages))
+            continue
+        if user.username in candidates or user.email in emails:
+            report.error(line, "Same student as an earlier row.")
+            continue
+        candidates[user.username] = (line, user)
+        emails.add(user.email)
+    if not candidates:
+        return
+
+    by_username, by_email = {}, {}
+    for pk, username, email, role in User.objects.filter(Q(username__in=candidates) | Q(email__in=emails)).values_list('id', 'username', 'email', 'role'):
+        by_username[username] = by_email[email] = (pk, role)
+
+    user_ids, new_users = [], []
+    for username, (line, user) in candidates.items():
+        match = by_username.get(username) or by_email.get(user.email)
+        if match is None:
+            new_users.append(user)
+        elif match[1] != 'student':
+            report.error(line, f"{username} already has a {match[1]} account.")
+        else:
+            user_ids.append(match[0])
+            report.existing += 1
+
+    # Bulk inserts skip the per-row signals, so profiles are created here
+    try:
+        with transaction.atomic():
+            User.objects.bulk_create(new_users)
+            StudentProfile.objects.bulk_create([StudentProfile(user=user) for user in new_users])
+    except IntegrityError:
+        for user in new_users:
+            report.error(candidates[user.username][0], "Account created by someone else during the import; import the file again.")
+        new_users = []
+    user_ids += [user.pk for user in new_users]
+    report.created += len(new_users)
+
+    if track is not None:
+        report.enrolled += len(enroll_in_track(track, user_ids))
+    if course_ids:
+        report.enrolled += len(enroll_in_courses(user_ids, course_ids))
+
+
+def import_roster(file, name, courses=(), track=None, batch_size=BATCH_SIZE):
+    """
+    Create student accounts from a CSV/XLSX roster and enroll them in the given
+    courses and track. Rows are read and written batch_size at a time, so memory
+    stays flat however long the file is. Students already registered (same
+    username or email) are enrolled without being changed. Returns a RosterReport;
+    raises RosterFormatError if the file can't be read at all.
+    """
+    report = RosterReport()
+    course_ids = [getattr(course, 'pk', course) for course in courses]
+    rows = read_roster(file, name)
+    while batch := list(islice(rows, batch_size)):
+        import_batch(batch, report, course_ids, track)
+    return report
@@ -0,0 +1,244 @@
+import re
+import threading
+import unicodedata
+from django.db import connection, transaction
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from .models import (
+    Course, Track, CourseLearningOutcome, CourseRequirement, CourseSyllabus, CourseSection, CourseLesson,
+)
+
+SEARCH_TABLE = 'core_search_index'
+KINDS = {'course': 0, 'track': 1}
+REBUILD_BATCH = 500
+
+# Arabic tashkeel, superscript alef and tatweel are dropped, and the common
+# spelling variants are folded, so "تعلّم" matches "تعلم" and "أحمد" matches "احمد".
+ARABIC_MARKS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+ARABIC_FOLD = str.maketrans({'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ى': 'ي', 'ة': 'ه'})
+TERM = re.compile(r'\w+')
+
+SNIPPET_TOKENS = 24
+
+# The FTS5 table is created by migration 0006_search_index, with rank
+# configured as bm25(10, 4, 1): title matches weigh most, then the
+# description, then outlines (outcomes, lessons ...). Matching runs on the
+# normalized columns; the *_text columns (UNINDEXED, migration 0020) keep
+# the text as written, for snippets.
+
+
+def is_supported():
+    return connection.vendor == 'sqlite'
+
+
+def normalize(text):
+    return ARABIC_MARKS.sub('', text or '').translate(ARABIC_FOLD)
+
+
+def fold_char(char):
+    # What the FTS tokenizer compares: case and Latin accents folded too
+    return unicodedata.normalize('NFD', char.translate(ARABIC_FOLD))[0].lower()
+
+
+def fold_with_offsets(text):
+    """The folded text, and for each of its characters the offset of the original one."""
+    folded, offsets = [], []
+    for offset, char in enumerate(text):
+        if not ARABIC_MARKS.match(char):
+            folded.append(fold_char(char))
+            offsets.append(offset)
+    return ''.join(folded), offsets
+
+
+def rowid(kind, object_id):
+    # Deterministic rowids let updates and deletes hit the FTS primary key
+    return object_id * len(KINDS) + KINDS[kind]
+
+
+def course_documents(course_ids):
+    """(rowid, title, body, extra) for the published courses in course_ids."""
+    extra = {course_id: [] for course_id in course_ids}
+    for model, field in ((CourseLearningOutcome, 'outcome'), (CourseRequirement, 'requirement'), (CourseSyllabus, 'title'), (CourseSection, 'title')):
+        for course_id, text in model.objects.filter(course_id__in=course_ids).order_by('position', 'id').values_list('course_id', field):
+            extra[course_id].append(text)
+    lessons = CourseLesson.objects.filter(section__course_id__in=course_ids).order_by('position', 'id')
+    for course_id, text in lessons.values_list('section__course_id', 'title'):
+        extra[course_id].append(text)
+
+    courses = Course.objects.published().filter(id__in=course_ids).values_list('id', 'title', 'excerpt', 'description')
+    return [
+        document(rowid('course', pk), title, f"{excerpt or ''}\n{description}", '\n'.join(extra[pk]))
+        for pk, title, excerpt, description in courses
+    ]
+
+
+def track_documents(track_ids):
+    tracks = Track.objects.filter(id__in=track_ids).values_list('id', 'title', 'description')
+    return [document(rowid('track', pk), title, description, '') for pk, title, description in tracks]
+
+
+def document(row, title, body, extra):
+    """An index row: the normalized columns to match, then the text as written."""
+    texts = (title or '', body or '', extra or '')
+    return (row, *(normalize(text) for text in texts), *texts)
+
+
+def write(kind, ids, documents):
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [(rowid(kind, pk),) for pk in ids])
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE}(rowid, title, body, extra, title_text, body_text, extra_text) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            documents,
+        )
+
+
+def index_course(course_id):
+    if is_supported():
+        write('course', [course_id], course_documents([course_id]))
+
+
+_pending = threading.local()
+
+
+def schedule_course(course_id):
+    """
+    Reindex a course when the current transaction commits (at once outside
+    one). Saving a course with its outline rows in one transaction, as the
+    admin does, reindexes it once rather than once per row.
+    """
+    if not is_supported() or not course_id:
+        return
+    if getattr(_pending, 'courses', None) is None or not any(
+        callback is flush_scheduled for _, callback, _ in connection.run_on_commit
+    ):
+        _pending.courses = set()  # Left over from a rolled back transaction
+    _pending.courses.add(course_id)
+    # Every call registers a flush, so rolling back a savepoint can't drop
+    # it; flushes after the first find the set empty
+    transaction.on_commit(flush_scheduled)
+
+
+def flush_scheduled():
+    course_ids, _pending.courses = getattr(_pending, 'courses', None), None
+    if course_ids:
+        write('course', course_ids, course_documents(list(course_ids)))
+
+
+def index_track(track_id):
+    if is_supported():
+        write('track', [track_id], track_documents([track_id]))
+
+
+def remove(kind, object_id):
+    if is_supported():
+        write(kind, [object_id], [])
+
+
+def rebuild():
+    """Reindex everything in batches; returns the number of documents written."""
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+    total = 0
+    for kind, queryset, documents in (
+        ('course', Course.objects.published(), course_documents),
+        ('track', Track.objects.all(), track_documents),
+    ):
+        ids = list(queryset.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(ids), REBUILD_BATCH):
+            batch = documents(ids[start:start + REBUILD_BATCH])
+            write(kind, [], batch)
+            total += len(batch)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')")
+    return total
+
+
+def query_terms(query):
+    return TERM.findall(normalize(query))
+
+
+def match_expression(query):
+    # Every word must match, as a prefix; quoting keeps FTS syntax out of user input
+    return ' '.join(f'"{term}"*' for term in query_terms(query))
+
+
+def snippet(texts, terms, size=SNIPPET_TOKENS):
+    """
+    A window of about size words from the column with the most matches, cut
+    from the text as written, with matching words in <mark>. Matches are found
+    on the folded text and mapped back through its offsets, so tashkeel and
+    spelling variants show as the author wrote them.
+    """
+    prefixes = [''.join(fold_char(char) for char in term) for term in terms]
+    best = None
+    for text in texts:
+        folded, offsets = fold_with_offsets(text)
+        words = list(TERM.finditer(folded))
+        hits = [i for i, word in enumerate(words) if word.group().startswith(tuple(prefixes))]
+        if hits and (best is None or len(hits) > len(best[3])):
+            best = (text, offsets, words, hits)
+    if best is None:
+        return escape(next((text for text in texts if text), '')[:200])
+    text, offsets, words, hits = best
+
+    first = max(0, hits[0] - size // 4)
+    last = min(len(words), first + size)
+
+    def original_span(word):
+        start, end = offsets[word.start()], offsets[word.end() - 1] + 1
+        while end < len(text) and ARABIC_MARKS.match(text[end]):
+            end += 1  # Keep marks on the last letter
+        return start, end
+
+    start = original_span(words[first])[0] if first else 0
+    end = original_span(words[last - 1])[1] if last < len(words) else len(text)
+    pieces = ['…' if first else '']
+    position = start
+    while position < end and text[position].isspace():
+        position += 1
+    for i in hits:
+        if first <= i < last:
+            word_start, word_end = original_span(words[i])
+            pieces += [escape(text[position:word_start]), '<mark>', escape(text[word_start:word_end]), '</mark>']
+            position = word_end
+    pieces += [escape(text[position:end]), '…' if last < len(words) else '']
+    return ''.join(pieces)
+
+
+def search(query, limit=20):
+    """
+    Ranked results as dicts with kind, object, and a highlighted snippet.
+    """
+    expression = match_expression(query)
+    if not expression:
+        return []
+
+    if not is_supported():
+        courses = Course.objects.published().filter(title__icontains=query)[:limit]
+        return [{'kind': 'course', 'object': course, 'snippet': course.excerpt or ''} for course in courses]
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT rowid, title_text, body_text, extra_text
+            FROM {SEARCH_TABLE}
+            WHERE {SEARCH_TABLE} MATCH %s
+            ORDER BY rank
+            LIMIT %s
+            """,
+            [expression, limit],
+        )
+        rows = cursor.fetchall()
+
+    terms = query_terms(query)
+    kinds = {code: kind for kind, code in KINDS.items()}
+    hits = [(kinds[row % len(KINDS)], row // len(KINDS), snippet(texts, terms)) for row, *texts in rows]
+    objects = {
+        'course': Course.objects.only('id', 'title', 'thumbnail').in_bulk([pk for kind, pk, _ in hits if kind == 'course']),
+        'track': Track.objects.only('id', 'title', 'image').in_bulk([pk for kind, pk, _ in hits if kind == 'track']),
+    }
+    return [
+        {'kind': kind, 'object': objects[kind][pk], 'snippet': mark_safe(text)}
+        for kind, pk, text in hits if pk in objects[kind]
+    ]
@@ -0,0 +1,10 @@
+from django.contrib.sessions.backends.db import SessionStore as DatabaseSessionStore
+from .db import retry_on_lock
+
+
+class SessionStore(DatabaseSessionStore):
+    """Database sessions whose writes are retried when SQLite is busy."""
+
+    @retry_on_lock
+    def save(self, must_create=False):
+        return super().save(must_create)
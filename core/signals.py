@@ -1,19 +1,30 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models import F
+from django.db.models.signals import post_save, pre_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
+from django.utils import timezone
 from django.contrib.auth import get_user_model
-from rest_framework_simplejwt.token_blacklist.models import OutstandingToken, BlacklistedToken
-from .models import User, StudentProfile, InstructorProfile
+from .models import (
+    User, StudentProfile, InstructorProfile, Track, Course, Category,
+    CourseLearningOutcome, CourseRequirement, CourseSyllabus, CourseSection, CourseLesson,
+    CourseReview, rating_updates, TrackFAQ, Event, EventImage, AboutUs, PrivacyPolicy, TermsConditions,
+    CourseFAQ, CourseGroup, Enrollment, QuizQuestion, QuizAnswer,
+)
+from .navigation import NAVIGATION_CACHE
+from .decorators import PAGES_CACHE
+from . import search, images, progress, quizzes, rollups
+from .accounts import blacklist_tokens, loaded_role, saves_role
+from .utils import bump_cache_version
 
 User = get_user_model()
 
 @receiver(post_save, sender=User)
-def invalidate_tokens_on_role_change(sender, instance, **kwargs):
-    if instance.pk:  # Check if the instance is being updated
-        old_instance = sender.objects.get(pk=instance.pk)
-        if old_instance.role != instance.role:  # Role has changed
-            tokens = OutstandingToken.objects.filter(user=instance)
-            for token in tokens:
-                BlacklistedToken.objects.get_or_create(token=token)
+def invalidate_tokens_on_role_change(sender, instance, update_fields=None, **kwargs):
+    if not saves_role(update_fields):
+        return  # e.g. the last_login update on every login
+    changed = instance.__dict__.pop('_role_changed', False)  # Set by update_user_profile
+    instance._loaded_role = instance.role
+    if changed:
+        blacklist_tokens([instance.pk])
 
 
 # Auto create profile student on new user
@@ -28,15 +39,15 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 # change role from student to instructor / admin will delete student profile
 @receiver(pre_save, sender=User)
-def update_user_profile(sender, instance, **kwargs):
-    if not instance.pk:
+def update_user_profile(sender, instance, update_fields=None, **kwargs):
+    if not instance.pk or not saves_role(update_fields):
         return  # New user handled in post_save
 
-    old_user = User.objects.get(pk=instance.pk)
-    old_role = old_user.role
+    old_role = loaded_role(instance)
     new_role = instance.role
 
     if old_role != new_role:
+        instance._role_changed = True
         # Delete old profile
         if old_role == 'student':
             StudentProfile.objects.filter(user=instance).delete()
@@ -48,3 +59,207 @@ def update_user_profile(sender, instance, **kwargs):
             StudentProfile.objects.get_or_create(user=instance)
         elif new_role == 'instructor':
             InstructorProfile.objects.get_or_create(user=instance)
+
+
+# Rebuild the cached header/footer menus when anything they show changes
+@receiver(post_save, sender=Track)
+@receiver(post_delete, sender=Track)
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(m2m_changed, sender=Course.tracks.through)
+def invalidate_navigation(sender, **kwargs):
+    bump_cache_version(NAVIGATION_CACHE)
+
+
+# Drop cached public pages (see cache_public_page) when content they render changes
+PAGE_CONTENT_MODELS = (Track, Course, Category, TrackFAQ, Event, EventImage, AboutUs, PrivacyPolicy, TermsConditions)
+
+def invalidate_pages(sender, **kwargs):
+    bump_cache_version(PAGES_CACHE)
+
+for model in PAGE_CONTENT_MODELS:
+    post_save.connect(invalidate_pages, sender=model, dispatch_uid=f'invalidate_pages_save_{model.__name__}')
+    post_delete.connect(invalidate_pages, sender=model, dispatch_uid=f'invalidate_pages_delete_{model.__name__}')
+m2m_changed.connect(invalidate_pages, sender=Course.tracks.through, dispatch_uid='invalidate_pages_course_tracks')
+
+
+# Keep the full-text search index in sync
+@receiver(post_save, sender=Course)
+def index_course(sender, instance, **kwargs):
+    search.schedule_course(instance.pk)  # Drops the course if it is no longer published
+
+@receiver(post_save, sender=Track)
+def index_track(sender, instance, **kwargs):
+    search.index_track(instance.pk)
+
+@receiver(post_delete, sender=Course)
+def unindex_course(sender, instance, **kwargs):
+    search.schedule_course(instance.pk)
+
+@receiver(post_delete, sender=Track)
+def unindex_track(sender, instance, **kwargs):
+    search.remove('track', instance.pk)
+
+@receiver(post_save, sender=CourseLearningOutcome)
+@receiver(post_delete, sender=CourseLearningOutcome)
+@receiver(post_save, sender=CourseRequirement)
+@receiver(post_delete, sender=CourseRequirement)
+@receiver(post_save, sender=CourseSyllabus)
+@receiver(post_delete, sender=CourseSyllabus)
+@receiver(post_save, sender=CourseSection)
+@receiver(post_delete, sender=CourseSection)
+def reindex_course_outline(sender, instance, **kwargs):
+    search.schedule_course(instance.course_id)
+
+@receiver(post_save, sender=CourseLesson)
+@receiver(post_delete, sender=CourseLesson)
+def reindex_course_lessons(sender, instance, **kwargs):
+    course_id = CourseSection.objects.filter(pk=instance.section_id).values_list('course_id', flat=True).first()
+    search.schedule_course(course_id)
+
+
+# Incremental course rating aggregates
+def apply_rating_updates(course_id, added=None, removed=None):
+    updates = rating_updates(added=added, removed=removed)
+    if course_id and updates:
+        Course.objects.filter(pk=course_id).update(**updates)
+
+@receiver(pre_save, sender=CourseReview)
+def remember_review_rating(sender, instance, **kwargs):
+    # Instances not loaded by a query (built with a pk) read what is counted now
+    if instance.pk and not hasattr(instance, '_loaded_rating'):
+        stored = sender._base_manager.filter(pk=instance.pk).values_list('course_id', 'rating').first()
+        instance._loaded_rating = stored or (None, None)
+
+@receiver(post_save, sender=CourseReview)
+def count_review(sender, instance, created, **kwargs):
+    old_course_id, old_rating = (None, None) if created else getattr(instance, '_loaded_rating', (None, None))
+    if old_course_id == instance.course_id:
+        apply_rating_updates(instance.course_id, added=instance.rating, removed=old_rating)
+    else:
+        apply_rating_updates(old_course_id, removed=old_rating)
+        apply_rating_updates(instance.course_id, added=instance.rating)
+    instance._loaded_rating = (instance.course_id, instance.rating)
+
+@receiver(post_delete, sender=CourseReview)
+def uncount_review(sender, instance, **kwargs):
+    course_id, rating = getattr(instance, '_loaded_rating', (instance.course_id, instance.rating))
+    apply_rating_updates(course_id, removed=rating)
+
+
+# Seats are taken by core.enrollment when enrolling, and given back here
+@receiver(post_delete, sender=Enrollment)
+def release_seat(sender, instance, **kwargs):
+    from .enrollment import release_seats
+    release_seats(instance.group_id)
+
+
+# Business dashboard rollups: every change to a counted row applies its delta
+def remember_rollup_values(sender, instance, **kwargs):
+    if not hasattr(instance, '_rollup_values'):
+        instance._rollup_values = rollups.stored_values(instance)
+
+def update_rollups(sender, instance, **kwargs):
+    rollups.record_change(instance)
+
+def remove_from_rollups(sender, instance, **kwargs):
+    rollups.record_change(instance, deleted=True)
+
+for model in rollups.ROLLUP_MODELS:
+    pre_save.connect(remember_rollup_values, sender=model, dispatch_uid=f'rollups_pre_save_{model.__name__}')
+    post_save.connect(update_rollups, sender=model, dispatch_uid=f'rollups_post_save_{model.__name__}')
+    post_delete.connect(remove_from_rollups, sender=model, dispatch_uid=f'rollups_post_delete_{model.__name__}')
+
+
+# Lesson totals behind Enrollment.progress; lessons moved between courses
+# are left to the recompute_progress command
+def shift_lesson_count(section_id, step):
+    course_id = CourseSection.objects.filter(pk=section_id).values_list('course_id', flat=True).first()
+    if course_id:
+        Course.objects.filter(pk=course_id).update(lesson_count=F('lesson_count') + step)
+        progress.refresh_progress(Enrollment.objects.filter(course_id=course_id))
+
+@receiver(post_save, sender=CourseLesson)
+def count_lesson(sender, instance, created, **kwargs):
+    if created:
+        shift_lesson_count(instance.section_id, 1)
+
+@receiver(pre_delete, sender=CourseLesson)
+def uncount_lesson_completions(sender, instance, **kwargs):
+    # Its completions are deleted along with it, without signals of their own
+    progress.shift_progress(Enrollment.objects.filter(completions__lesson=instance), -1)
+
+@receiver(post_delete, sender=CourseLesson)
+def uncount_lesson(sender, instance, **kwargs):
+    shift_lesson_count(instance.section_id, -1)
+
+
+# Touch the parent's updated_at when a child row shown on its page changes,
+# so the page validators (conditional_page) move with its content
+@receiver(post_save, sender=CourseLearningOutcome)
+@receiver(post_delete, sender=CourseLearningOutcome)
+@receiver(post_save, sender=CourseRequirement)
+@receiver(post_delete, sender=CourseRequirement)
+@receiver(post_save, sender=CourseSyllabus)
+@receiver(post_delete, sender=CourseSyllabus)
+@receiver(post_save, sender=CourseSection)
+@receiver(post_delete, sender=CourseSection)
+@receiver(post_save, sender=CourseFAQ)
+@receiver(post_delete, sender=CourseFAQ)
+@receiver(post_save, sender=CourseGroup)
+@receiver(post_delete, sender=CourseGroup)
+def touch_course(sender, instance, **kwargs):
+    Course.objects.filter(pk=instance.course_id).update(updated_at=timezone.now())
+
+@receiver(post_save, sender=CourseLesson)
+@receiver(post_delete, sender=CourseLesson)
+def touch_lesson_course(sender, instance, **kwargs):
+    Course.objects.filter(coursesection__pk=instance.section_id).update(updated_at=timezone.now())
+
+@receiver(post_save, sender=TrackFAQ)
+@receiver(post_delete, sender=TrackFAQ)
+def touch_track(sender, instance, **kwargs):
+    Track.objects.filter(pk=instance.track_id).update(updated_at=timezone.now())
+
+@receiver(m2m_changed, sender=Course.tracks.through)
+def touch_course_tracks(sender, instance, action, reverse, pk_set, **kwargs):
+    now = timezone.now()
+    if reverse and action.startswith('post_'):  # track.courses.add(...)
+        Track.objects.filter(pk=instance.pk).update(updated_at=now)
+    elif not reverse and action == 'pre_clear':  # Still knows which tracks are affected
+        Track.objects.filter(courses=instance).update(updated_at=now)
+    elif not reverse and action in ('post_add', 'post_remove'):
+        Track.objects.filter(pk__in=pk_set).update(updated_at=now)
+
+
+# Off-request thumbnails: hash new uploads before save, render after commit
+@receiver(pre_save, sender=Course)
+@receiver(pre_save, sender=Track)
+@receiver(pre_save, sender=Event)
+@receiver(pre_save, sender=User)
+def hash_images(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or any(spec.field in update_fields for spec in images.specs_for(sender)):
+        images.prepare(instance)
+
+@receiver(post_save, sender=Course)
+@receiver(post_save, sender=Track)
+@receiver(post_save, sender=Event)
+@receiver(post_save, sender=User)
+def render_thumbnails(sender, instance, **kwargs):
+    images.dispatch(instance)
+
+
+# Quiz answer keys are cached per quiz, see core.quizzes
+@receiver(post_save, sender=QuizQuestion)
+@receiver(post_delete, sender=QuizQuestion)
+def invalidate_quiz_questions(sender, instance, **kwargs):
+    quizzes.invalidate_answer_key(instance.quiz_id)
+
+@receiver(post_save, sender=QuizAnswer)
+@receiver(post_delete, sender=QuizAnswer)
+def invalidate_quiz_answers(sender, instance, **kwargs):
+    quiz_id = QuizQuestion.objects.filter(pk=instance.question_id).values_list('quiz_id', flat=True).first()
+    if quiz_id:
+        quizzes.invalidate_answer_key(quiz_id)
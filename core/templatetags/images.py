@@ -0,0 +1,44 @@
+from django import template
+from django.forms.utils import flatatt
+from django.urls import reverse
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+from core import images
+
+register = template.Library()
+
+
+@register.filter
+def thumbnail(instance, field):
+    """{{ course|thumbnail:'thumbnail' }} -> resized image URL, or the original until it is ready."""
+    return images.thumbnail_url(instance, field)
+
+
+@register.simple_tag
+def responsive_image(instance, field, sizes='100vw', **attrs):
+    """
+    <picture> with AVIF/WebP srcsets for an image field; the <img> fallback
+    uses the thumbnail. Extra keyword arguments become <img> attributes:
+    {% responsive_image course 'thumbnail' sizes='(max-width: 768px) 100vw, 410px' alt=course.title %}
+    """
+    src = images.thumbnail_url(instance, field)
+    if not src:
+        return ''
+    attrs.setdefault('alt', '')
+    attrs.setdefault('loading', 'lazy')
+    attrs.setdefault('decoding', 'async')
+    img = format_html('<img src="{}"{}>', src, flatatt(attrs))
+
+    spec = next(spec for spec in images.specs_for(type(instance)) if spec.field == field)
+    digest = getattr(instance, spec.digest_field)
+    formats = images.variant_formats()
+    if not digest or not formats:
+        return img
+
+    sources = []
+    for ext in formats:
+        srcset = ', '.join(
+            f"{reverse('image_variant', args=[digest, width, ext])} {width}w" for width in images.VARIANT_WIDTHS
+        )
+        sources.append(format_html('<source type="{}" srcset="{}" sizes="{}">', images.VARIANT_FORMATS[ext][1], srcset, sizes))
+    return format_html('<picture>{}{}</picture>', mark_safe(''.join(sources)), img)
@@ -1,3 +1,1382 @@
-from django.test import TestCase
+import base64
+import csv
+import json
+import os
+import shutil
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from openpyxl import Workbook
+from PIL import Image
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache, caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.conf import settings
+from django.db import OperationalError, connection, connections
+from django.db.models import Count
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import *
+from .db import RETRY_BUDGET, RETRY_DELAY, retry_on_lock
+from .decorators import PAGES_CACHE, cache_public_page
+from .enrollment import CourseFull, enroll, enroll_in_courses, enroll_in_track
+from .images import IMAGE_SPECS, thumbnail_url
+from .navigation import get_navigation
+from .progress import complete_lesson, uncomplete_lesson
+from .roster import RosterFormatError, import_roster
+from .utils import get_cache_version
+from . import accounts, outbox, payments, quizzes, recaptcha, rollups, search, throttle
+
+
+def make_course(**kwargs):
+    defaults = {
+        'title': 'Python Basics',
+        'description': 'Learn Python',
+        'duration': 600,
+        'level': 'beginner',
+        'status': 'published',
+    }
+    defaults.update(kwargs)
+    return Course.objects.create(**defaults)
+
+
+class CourseDetailQueryTests(TestCase):
+    def setUp(self):
+        self.instructor = User.objects.create(username='teacher', role='instructor')
+
+    def build_graph(self, course, sections, lessons):
+        for i in range(sections):
+            CourseLearningOutcome.objects.create(course=course, outcome=f'Outcome {i}', position=i)
+            CourseRequirement.objects.create(course=course, requirement=f'Requirement {i}', position=i)
+            CourseSyllabus.objects.create(course=course, title=f'Week {i}', description='...', position=i)
+            CourseFAQ.objects.create(course=course, question=f'Q {i}', answer='A', position=i)
+            CourseGroup.objects.create(
+                course=course, instructor=self.instructor,
+                start_date=date(2030, 1, i + 1), end_date=date(2030, 2, i + 1),
+            )
+            section = CourseSection.objects.create(course=course, title=f'Section {i}', position=sections - i)
+            for j in range(lessons):
+                CourseLesson.objects.create(section=section, title=f'Lesson {j}', position=lessons - j)
+
+    def count_queries(self, course):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('course', args=[course.id]))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_curriculum(self):
+        category = Category.objects.create(name='Programming')
+        small = make_course(category=category)
+        large = make_course(title='Django', category=category)
+        self.build_graph(small, sections=1, lessons=1)
+        self.build_graph(large, sections=6, lessons=5)
+        get_navigation()
+
+        self.assertEqual(self.count_queries(small), self.count_queries(large))
+
+    def test_with_detail_orders_by_position(self):
+        course = make_course()
+        self.build_graph(course, sections=3, lessons=3)
+
+        course = Course.objects.with_detail().get(pk=course.pk)
+        with self.assertNumQueries(0):
+            sections = list(course.coursesection_set.all())
+            lessons = [list(section.courselesson_set.all()) for section in sections]
+            outcomes = list(course.outcomes.all())
+            groups = [group.instructor for group in course.groups.all()]
+        self.assertEqual([s.position for s in sections], [1, 2, 3])
+        self.assertEqual([l.position for l in lessons[0]], [1, 2, 3])
+        self.assertEqual([o.position for o in outcomes], [0, 1, 2])
+        self.assertEqual(groups, [self.instructor] * 3)
+
+
+class NavigationCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_menu_renders_without_queries_once_cached(self):
+        track = Track.objects.create(title='Backend')
+        course = make_course()
+        course.tracks.add(track)
+        get_navigation()
+
+        with self.assertNumQueries(0):
+            navigation = get_navigation()
+        self.assertEqual(navigation['tracks'][0]['courses'], [{'id': course.id, 'title': course.title}])
+
+    def test_changes_invalidate_menu(self):
+        track = Track.objects.create(title='Backend')
+        course = make_course()
+        self.assertEqual(get_navigation()['tracks'][0]['courses'], [])
+
+        course.tracks.add(track)
+        self.assertEqual(len(get_navigation()['tracks'][0]['courses']), 1)
+
+        Category.objects.create(name='Design')
+        self.assertEqual([cat['name'] for cat in get_navigation()['cats']], ['Design'])
+
+        course.delete()
+        self.assertEqual(get_navigation()['courses'], [])
+
+
+class CatalogListingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_keyset_pages_walk_forward_and_back(self):
+        from .views import COURSES_PER_PAGE
+        created = [make_course(title=f'Course {i}') for i in range(COURSES_PER_PAGE * 2 + 3)]
+        newest_first = [course.id for course in reversed(created)]
+
+        first = self.client.get(reverse('courses'))
+        self.assertEqual([c.id for c in first.context['courses']], newest_first[:COURSES_PER_PAGE])
+        self.assertNotIn('previous_url', first.context)
+
+        second = self.client.get(reverse('courses') + first.context['next_url'])
+        self.assertEqual([c.id for c in second.context['courses']], newest_first[COURSES_PER_PAGE:COURSES_PER_PAGE * 2])
+
+        third = self.client.get(reverse('courses') + second.context['next_url'])
+        self.assertEqual([c.id for c in third.context['courses']], newest_first[COURSES_PER_PAGE * 2:])
+        self.assertNotIn('next_url', third.context)
+
+        back = self.client.get(reverse('courses') + third.context['previous_url'])
+        self.assertEqual([c.id for c in back.context['courses']], newest_first[COURSES_PER_PAGE:COURSES_PER_PAGE * 2])
+
+    def test_malformed_cursor_gives_the_first_page(self):
+        from .views import COURSES_PER_PAGE
+        created = [make_course(title=f'Course {i}') for i in range(COURSES_PER_PAGE + 1)]
+        first_page = [course.id for course in reversed(created)][:COURSES_PER_PAGE]
+        for values in ([{'a': 1}], ['abc'], [[1]], [None], ['1', '2']):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            for name in ('courses', 'tracks'):
+                response = self.client.get(reverse(name), {'after': cursor})
+                self.assertEqual(response.status_code, 200)
+            response = self.client.get(reverse('courses'), {'before': cursor, 'sort': 'price'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['courses']), COURSES_PER_PAGE)
+        # Two values, as price cursors have, but not a price
+        for values in (['abc', '3'], ['NaN', '3'], ['1e999999', '3'], ['10.00', 'x']):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            for sort in ('price', '-price'):
+                for param in ('after', 'before'):
+                    response = self.client.get(reverse('courses'), {param: cursor, 'sort': sort})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(len(response.context['courses']), COURSES_PER_PAGE)
+        response = self.client.get(reverse('courses'), {'after': 'not base64!'})
+        self.assertEqual([c.id for c in response.context['courses']], first_page)
+
+    def test_filters_and_unpublished_courses(self):
+        category = Category.objects.create(name='Data')
+        match = make_course(category=category, level='advanced', currency='USD', price=100)
+        make_course(category=category, level='advanced', currency='USD', price=500)
+        make_course(category=category, level='beginner', currency='USD', price=100)
+        make_course(category=category, level='advanced', currency='USD', price=100, status='draft')
+
+        response = self.client.get(reverse('courses'), {
+            'category': category.id, 'level': 'advanced', 'currency': 'USD', 'max_price': '200',
+        })
+        self.assertEqual([c.id for c in response.context['courses']], [match.id])
+
+        response = self.client.get(reverse('courses'), {'status': 'draft'})
+        self.assertEqual(list(response.context['courses']), [])
+
+    def test_listing_uses_status_index(self):
+        queryset = Course.objects.published().filter(level='advanced').order_by('-id')[:13]
+        self.assertIn('course_status_level_idx', queryset.explain())
+
+
+class SearchTests(TestCase):
+    def indexed(self):
+        # The index is written when the transaction commits
+        return self.captureOnCommitCallbacks(execute=True)
+
+    def test_ranked_search_with_snippets(self):
+        with self.indexed():
+            in_title = make_course(title='Django for Beginners', description='Build web apps')
+            in_body = make_course(title='Web Basics', description='A short intro before you learn Django')
+            make_course(title='Django Drafts', description='Not public', status='draft')
+
+        results = search.search('djang')
+        self.assertEqual([r['object'].id for r in results], [in_title.id, in_body.id])
+        self.assertIn('<mark>Django</mark>', results[1]['snippet'])
+
+    def test_arabic_text_ignores_tashkeel(self):
+        with self.indexed():
+            course = make_course(title='مقدمة في البرمجة', description='تعلّم البرمجة بلغة بايثون من الصفر')
+        self.assertEqual([r['object'].id for r in search.search('تعلم بايثون')], [course.id])
+        self.assertEqual([r['object'].id for r in search.search('البرمجه')], [course.id])
+        # Snippets keep the text as written
+        self.assertEqual(search.search('تعلم')[0]['snippet'], '<mark>تعلّم</mark> البرمجة بلغة بايثون من الصفر')
+        self.assertEqual(search.search('البرمجه')[0]['snippet'], 'مقدمة في <mark>البرمجة</mark>')
+
+    def test_signals_keep_outline_and_tracks_in_sync(self):
+        with self.indexed():
+            course = make_course()
+            section = CourseSection.objects.create(course=course, title='Basics')
+            lesson = CourseLesson.objects.create(section=section, title='Generators and iterators')
+        self.assertEqual([r['object'] for r in search.search('generators')], [course])
+
+        with self.indexed():
+            lesson.delete()
+        self.assertEqual(search.search('generators'), [])
+
+        track = Track.objects.create(title='Data Engineering', description='Pipelines <script>')
+        result = search.search('pipelines')[0]
+        self.assertEqual((result['kind'], result['object']), ('track', track))
+        self.assertIn('&lt;script&gt;', result['snippet'])
+
+        with self.indexed():
+            course.status = 'archived'
+            course.save()
+        self.assertEqual(search.search('python'), [])
+
+    def test_course_reindexed_once_per_transaction(self):
+        course = make_course()
+        with patch('core.search.course_documents', wraps=search.course_documents) as documents:
+            with self.indexed():
+                section = CourseSection.objects.create(course=course, title='Basics')
+                for title in ('Lists', 'Dicts', 'Sets'):
+                    CourseLesson.objects.create(section=section, title=title)
+        documents.assert_called_once_with([course.id])
+        self.assertEqual([r['object'] for r in search.search('dicts')], [course])
+
+    def test_rebuild_and_search_view(self):
+        course = make_course()
+        Course.objects.filter(pk=course.pk).update(title='Rust Systems')  # Bypasses signals
+        self.assertEqual(search.search('rust'), [])
+
+        call_command('rebuild_search_index', stdout=StringIO())
+        response = self.client.get(reverse('search'), {'q': 'Rust" sys*'})
+        self.assertEqual([r['object'] for r in response.context['results']], [course])
+
+
+class CourseRatingTests(TestCase):
+    def setUp(self):
+        self.course = make_course()
+        self.other = make_course(title='Other')
+        self.users = [User.objects.create(username=f'student{i}') for i in range(3)]
+
+    def assertRatings(self, course, count, total, histogram):
+        course.refresh_from_db()
+        self.assertEqual((course.rating_count, course.rating_sum), (count, total))
+        self.assertEqual(list(course.rating_histogram.values()), histogram)
+        self.assertAlmostEqual(course.rating_average, total / count if count else 0)
+
+    def test_create_edit_move_and_delete(self):
+        first = CourseReview.objects.create(user=self.users[0], course=self.course, rating=5)
+        CourseReview.objects.create(user=self.users[1], course=self.course, rating=2)
+        self.assertRatings(self.course, 2, 7, [0, 1, 0, 0, 1])
+        self.assertEqual(self.course.average_rating, 3.5)
+
+        first.rating = 4
+        first.save()
+        self.assertRatings(self.course, 2, 6, [0, 1, 0, 1, 0])
+
+        first = CourseReview.objects.get(pk=first.pk)
+        first.course = self.other
+        first.save()
+        self.assertRatings(self.course, 1, 2, [0, 1, 0, 0, 0])
+        self.assertRatings(self.other, 1, 4, [0, 0, 0, 1, 0])
+
+        first.delete()
+        self.assertRatings(self.other, 0, 0, [0, 0, 0, 0, 0])
+
+        self.users[1].delete()  # Cascades to the review
+        self.assertRatings(self.course, 0, 0, [0, 0, 0, 0, 0])
+
+    def test_stale_saves_keep_the_aggregates(self):
+        review = CourseReview.objects.create(user=self.users[0], course=self.course, rating=5)
+        stale = Course.objects.get(pk=self.course.pk)
+        CourseReview.objects.create(user=self.users[1], course=self.course, rating=3)
+        stale.title = 'Renamed'
+        stale.save()
+        self.assertRatings(self.course, 2, 8, [0, 0, 1, 0, 1])
+        self.assertEqual(Course.objects.get(pk=self.course.pk).title, 'Renamed')
+
+        # Built with a pk rather than loaded: the stored rating is read, not counted twice
+        CourseReview(pk=review.pk, user=self.users[0], course=self.course, rating=4, created_at=review.created_at).save()
+        self.assertRatings(self.course, 2, 7, [0, 0, 1, 1, 0])
+
+    def test_repair_command_and_rating_sort(self):
+        for user, rating in zip(self.users, (3, 4, 5)):
+            CourseReview.objects.create(user=user, course=self.other, rating=rating)
+        CourseReview.objects.create(user=self.users[0], course=self.course, rating=1)
+        Course.objects.update(rating_count=0, rating_sum=0, rating_average=0, rating_3=7)
+
+        call_command('recompute_course_ratings', stdout=StringIO())
+        self.assertRatings(self.other, 3, 12, [0, 0, 1, 1, 1])
+        self.assertRatings(self.course, 1, 1, [1, 0, 0, 0, 0])
+
+        response = self.client.get(reverse('courses'), {'sort': 'rating'})
+        self.assertEqual([c.id for c in response.context['courses']], [self.other.id, self.course.id])
+        response = self.client.get(reverse('courses'), {'min_rating': 2})
+        self.assertEqual([c.id for c in response.context['courses']], [self.other.id])
+
+
+class CoursePriceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_final_price_filter_and_sort_in_sql(self):
+        cheap = make_course(price=200, discount=50)  # 100.00
+        full = make_course(price=150, discount=0)
+        dear = make_course(price=400, discount=25)   # 300.00
+        self.assertEqual(Course.objects.get(pk=cheap.pk).final_price, Decimal('100.00'))
+
+        response = self.client.get(reverse('courses'), {'max_price': '150', 'sort': 'price'})
+        self.assertEqual([c.id for c in response.context['courses']], [cheap.id, full.id])
+        response = self.client.get(reverse('courses'), {'sort': '-price'})
+        self.assertEqual([c.id for c in response.context['courses']], [dear.id, full.id, cheap.id])
+
+        plan = Course.objects.published().filter(final_price__lte=150).order_by('final_price', 'id').explain()
+        self.assertIn('course_status_final_price_idx', plan)
+
+    def test_base_price_and_track_final_price(self):
+        egp = make_course(price=1000, currency='EGP')
+        usd = make_course(price=100, discount=10, currency='USD')
+        with self.settings(CURRENCY_RATES={'EGP': Decimal('1'), 'USD': Decimal('50')}):
+            prices = dict(Course.objects.with_base_price().order_by('base_price').values_list('id', 'base_price'))
+        self.assertEqual(prices, {egp.id: Decimal('1000'), usd.id: Decimal('4500')})
+
+        track = Track.objects.create(title='Full stack', price=None, discount=None)
+        self.assertEqual(Track.objects.get(pk=track.pk).final_price, Decimal('0'))
+
+
+    def test_versions_outlive_the_page_cache(self):
+        version = get_cache_version(PAGES_CACHE)
+        cache.clear()  # Like culling a full page cache
+        self.assertEqual(get_cache_version(PAGES_CACHE), version)
+
+
+class PublicPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        self.client.get(reverse('tracks'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('tracks'))
+        self.assertEqual(response.status_code, 200)
+
+        Track.objects.create(title='Cyber Security')
+        self.assertContains(self.client.get(reverse('tracks')), 'Cyber Security')
+
+    def test_tracking_tags_share_the_cached_page(self):
+        self.client.get(reverse('tracks'), {'utm_source': 'ads', 'gclid': 'first'})
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('tracks'), {'gclid': 'second', 'fbclid': 'x'})
+        self.assertNotContains(response, 'gclid')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('tracks'), {'max_price': '100', 'gclid': 'third'})
+        self.assertTrue(ctx.captured_queries)  # A filter the view reads is its own entry
+
+    def test_logged_in_users_and_flash_messages_bypass_cache(self):
+        self.client.get(reverse('about'))
+        self.client.force_login(User.objects.create(username='staff'))
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse('about'))
+        self.assertTrue(ctx.captured_queries)
+        self.client.logout()
+
+        # A pending success message must be shown, and not cached for others
+        self.client.post(reverse('contact'), {
+            'username': 'Mona', 'company_name': 'ACME', 'email': 'mona@example.com', 'phone': '0100', 'message': 'Hi',
+        })
+        self.assertContains(self.client.get(reverse('home')), 'Your message was submitted successfully')
+        self.assertNotContains(self.client.get(reverse('home')), 'Your message was submitted successfully')
+
+    def test_pages_with_csrf_tokens_are_not_cached(self):
+        calls = []
+
+        @cache_public_page
+        def form_page(request):
+            calls.append(1)
+            return HttpResponse(get_token(request))
+
+        for _ in range(2):
+            request = RequestFactory().get('/form/')
+            request.user = AnonymousUser()
+            form_page(request)
+        self.assertEqual(len(calls), 2)
+
+
+class ConditionalPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'], HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+
+    def test_course_page_returns_304_until_content_changes(self):
+        course = make_course()
+        url = reverse('course', args=[course.id])
+        first = self.client.get(url)
+        self.assertIn('ETag', first)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revalidate(url, first).status_code, 304)
+
+        CourseLearningOutcome.objects.create(course=course, outcome='Write tests')
+        second = self.revalidate(url, first)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+
+    def test_track_page_follows_member_courses_and_faqs(self):
+        track = Track.objects.create(title='Backend')
+        course = make_course()
+        url = reverse('track', args=[track.id])
+        first = self.client.get(url)
+        self.assertEqual(self.revalidate(url, first).status_code, 304)
+
+        course.tracks.add(track)
+        second = self.revalidate(url, first)
+        self.assertEqual(second.status_code, 200)
+
+        self.assertEqual(self.revalidate(url, second).status_code, 304)
+        # Outcomes of member courses are listed on the track page
+        CourseLearningOutcome.objects.create(course=course, outcome='Design APIs')
+        self.assertEqual(self.revalidate(url, second).status_code, 200)
+
+    def test_missing_course_is_still_404(self):
+        self.assertEqual(self.client.get(reverse('course', args=[999])).status_code, 404)
+
+
+def image_upload(name='photo.png', size=(820, 400), color='red', mode='RGB'):
+    output = BytesIO()
+    Image.new(mode, size, color).save(output, format='PNG')
+    return SimpleUploadedFile(name, output.getvalue(), content_type='image/png')
+
+
+class ImageTestMixin:
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings_override = self.settings(MEDIA_ROOT=media, IMAGE_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class ThumbnailPipelineTests(ImageTestMixin, TestCase):
+    def test_thumbnail_is_cropped_after_commit_and_original_kept(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            course = make_course(thumbnail=image_upload())
+        # Until the job runs the page shows the original upload
+        self.assertEqual(thumbnail_url(course, 'thumbnail'), course.thumbnail.url)
+        with Image.open(course.thumbnail.path) as original:
+            self.assertEqual(original.size, (820, 400))
+
+        for callback in callbacks:
+            callback()
+        rendition = IMAGE_SPECS[0].rendition_name(course.thumbnail_digest)
+        self.assertEqual(thumbnail_url(course, 'thumbnail'), default_storage.url(rendition))
+        with default_storage.open(rendition) as thumb:
+            self.assertEqual(Image.open(thumb).size, (410, 378))
+
+    def test_unchanged_images_are_not_reencoded(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            course = make_course(thumbnail=image_upload())
+            user = User.objects.create(username='pic', profile_picture=image_upload('me.png', mode='RGBA', color=(0, 0, 0, 0)))
+        self.assertTrue(user.profile_picture_digest)
+
+        with patch('core.images.render_thumbnail') as render, patch('core.images.file_digest') as digest:
+            with self.captureOnCommitCallbacks(execute=True):
+                course = Course.objects.get(pk=course.pk)
+                course.title = 'Renamed'
+                course.save()
+        render.assert_not_called()
+        digest.assert_not_called()
+
+        # Same content uploaded again: same digest, thumbnail already on disk
+        with patch('core.images.Image.open') as reopen, self.captureOnCommitCallbacks(execute=True):
+            old_digest = course.thumbnail_digest
+            course.thumbnail = image_upload('again.png')
+            course.save()
+        self.assertEqual(course.thumbnail_digest, old_digest)
+        reopen.assert_not_called()
+
+
+class ResponsiveImageTests(ImageTestMixin, TestCase):
+    def test_srcset_and_lazy_variant_generation(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            course = make_course(thumbnail=image_upload(size=(1200, 800)))
+        html = Template("{% load images %}{% responsive_image course 'thumbnail' sizes='50vw' alt='x' %}").render(Context({'course': course}))
+        url = reverse('image_variant', args=[course.thumbnail_digest, 640, 'webp'])
+        self.assertIn(f'{url} 640w', html)
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('loading="lazy"', html)
+        self.assertContains(self.client.get(reverse('courses')), f'{url} 640w')
+
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        with Image.open(BytesIO(b''.join(response.streaming_content))) as variant:
+            self.assertEqual(variant.size, (640, 590))  # The 410x378 thumbnail crop
+
+        # Later requests are served straight from disk
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_unknown_digest_or_width_is_404(self):
+        self.assertEqual(self.client.get(reverse('image_variant', args=['0' * 64, 640, 'webp'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('image_variant', args=['0' * 64, 641, 'webp'])).status_code, 404)
+
+
+class TrackEnrollmentTests(TestCase):
+    def setUp(self):
+        self.track = Track.objects.create(title='Full Stack')
+        self.courses = [make_course(title=f'Course {i}') for i in range(12)]
+        self.track.courses.add(*self.courses)
+        for course in self.courses[:10]:  # Two courses have no group yet
+            for start in (date(2030, 1, 1), date(2030, 3, 1)):
+                CourseGroup.objects.create(course=course, start_date=start, end_date=start)
+        self.students = [User.objects.create(username=f'trainee{i}') for i in range(10)]
+
+    def test_cohort_enrollment_is_set_based(self):
+        # Track rows, course ids, enrolled pairs, groups, one seat UPDATE per course,
+        # enrollments, rollup rows plus one UPDATE per course, and two savepoints:
+        # nothing grows with the number of students
+        with self.assertNumQueries(30):
+            enroll_in_track(self.track, self.students)
+        self.assertEqual(TrackEnrollment.objects.count(), 10)
+        self.assertEqual(Enrollment.objects.count(), 10 * 10)
+        self.assertEqual(set(Enrollment.objects.values_list('group__start_date', flat=True)), {date(2030, 1, 1)})
+        self.assertEqual(set(CourseGroup.objects.filter(start_date=date(2030, 1, 1)).values_list('seats_taken', flat=True)), {10})
+
+        enroll_in_track(self.track, self.students)  # Idempotent
+        self.assertEqual(Enrollment.objects.count(), 10 * 10)
+
+    def test_single_enrollment_save_is_atomic(self):
+        with self.assertNumQueries(30):
+            TrackEnrollment.objects.create(user=self.students[0], track=self.track)
+        self.assertEqual(Enrollment.objects.filter(user=self.students[0]).count(), 10)
+
+        with patch.object(Enrollment.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                TrackEnrollment.objects.create(user=self.students[1], track=self.track)
+        self.assertFalse(TrackEnrollment.objects.filter(user=self.students[1]).exists())
+
+
+class SeatAllocationTests(TestCase):
+    def setUp(self):
+        self.course = make_course()
+        self.started = CourseGroup.objects.create(course=self.course, start_date=date(2020, 1, 1), end_date=date(2020, 3, 1), capacity=50)
+        self.later = CourseGroup.objects.create(course=self.course, start_date=date(2030, 6, 1), end_date=date(2030, 9, 1), capacity=5)
+        self.earliest = CourseGroup.objects.create(course=self.course, start_date=date(2030, 1, 1), end_date=date(2030, 3, 1), capacity=2)
+        self.students = [User.objects.create(username=f'seat{i}') for i in range(8)]
+
+    def test_fills_earliest_upcoming_group_first(self):
+        groups = [enroll(student, self.course).group_id for student in self.students[:7]]
+        self.assertEqual(groups, [self.earliest.id] * 2 + [self.later.id] * 5)
+        self.assertEqual(enroll(self.students[0], self.course).group_id, self.earliest.id)  # Already enrolled
+        with self.assertRaises(CourseFull):
+            enroll(self.students[7], self.course)
+
+        self.earliest.refresh_from_db()
+        self.later.refresh_from_db()
+        self.assertEqual((self.earliest.seats_taken, self.later.seats_taken), (2, 5))
+        self.assertEqual(self.later.seats_left, 0)
+
+    def test_bulk_enrollment_spills_over_and_skips_the_rest(self):
+        created = enroll_in_courses(self.students, [self.course.id])
+        self.assertEqual(len(created), 7)
+        self.assertEqual(
+            dict(Enrollment.objects.values_list('group_id').annotate(total=Count('id'))),
+            {self.earliest.id: 2, self.later.id: 5},
+        )
+        self.assertFalse(Enrollment.objects.filter(group=self.started).exists())
+
+    def test_seats_are_released_and_never_overwritten(self):
+        enrollment = enroll(self.students[0], self.course)
+        stale = CourseGroup.objects.get(pk=self.earliest.pk)
+        enroll(self.students[1], self.course)
+        stale.capacity = 3
+        stale.save()  # Must not write its stale seats_taken back
+        self.earliest.refresh_from_db()
+        self.assertEqual((self.earliest.capacity, self.earliest.seats_taken), (3, 2))
+
+        enrollment.delete()
+        self.earliest.refresh_from_db()
+        self.assertEqual(self.earliest.seats_taken, 1)
+
+        CourseGroup.objects.filter(pk=self.earliest.pk).update(seats_taken=0)
+        call_command('recount_group_seats', stdout=StringIO())
+        self.earliest.refresh_from_db()
+        self.assertEqual(self.earliest.seats_taken, 1)
+
+
+class ConcurrentSeatAllocationTests(TransactionTestCase):
+    def test_parallel_enrollments_never_overfill_a_group(self):
+        course = make_course()
+        groups = [
+            CourseGroup.objects.create(course=course, start_date=date(2030, month, 1), end_date=date(2030, month, 28), capacity=7)
+            for month in (1, 2, 3)
+        ]
+        students = [User.objects.create(username=f'rush{i}') for i in range(40)]
+
+        def attempt(student):
+            try:
+                return enroll(student, course).group_id
+            except CourseFull:
+                return None
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(attempt, students))
+
+        self.assertEqual(sum(result is not None for result in results), 21)
+        for group in groups:
+            group.refresh_from_db()
+            self.assertEqual(group.seats_taken, 7)
+            self.assertEqual(Enrollment.objects.filter(group=group).count(), 7)
+
+
+class RosterImportTests(TestCase):
+    def setUp(self):
+        self.course = make_course()
+        CourseGroup.objects.create(course=self.course, start_date=date(2030, 1, 1), end_date=date(2030, 3, 1))
+        User.objects.create(username='mona', email='mona@example.com')
+        User.objects.create(username='coach', email='coach@example.com', role='instructor')
+
+    def roster(self, rows, name='roster.csv'):
+        content = 'Email,First Name,Last Name,Phone\n' + ''.join(f'{row}\n' for row in rows)
+        return SimpleUploadedFile(name, content.encode())
+
+    def test_creates_students_in_bulk_and_reports_bad_rows(self):
+        rows = [f'trainee{i}@example.com,Trainee,{i},0100000{i:04d}' for i in range(30)]
+        rows += ['MONA@example.com,Mona,,', 'not-an-email,,,', 'trainee25@example.com,Again,,', 'coach@example.com,,,', ',,,']
+        with CaptureQueriesContext(connection) as queries:
+            report = import_roster(self.roster(rows), 'roster.csv', [self.course], batch_size=20)
+        self.assertLess(len(queries), 30)  # Per batch, not per row
+
+        self.assertEqual((report.created, report.existing, report.enrolled), (30, 1, 31))
+        self.assertEqual([line for line, _ in report.errors], [33, 34, 35])
+        self.assertEqual(StudentProfile.objects.filter(user__email__startswith='trainee').count(), 30)
+        trainee = User.objects.get(email='trainee7@example.com')
+        self.assertEqual((trainee.username, trainee.last_name, trainee.phone1), ('trainee7@example.com', '7', '01000000007'))
+        self.assertFalse(trainee.has_usable_password())
+
+        again = import_roster(self.roster(rows), 'roster.csv', [self.course])  # Idempotent
+        self.assertEqual((again.created, again.existing, again.enrolled), (0, 31, 0))
+
+    def test_xlsx_roster(self):
+        workbook = Workbook()
+        workbook.active.append(['Email', 'First Name', 'Last Name', 'Phone'])
+        workbook.active.append(['sheet@example.com', 'Sheet', 'Row', 1001234567])
+        workbook.active.append(['mona@example.com', 'Mona', None, None])
+        workbook.active.append(['broken', None, None, None])
+        content = BytesIO()
+        workbook.save(content)
+
+        report = import_roster(SimpleUploadedFile('roster.xlsx', content.getvalue()), 'roster.xlsx', [self.course])
+        self.assertEqual((report.created, report.existing, report.enrolled, report.error_count), (1, 1, 2, 1))
+        self.assertEqual(User.objects.get(email='sheet@example.com').phone1, '1001234567')
+
+        with self.assertRaises(RosterFormatError):
+            import_roster(SimpleUploadedFile('roster.xlsx', b'not a workbook'), 'roster.xlsx')
+
+    def test_admin_import(self):
+        admin_user = User.objects.create_superuser('root', 'root@example.com', 'secret')
+        self.client.force_login(admin_user)
+        url = reverse('admin:core_user_import_roster')
+        self.assertContains(self.client.get(reverse('admin:core_user_changelist')), url)
+
+        response = self.client.post(url, {'roster': self.roster(['new@example.com,New,Student,']), 'courses': [self.course.id]})
+        self.assertContains(response, '1 students created')
+        self.assertTrue(Enrollment.objects.filter(user__email='new@example.com', course=self.course).exists())
+
+        response = self.client.post(url, {'roster': self.roster([], name='roster.txt')})
+        self.assertContains(response, 'Upload a .csv or .xlsx file.')
+
+
+class LessonProgressTests(TestCase):
+    def setUp(self):
+        self.course = make_course()
+        group = CourseGroup.objects.create(course=self.course, start_date=date(2030, 1, 1), end_date=date(2030, 3, 1))
+        section = CourseSection.objects.create(course=self.course, title='Basics')
+        self.lessons = [CourseLesson.objects.create(section=section, title=f'Lesson {i}') for i in range(4)]
+        self.enrollment = Enrollment.objects.create(user=User.objects.create(username='learner'), course=self.course, group=group)
+
+    def progress(self):
+        self.enrollment.refresh_from_db()
+        return self.enrollment.completed_lessons, self.enrollment.progress
+
+    def test_completion_moves_progress_without_recounting(self):
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.lesson_count, 4)
+
+        with self.assertNumQueries(4):  # Savepoint, completion, counter UPDATE, release
+            self.assertTrue(complete_lesson(self.enrollment, self.lessons[0]))
+        self.assertFalse(complete_lesson(self.enrollment, self.lessons[0]))
+        complete_lesson(self.enrollment, self.lessons[1])
+        self.assertEqual(self.progress(), (2, Decimal('50.00')))
+
+        uncomplete_lesson(self.enrollment, self.lessons[1])
+        self.assertEqual(self.progress(), (1, Decimal('25.00')))
+        CourseLesson.objects.create(section=self.lessons[0].section, title='Extra 1')
+        CourseLesson.objects.create(section=self.lessons[0].section, title='Extra 2')
+        self.assertEqual(self.progress(), (1, Decimal('16.67')))
+
+        with self.assertRaises(ValueError):
+            complete_lesson(self.enrollment, CourseLesson.objects.create(section=CourseSection.objects.create(course=make_course(), title='Other'), title='Elsewhere'))
+
+    def test_stale_saves_keep_the_counters(self):
+        stale_course = Course.objects.get(pk=self.course.pk)
+        stale_enrollment = Enrollment.objects.get(pk=self.enrollment.pk)
+        CourseLesson.objects.create(section=self.lessons[0].section, title='Added later')
+        complete_lesson(self.enrollment, self.lessons[0])
+        stale_course.title = 'Renamed'
+        stale_course.save()
+        stale_enrollment.save()
+
+        self.course.refresh_from_db()
+        self.assertEqual((self.course.title, self.course.lesson_count), ('Renamed', 5))
+        self.assertEqual(self.progress(), (1, Decimal('20.00')))
+
+    def test_curriculum_changes(self):
+        complete_lesson(self.enrollment, self.lessons[0])
+        CourseLesson.objects.create(section=self.lessons[0].section, title='Bonus')
+        self.assertEqual(self.progress(), (1, Decimal('20.00')))
+
+        self.lessons[0].delete()
+        self.assertEqual(self.progress(), (0, Decimal('0.00')))
+
+        complete_lesson(self.enrollment, self.lessons[1])
+        Course.objects.filter(pk=self.course.pk).update(lesson_count=0)
+        Enrollment.objects.filter(pk=self.enrollment.pk).update(completed_lessons=3, progress=0)
+        call_command('recompute_progress', stdout=StringIO())
+        self.assertEqual(self.progress(), (1, Decimal('25.00')))
+
+
+class InstallmentTests(TestCase):
+    def setUp(self):
+        self.payment = Payment.objects.create(
+            student=User.objects.create(username='payer'), course=make_course(), amount=Decimal('1200'),
+            payment_method='Paymob', payment_type='installment', total_installments=4, installment_amount=Decimal('300'),
+        )
+
+    def test_schedule_is_one_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            installments = self.payment.create_installments()
+        self.assertEqual(sum('INSERT INTO "core_installment"' in query['sql'] for query in queries), 1)
+        start = timezone.localdate(self.payment.created_at)
+        self.assertEqual([i.due_date for i in installments], [start + timedelta(days=days) for days in (90, 120, 150, 180)])
+        self.assertEqual(list(self.payment.installments.values_list('installment_number', flat=True)), [1, 2, 3, 4])
+
+    def test_overdue_sweep(self):
+        self.payment.create_installments()
+        today = timezone.localdate(self.payment.created_at) + timedelta(days=125)
+        self.payment.installments.filter(installment_number=1).update(status='paid')
+        self.assertEqual(list(Installment.objects.overdue(today).values_list('installment_number', flat=True)), [2])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(Installment.objects.mark_overdue(today), 1)
+        self.assertEqual(Installment.objects.mark_overdue(today), 0)
+        self.assertEqual(list(Installment.objects.overdue(today).values_list('installment_number', 'status')), [(2, 'overdue')])
+
+        with patch('django.utils.timezone.localdate', return_value=today + timedelta(days=365)):
+            call_command('mark_overdue_installments', stdout=StringIO())
+        self.assertEqual(Installment.objects.filter(status='overdue').count(), 3)
+
+
+class DashboardRollupTests(TestCase):
+    def setUp(self):
+        self.course = make_course()
+        self.student = User.objects.create(username='client')
+        self.group = CourseGroup.objects.create(course=self.course, start_date=date(2030, 1, 1), end_date=date(2030, 3, 1))
+
+    def stats(self):
+        return {
+            row.pop('day'): row
+            for row in DailyCourseStats.objects.filter(course=self.course).values('day', *rollups.STATS_FIELDS).order_by('day')
+        }
+
+    def test_ledger_changes_are_applied_as_deltas(self):
+        today = timezone.localdate()
+        payment = Payment.objects.create(
+            student=self.student, course=self.course, amount=Decimal('900'), payment_method='Paymob',
+            payment_type='installment', total_installments=3, installment_amount=Decimal('300'),
+        )
+        self.assertFalse(DailyCourseStats.objects.exists())  # Pending payments don't count
+
+        payment.status = 'completed'
+        payment.save()
+        installments = payment.create_installments()
+        Enrollment.objects.create(user=self.student, course=self.course, group=self.group)
+        first = Installment.objects.get(pk=installments[0].pk)
+        first.status, first.paid_at = 'paid', timezone.now()
+        first.save()
+
+        stats = self.stats()
+        self.assertEqual((stats[today]['payments'], stats[today]['revenue'], stats[today]['enrollments']), (1, Decimal('900'), 1))
+        self.assertEqual(stats[today]['installments_collected'], Decimal('300'))
+        self.assertEqual(stats[installments[0].due_date]['installments_due'], Decimal('300'))
+        self.assertEqual(rollups.collections(), {'due': Decimal('900'), 'collected': Decimal('300'), 'outstanding': Decimal('600')})
+
+        payment.status = 'refunded'
+        payment.save()
+        stats = self.stats()
+        self.assertEqual((stats[today]['payments'], stats[today]['revenue'], stats[today]['refunds']), (0, Decimal('0'), Decimal('900')))
+
+        before = self.stats()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual({day: row for day, row in self.stats().items() if any(row.values())}, {day: row for day, row in before.items() if any(row.values())})
+
+        payment.delete()  # Its installments go with it
+        self.assertEqual(
+            {day: {field: value for field, value in row.items() if value} for day, row in self.stats().items()},
+            {day: ({'enrollments': 1} if day == today else {}) for day in self.stats()},
+        )
+
+    def test_dashboard_reads_only_rollups(self):
+        DailyCourseStats.objects.create(day=date(2025, 1, 5), course=self.course, enrollments=2, revenue=Decimal('100'))
+        DailyCourseStats.objects.create(day=date(2025, 1, 20), course=self.course, enrollments=1, revenue=Decimal('50'))
+        DailyCourseStats.objects.create(day=date(2025, 2, 1), course=self.course, enrollments=4)
+        with CaptureQueriesContext(connection) as queries:
+            months = list(rollups.monthly(date(2025, 1, 1), date(2025, 2, 28)))
+        self.assertEqual([(row['month'], row['enrollments'], row['revenue']) for row in months], [
+            (date(2025, 1, 1), 3, Decimal('150')), (date(2025, 2, 1), 4, Decimal('0')),
+        ])
+        self.assertNotIn('core_payment', queries[0]['sql'])
+
+
+class FakePaymob:
+    """Stand-in for the gateway: builds and signs transaction callbacks like Paymob does."""
+
+    def __init__(self, client, secret='test-secret'):
+        self.client = client
+        self.secret = secret
+        self.next_id = 9000
+
+    def transaction(self, reference, success=True, **fields):
+        self.next_id += 1
+        return {
+            'id': self.next_id, 'amount_cents': 90000, 'created_at': '2026-01-01T10:00:00', 'currency': 'EGP',
+            'error_occured': False, 'has_parent_transaction': False, 'integration_id': 42, 'is_3d_secure': True,
+            'is_auth': False, 'is_capture': False, 'is_refunded': False, 'is_standalone_payment': True,
+            'is_voided': False, 'owner': 7, 'pending': False, 'success': success,
+            'order': {'id': 555, 'merchant_order_id': reference},
+            'source_data': {'pan': '2346', 'sub_type': 'MasterCard', 'type': 'card'},
+            **fields,
+        }
+
+    def callback(self, transaction_data, signature=None):
+        signature = signature or payments.paymob_signature(transaction_data, self.secret)
+        return self.client.post(
+            f"{reverse('paymob_webhook')}?hmac={signature}",
+            json.dumps({'type': 'TRANSACTION', 'obj': transaction_data}), content_type='application/json',
+        )
+
+
+@override_settings(PAYMOB_HMAC_SECRET='test-secret')
+class PaymentWebhookTests(TestCase):
+    def setUp(self):
+        self.gateway = FakePaymob(self.client)
+        self.course = make_course()
+        CourseGroup.objects.create(course=self.course, start_date=date(2030, 1, 1), end_date=date(2030, 3, 1))
+        self.student = User.objects.create(username='buyer')
+
+    def payment(self, **kwargs):
+        return Payment.objects.create(student=self.student, course=self.course, amount=Decimal('900'), payment_method='Paymob', **kwargs)
+
+    def test_callbacks_are_verified_stored_and_applied_once(self):
+        payment = self.payment(payment_type='cash')
+        transaction_data = self.gateway.transaction(payments.merchant_order_id(payment))
+
+        self.assertEqual(self.gateway.callback(transaction_data, signature='0' * 128).status_code, 403)
+        with self.assertNumQueries(1):  # Just the inbox INSERT
+            self.assertEqual(self.gateway.callback(transaction_data).status_code, 200)
+        self.gateway.callback(transaction_data)  # Gateway retry
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'pending')  # Nothing applied on the web request
+
+        self.assertEqual(payments.process_due(), 1)
+        self.assertEqual(payments.process_due(), 0)
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.transaction_id), ('completed', str(transaction_data['id'])))
+        self.assertEqual(Enrollment.objects.filter(user=self.student, course=self.course).count(), 1)
+
+    def test_installments_and_retries(self):
+        payment = self.payment(payment_type='installment', total_installments=2, installment_amount=Decimal('450'))
+        installments = payment.create_installments()
+        missing = self.gateway.transaction('999999')
+        first = self.gateway.transaction(payments.merchant_order_id(payment, installments[0]), amount_cents=45000)
+        self.gateway.callback(missing)
+        self.gateway.callback(first)
+
+        with self.assertLogs('core.payments', 'ERROR'):
+            self.assertEqual(payments.process_due(), 1)
+        failed = PaymentEvent.objects.get(transaction_id=missing['id'])
+        self.assertEqual((failed.status, failed.attempts), ('pending', 1))
+        self.assertGreater(failed.next_attempt_at, timezone.now())
+        self.assertIn('DoesNotExist', failed.last_error)
+
+        payment.refresh_from_db()
+        self.assertEqual((payment.paid_installments, payment.status), (1, 'pending'))
+        self.assertTrue(Enrollment.objects.filter(user=self.student, course=self.course).exists())
+        self.gateway.callback(self.gateway.transaction(payments.merchant_order_id(payment, installments[1]), amount_cents=45000))
+        call_command('process_payment_events', stdout=StringIO())
+        payment.refresh_from_db()
+        self.assertEqual((payment.paid_installments, payment.status), (2, 'completed'))
+
+    def test_wrong_amounts_are_flagged_not_applied(self):
+        payment = self.payment(payment_type='cash')
+        reference = payments.merchant_order_id(payment)
+        self.gateway.callback(self.gateway.transaction(reference, amount_cents=100))
+        with self.assertLogs('core.payments', 'ERROR'):
+            self.assertEqual(payments.process_due(), 0)
+        event = PaymentEvent.objects.get()
+        self.assertEqual(event.status, 'failed')  # Not retried
+        self.assertIn('AmountMismatch', event.last_error)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'pending')
+        self.assertFalse(Enrollment.objects.filter(user=self.student, course=self.course).exists())
+
+        # The right number of cents, in another currency
+        self.gateway.callback(self.gateway.transaction(reference, currency='USD'))
+        with self.assertLogs('core.payments', 'ERROR'):
+            self.assertEqual(payments.process_due(), 0)
+        self.assertIn('USD', PaymentEvent.objects.get(payload__currency='USD').last_error)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'pending')
+
+        installment = self.payment(payment_type='installment', total_installments=2, installment_amount=Decimal('450'))
+        first = installment.create_installments()[0]
+        self.gateway.callback(self.gateway.transaction(payments.merchant_order_id(installment, first)))  # The full 900
+        with self.assertLogs('core.payments', 'ERROR'):
+            payments.process_due()
+        first.refresh_from_db()
+        self.assertEqual(first.status, 'pending')
+
+    def test_events_of_one_order_wait_for_earlier_ones(self):
+        payment = self.payment(payment_type='cash')
+        reference = payments.merchant_order_id(payment)
+        self.gateway.callback(self.gateway.transaction(reference, success=False))
+        self.gateway.callback(self.gateway.transaction(reference))
+        self.assertEqual(payments.due_events().count(), 1)
+
+        payments.process_due()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'failed')
+        payments.process_due()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'completed')
+
+
+class QuizGradingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.quiz = Quiz.objects.create(course=make_course(), title='Basics', description='')
+        self.questions = [QuizQuestion.objects.create(quiz=self.quiz, question_text=f'Q{i}') for i in range(4)]
+        self.correct = {}
+        for question in self.questions:
+            answers = [QuizAnswer.objects.create(question=question, answer_text=str(i), is_correct=i == 1) for i in range(3)]
+            self.correct[question.id] = answers[1].id
+        # The last question has two correct answers, both must be chosen
+        extra = QuizAnswer.objects.create(question=self.questions[3], answer_text='also', is_correct=True)
+        self.correct[self.questions[3].id] = [self.correct[self.questions[3].id], extra.id]
+        self.students = [User.objects.create(username=f'examinee{i}') for i in range(3)]
+
+    def test_grades_in_memory_with_a_cached_key(self):
+        responses = dict(self.correct)
+        responses[self.questions[0].id] = self.correct[self.questions[0].id] + 1  # One wrong answer
+        quizzes.grade(self.students[0], self.quiz, responses)  # Warms the key
+
+        with self.assertNumQueries(5):  # The attempt INSERT and two counter UPDATEs, in a savepoint
+            attempt = quizzes.grade(self.students[1], self.quiz, {str(k): v for k, v in self.correct.items()})
+        self.assertEqual(attempt.score, 100)
+        self.assertEqual(QuizAttempt.objects.get(user=self.students[0]).score, 75)
+        self.assertEqual(attempt.responses[str(self.questions[3].id)], sorted(self.correct[self.questions[3].id]))
+
+        partial = {self.questions[3].id: self.correct[self.questions[3].id][0]}
+        self.assertEqual(quizzes.grade(self.students[2], self.quiz, partial).score, 0)
+
+    def test_key_is_reloaded_after_changes(self):
+        self.assertEqual(len(quizzes.answer_key(self.quiz.id)), 4)
+        QuizQuestion.objects.create(quiz=self.quiz, question_text='New')
+        self.assertEqual(len(quizzes.answer_key(self.quiz.id)), 5)
+        QuizAnswer.objects.filter(question=self.questions[0]).update(is_correct=False)  # No signal
+        answer = QuizAnswer.objects.filter(question=self.questions[0]).first()
+        answer.is_correct = True
+        answer.save()
+        self.assertEqual(quizzes.answer_key(self.quiz.id)[self.questions[0].id], {answer.id})
+
+    def test_bulk_grading(self):
+        students = [User.objects.create(username=f'bulk{i}') for i in range(30)]
+        submissions = [(student.id, self.correct if i % 2 else {}) for i, student in enumerate(students)]
+        with self.assertNumQueries(19):  # Key (cache miss), then per batch of 10 a read, an INSERT and two UPDATEs in a savepoint
+            self.assertEqual(quizzes.grade_many(self.quiz, submissions, batch_size=10), 30)
+        self.assertEqual(sorted(set(QuizAttempt.objects.values_list('score', flat=True))), [0, 100])
+
+        upload = tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False)
+        self.addCleanup(os.remove, upload.name)
+        with upload:
+            for student in self.students:
+                upload.write(json.dumps({'user': student.id, 'responses': self.correct}) + '\n')
+            upload.write('not json\n')
+        err = StringIO()
+        call_command('grade_submissions', self.quiz.id, upload.name, stdout=StringIO(), stderr=err)
+        self.assertIn('Line 4', err.getvalue())
+        self.assertEqual(QuizAttempt.objects.filter(user__in=self.students, score=100).count(), 3)
+
+    def test_item_counters_follow_grading(self):
+        first = self.questions[0]
+        wrong = self.correct[first.id] + 1
+        quizzes.grade(self.students[0], self.quiz, self.correct)  # 100
+        quizzes.grade(self.students[1], self.quiz, {**self.correct, first.id: wrong})  # 75
+        quizzes.grade_many(self.quiz, [(self.students[2].id, {first.id: wrong}), (self.students[0].id, {})])  # 0, then a repeat
+
+        first.refresh_from_db()
+        self.assertEqual((first.attempt_count, first.correct_count, first.score_sum), (3, 1, 175))
+        self.assertAlmostEqual(first.difficulty, 1 / 3)
+        self.assertGreater(first.discrimination, 0)
+        self.assertEqual(QuizAnswer.objects.get(pk=wrong).chosen_count, 2)
+        self.assertEqual(QuizAnswer.objects.get(pk=self.correct[first.id]).chosen_count, 1)
+
+        stale = QuizQuestion.objects.get(pk=first.pk)
+        quizzes.grade(User.objects.create(username='late'), self.quiz, {})
+        stale.question_text = 'Reworded'
+        stale.save()
+        first.refresh_from_db()
+        self.assertEqual((first.question_text, first.attempt_count), ('Reworded', 4))
+        answer = QuizAnswer.objects.get(pk=wrong)
+        quizzes.grade(User.objects.create(username='later'), self.quiz, {first.id: wrong})
+        answer.save()
+        self.assertEqual(QuizAnswer.objects.get(pk=wrong).chosen_count, 3)
+
+        counters = list(QuizQuestion.objects.order_by('id').values_list(*quizzes.ITEM_FIELDS))
+        chosen = list(QuizAnswer.objects.order_by('id').values_list('chosen_count', flat=True))
+        QuizQuestion.objects.update(attempt_count=0, correct_count=0)
+        self.assertEqual(quizzes.recompute_item_stats(self.quiz.id, batch_size=2), 5)
+        self.assertEqual(list(QuizQuestion.objects.order_by('id').values_list(*quizzes.ITEM_FIELDS)), counters)
+        self.assertEqual(list(QuizAnswer.objects.order_by('id').values_list('chosen_count', flat=True)), chosen)
+
+        with self.assertNumQueries(2):
+            analysis = quizzes.item_analysis(self.quiz.id)
+        self.assertEqual(analysis[0]['attempts'], 5)
+        self.assertAlmostEqual(analysis[0]['answers'][2]['share'], 3 / 5)
+
+        out = StringIO()
+        call_command('export_item_analysis', self.quiz.id, stdout=out)
+        rows = list(csv.DictReader(StringIO(out.getvalue())))
+        self.assertEqual(len(rows), QuizAnswer.objects.count())
+        self.assertEqual(rows[0]['difficulty'], '0.2000')
+
+
+class RoleChangeTests(TestCase):
+    def setUp(self):
+        User.objects.create(username='learner', role='student')
+
+    def test_saves_that_keep_the_role_cost_no_extra_queries(self):
+        user = User.objects.get(username='learner')
+        with self.assertNumQueries(1):  # The UPDATE only
+            user.last_login = timezone.now()
+            user.save(update_fields=['last_login'])
+        with self.assertNumQueries(1):  # Full save, role compared against the loaded value
+            user.headline = 'Learning'
+            user.save()
+
+    def test_role_change_swaps_profiles(self):
+        user = User.objects.get(username='learner')
+        user.role = 'instructor'
+        user.save()
+        self.assertFalse(StudentProfile.objects.filter(user=user).exists())
+        self.assertTrue(InstructorProfile.objects.filter(user=user).exists())
+        with self.assertNumQueries(1):  # The new role is now the loaded one
+            user.save()
+
+        stale = User(pk=user.pk, username='learner', role='student')  # Not loaded by a query
+        stale.save()
+        self.assertTrue(StudentProfile.objects.filter(user=user).exists())
+        self.assertFalse(InstructorProfile.objects.filter(user=user).exists())
+
+
+class BulkUserOperationTests(TestCase):
+    def setUp(self):
+        self.students = [User.objects.create(username=f'member{i}', role='student') for i in range(20)]
+        self.instructor = User.objects.create(username='mentor', role='instructor')
+
+    def test_change_role_matches_per_user_saves(self):
+        ids = [user.id for user in self.students] + [self.instructor.id]
+        with self.assertNumQueries(6):  # Read, UPDATE, profile DELETE and INSERT, in a savepoint
+            self.assertEqual(accounts.change_role(ids, 'instructor'), 20)
+        self.assertEqual(set(User.objects.values_list('role', flat=True)), {'instructor'})
+        self.assertFalse(StudentProfile.objects.exists())
+        self.assertEqual(InstructorProfile.objects.count(), 21)
+
+        self.assertEqual(accounts.change_role(User.objects.filter(username__startswith='member'), 'admin'), 20)
+        self.assertEqual(InstructorProfile.objects.get().user, self.instructor)
+        self.assertFalse(StudentProfile.objects.exists())
+
+    def test_admin_actions(self):
+        admin_user = User.objects.create_superuser(username='root', email='root@example.com', password='pw', role='admin')
+        self.client.force_login(admin_user)
+        url = reverse('admin:core_user_changelist')
+        selected = [user.pk for user in self.students[:5]]
+        self.client.post(url, {'action': 'deactivate_users', '_selected_action': selected})
+        self.assertEqual(User.objects.filter(is_active=False).count(), 5)
+        self.client.post(url, {'action': 'activate_users', '_selected_action': selected})
+        self.client.post(url, {'action': 'make_instructors', '_selected_action': selected})
+        self.assertFalse(User.objects.filter(is_active=False).exists())
+        self.assertEqual(InstructorProfile.objects.count(), 6)
+        self.assertEqual(StudentProfile.objects.count(), 15)
+
+
+class RecaptchaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.server = recaptcha.stub_server()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.enterContext(override_settings(RECAPTCHA_VERIFY_URL=recaptcha.stub_url(self.server)))
+
+    def test_verifies_against_the_stub_and_refuses_replays(self):
+        self.assertTrue(recaptcha.verify('good-token'))
+        self.assertFalse(recaptcha.verify('invalid-token'))
+        self.assertFalse(recaptcha.verify(''))
+        self.assertTrue(async_to_sync(recaptcha.verify_async)('other-token'))
+
+        self.server.shutdown()
+        with override_settings(RECAPTCHA_FAIL_OPEN=True):  # Answered from the cache, no request
+            self.assertFalse(recaptcha.verify('good-token'))  # Spent
+            self.assertFalse(recaptcha.verify('invalid-token'))
+
+    def test_unreachable_verifier_follows_the_policy(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self.assertLogs('core.recaptcha', 'WARNING'):
+            self.assertFalse(recaptcha.verify('token'))
+            with override_settings(RECAPTCHA_FAIL_OPEN=True):
+                self.assertTrue(recaptcha.verify('token'))
+
+
+class SMTPSink(socketserver.StreamRequestHandler):
+    """A debugging SMTP server that accepts every message and remembers it."""
+    connections = 0
+    messages = []
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        type(self).connections += 1
+        self.reply('220 sink ready')
+        while line := self.rfile.readline():
+            command = line.decode().strip().upper()
+            if command.startswith('EHLO') or command.startswith('HELO'):
+                self.reply('250 sink')
+            elif command == 'DATA':
+                self.reply('354 go ahead')
+                data = b''.join(iter(lambda: self.rfile.readline(), b'.\r\n'))
+                type(self).messages.append(data.decode())
+                self.reply('250 queued')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+@override_settings(STAFF_NOTIFICATION_EMAILS=['staff@example.com'])
+class OutboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        SMTPSink.connections, SMTPSink.messages = 0, []
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPSink)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.enterContext(override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=server.server_address[1],
+        ))
+
+    def post_contact(self, i):
+        return self.client.post(reverse('contact'), {
+            'username': f'Visitor {i}', 'company_name': 'Acme', 'email': f'v{i}@example.com',
+            'phone': '0100', 'message': 'Hello',
+        })
+
+    def test_form_save_and_outbox_row_commit_together(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.post_contact(0).status_code, 302)
+        # Apart from the throttle cache, the two INSERTs in one savepoint; no SMTP
+        writes = [query['sql'].split('"')[1] for query in queries if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual([table for table in writes if table != 'core_throttle_cache'], ['core_contact', 'core_outboxmessage'])
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.topic, message.payload), ('contact_received', {'id': Contact.objects.get().pk}))
+
+        with patch('core.outbox.enqueue', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.post_contact(1)
+        self.assertEqual(Contact.objects.count(), 1)  # Rolled back with the outbox write
+
+    def test_worker_sends_a_batch_over_one_connection(self):
+        for i in range(3):
+            self.post_contact(i)
+        call_command('drain_outbox', stdout=StringIO())
+        self.assertEqual(SMTPSink.connections, 1)
+        self.assertEqual(len(SMTPSink.messages), 3)
+        self.assertIn('Visitor 2', SMTPSink.messages[2])
+        self.assertFalse(OutboxMessage.objects.exclude(status='sent').exists())
+
+    def test_failures_back_off_and_give_up(self):
+        self.post_contact(0)
+        message = OutboxMessage.objects.get()
+        with override_settings(EMAIL_PORT=1), self.assertLogs('core.outbox', 'ERROR'):  # Nothing listens there
+            self.assertEqual(outbox.deliver(outbox.claim()), 0)
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts, message.claim), ('pending', 1, ''))
+        self.assertGreater(message.next_attempt_at, timezone.now() + timedelta(seconds=outbox.RETRY_DELAY - 5))
+        self.assertEqual(outbox.claim(), [])  # Not due yet
+
+        OutboxMessage.objects.update(next_attempt_at=timezone.now(), attempts=7)
+        with override_settings(EMAIL_PORT=1), self.assertLogs('core.outbox', 'ERROR'):
+            outbox.deliver(outbox.claim())
+        self.assertEqual(OutboxMessage.objects.get().status, 'failed')
+
+
+class FormLoadSheddingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def post_talent_request(self, ip='10.0.0.1'):
+        # Invalid on purpose: a rejected POST must fail before the form is looked at
+        return self.client.post(reverse('need_talents'), {'user_name': 'Bot'}, REMOTE_ADDR=ip)
+
+    @override_settings(PUBLIC_FORM_RATE_PER_IP=(2, 60))
+    def test_per_ip_bucket(self):
+        self.assertEqual(self.post_talent_request().status_code, 200)
+        self.assertEqual(self.post_talent_request().status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_talent_request()
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(all('core_throttle_cache' in query['sql'] for query in queries))  # Only the bucket was read
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(self.post_talent_request(ip='10.0.0.2').status_code, 200)
+        self.assertEqual(self.client.get(reverse('need_talents'), REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    @override_settings(PUBLIC_FORM_RATE_PER_IP=(1, 60), RATE_LIMIT_IP_HEADER='HTTP_X_FORWARDED_FOR')
+    def test_forwarded_for_uses_the_proxy_hop(self):
+        def post(spoofed):
+            return self.client.post(reverse('need_talents'), {'user_name': 'Bot'}, HTTP_X_FORWARDED_FOR=f'{spoofed}, 203.0.113.9')
+
+        self.assertEqual(post('1.1.1.1').status_code, 200)
+        self.assertEqual(post('2.2.2.2').status_code, 429)  # Rotating the client part doesn't help
+
+    @override_settings(PUBLIC_FORM_RATE_GLOBAL=(3, 60))
+    def test_global_bucket(self):
+        codes = [self.post_talent_request(ip=f'10.0.1.{i}').status_code for i in range(4)]
+        self.assertEqual(codes, [200, 200, 200, 429])
+
+    def test_bucket_refills(self):
+        now = timezone.now().timestamp()  # Entry expiry is computed from the same clock
+        with patch('core.throttle.time.time', return_value=now):
+            self.assertEqual(throttle.take('bucket', 2, 10), 0)
+            self.assertEqual(throttle.take('bucket', 2, 10), 0)
+            self.assertAlmostEqual(throttle.take('bucket', 2, 10), 5)
+        with patch('core.throttle.time.time', return_value=now + 5):
+            self.assertEqual(throttle.take('bucket', 2, 10), 0)
+
+
+
+class AdmissionTests(TransactionTestCase):
+    # Committed writes, so the waiting thread's own connection sees the slots
+    def setUp(self):
+        caches['throttle'].clear()
+
+    def test_admission_queue(self):
+        slots, other_worker = throttle.Admission('queue'), throttle.Admission('queue')  # Shared through the cache
+        slot = slots.enter(1, 1, 0)
+        self.assertIsNotNone(slot)
+        self.assertIsNone(other_worker.enter(1, 0, 5))  # Queue full, refused without waiting
+        self.assertIsNone(other_worker.enter(1, 1, 0.1))  # Waited, no slot freed up
+
+        def wait_for_slot():
+            try:
+                return other_worker.enter(1, 1, 5)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(1) as pool:
+            waiter = pool.submit(wait_for_slot)
+            slots.leave(slot)
+            self.assertIsNotNone(waiter.result(timeout=5))
+
+        with override_settings(PUBLIC_FORM_CONCURRENCY=0, PUBLIC_FORM_QUEUE=0):
+            response = self.client.post(reverse('need_talents'), {'user_name': 'Bot'})
+        self.assertEqual(response.status_code, 503)
+
+    def test_held_slots_survive_a_flood_of_visitors(self):
+        slot = throttle.Admission('contact').enter(1, 0, 0)
+        for i in range(400):
+            throttle.take(f'throttle:contact:ip:10.1.{i // 256}.{i % 256}', 5, 60)
+        self.assertIsNone(throttle.Admission('contact').enter(1, 0, 0))
+        throttle.Admission('contact').leave(slot)
+        self.assertIsNotNone(throttle.Admission('contact').enter(1, 0, 0))
+
+
+class SQLiteConfigurationTests(TestCase):
+    def test_connection_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            busy_timeout = cursor.fetchone()[0]
+        self.assertEqual(busy_timeout, settings.SQLITE_PRAGMAS['busy_timeout'])
+        # Every write waits this long, not just the ones wrapped in retry_on_lock
+        self.assertGreaterEqual(busy_timeout, 1000)
+
+    def test_busy_writes_are_retried_outside_transactions(self):
+        calls = []
+
+        def write():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return 'saved'
+
+        with patch('core.db.connection') as conn, patch('core.db.time.sleep') as sleep, self.assertLogs('core.db', 'WARNING'):
+            conn.in_atomic_block = False
+            self.assertEqual(retry_on_lock(write)(), 'saved')
+            self.assertEqual(sleep.call_count, 2)
+            self.assertLessEqual(sleep.call_args_list[1].args[0], 2 * RETRY_DELAY)
+
+            # A database that stays locked gives up once the budget is spent
+            def locked():
+                calls.append(1)
+                raise OperationalError('database is locked')
+
+            calls.clear()
+            clock = iter(range(1000))  # Every reading is a second later
+            with patch('core.db.time.monotonic', side_effect=lambda: next(clock)), self.assertRaises(OperationalError):
+                retry_on_lock(locked)()
+            self.assertLessEqual(len(calls), RETRY_BUDGET)
+
+            calls.clear()
+            conn.in_atomic_block = True
+            with self.assertRaises(OperationalError):
+                retry_on_lock(write)()
+        self.assertEqual(len(calls), 1)
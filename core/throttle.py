@@ -0,0 +1,86 @@
+import time
+from django.conf import settings
+from django.core.cache import caches
+
+SLOT_LEASE = 60  # Seconds before the slot of a worker that died mid-request frees itself
+QUEUE_POLL = 0.05  # Seconds between two looks for a free slot while queued
+
+
+def store():
+    """The cache holding buckets and slots, kept apart from the evictable page cache."""
+    return caches['throttle']
+
+
+def client_ip(request):
+    """
+    The visitor's address. Behind a proxy, the last entry of RATE_LIMIT_IP_HEADER,
+    which the proxy appended itself; earlier entries come from the client and
+    can be anything.
+    """
+    forwarded = request.META.get(settings.RATE_LIMIT_IP_HEADER, '') if settings.RATE_LIMIT_IP_HEADER else ''
+    return forwarded.split(',')[-1].strip() or request.META.get('REMOTE_ADDR', '')
+
+
+def take(key, rate, period):
+    """
+    Take a token from a bucket holding rate tokens, refilled over period seconds.
+    Returns 0 when allowed, else the seconds until a token is free.
+
+    The bucket is one number in the throttle cache, the time it will be full
+    again (GCRA), so a check is a cache read plus a write when allowed. Two
+    workers racing on the same key can let an extra request through, which is
+    fine for load shedding.
+    """
+    interval = period / rate
+    now = time.time()
+    full_at = max(store().get(key) or now, now)
+    wait = full_at + interval - now - period
+    if wait > 0:
+        return wait
+    store().set(key, full_at + interval, int(period) + 1)
+    return 0
+
+
+class Admission:
+    """
+    Bounded admission shared by every worker through the throttle cache: up to
+    limit requests of a scope run at once site-wide, up to queue more wait at
+    most timeout seconds for a slot, the rest are turned away immediately.
+
+    Slots and places in the queue are cache keys taken with add(), which the
+    database cache does in one transaction, so no two workers hold the same
+    one. There is no counter that a crashed worker could leave behind: the
+    keys expire after SLOT_LEASE seconds.
+    """
+
+    def __init__(self, scope):
+        self.scope = scope
+
+    def take_key(self, kind, count):
+        for number in range(count):
+            key = f"admission:{self.scope}:{kind}:{number}"
+            if store().add(key, 1, SLOT_LEASE):
+                return key
+        return None
+
+    def enter(self, limit, queue, timeout):
+        """The key of the slot taken, to give back with leave(), or None when refused."""
+        key = self.take_key('slot', limit)
+        if key is not None or not queue:
+            return key
+        place = self.take_key('queue', queue)
+        if place is None:
+            return None
+        try:
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                time.sleep(QUEUE_POLL)
+                key = self.take_key('slot', limit)
+                if key is not None:
+                    return key
+            return None
+        finally:
+            store().delete(place)
+
+    def leave(self, key):
+        store().delete(key)
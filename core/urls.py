@@ -12,4 +12,7 @@ urlpatterns = [
     path('tracks/<int:track_id>/', track, name='track'),
     path('courses/', courses, name='courses'),
     path('courses/<int:course_id>/', course, name='course'),
+    path('search/', search, name='search'),
+    path('images/<str:digest>/<int:width>.<str:ext>', image_variant, name='image_variant'),
+    path('payments/paymob/callback/', paymob_webhook, name='paymob_webhook'),
 ]
\ No newline at end of file
@@ -1,12 +1,31 @@
-import requests
-from django.conf import settings
+import time
+from django.core.cache import caches
+from .recaptcha import verify
 
 def verify_recaptcha(recaptcha_response):
-    url = "https://www.google.com/recaptcha/api/siteverify"
-    data = {
-        "secret": settings.RECAPTCHA_SECRET_KEY,
-        "response": recaptcha_response
-    }
-    response = requests.post(url, data=data)
-    result = response.json()
-    return result.get("success", False)  # Returns True if verification is successful
+    return verify(recaptcha_response)  # Returns True if verification is successful
+
+
+# Versioned cache keys
+# Each cached namespace has a version stored in the 'versions' cache. Bumping the
+# version makes every key built from the old one unreachable, so invalidation
+# is a single cache write. Versions are timestamps, so they can also be used
+# as "last changed" markers.
+def get_cache_version(name):
+    key = f"version:{name}"
+    versions = caches['versions']
+    version = versions.get(key)
+    if version is None:
+        versions.add(key, time.time(), None)
+        version = versions.get(key)
+    return version
+
+def bump_cache_version(name):
+    key = f"version:{name}"
+    version = time.time()
+    versions = caches['versions']
+    current = versions.get(key)
+    if current is not None and version <= current:
+        version = current + 0.000001
+    versions.set(key, version, None)
+    return version
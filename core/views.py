@@ -1,10 +1,44 @@
+import json
+import re
 from django.shortcuts import render, get_object_or_404, redirect
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.contrib import messages
+from django.db import transaction
+from django.db.models import Max
+from datetime import datetime, timezone as dt_timezone
 from .models import *
 from .forms import *
+from .pagination import KeysetPaginator
+from .db import retry_on_lock
+from .decorators import cache_public_page, conditional_page, shed_form_posts
+from .navigation import NAVIGATION_CACHE
+from .utils import get_cache_version
+from . import search as search_index
+from . import images
+from . import outbox, payments
 
+COURSES_PER_PAGE = 12
+TRACKS_PER_PAGE = 10
 
 
+def page_links(request, page):
+    """Next/previous URLs for a keyset page, keeping the current filters."""
+    links = {}
+    for name, cursor, param in (('next_url', page.next_cursor, 'after'), ('previous_url', page.previous_cursor, 'before')):
+        if cursor:
+            query = request.GET.copy()
+            query.pop('after', None)
+            query.pop('before', None)
+            query[param] = cursor
+            links[name] = f"?{query.urlencode()}"
+    return links
+
+
+
+@cache_public_page
 def home(request):
     context = {
         'page_title' : 'Home Page',
@@ -12,15 +46,38 @@ def home(request):
     return render(request, 'core/home.html', context)
 
 # All Tracks
+@cache_public_page(params=('min_price', 'max_price', 'after', 'before'))
 def tracks(request):
-    tracks = Track.objects.all()
+    form = TrackFilterForm(request.GET)
+    paginator = KeysetPaginator(form.filter(Track.objects.all()), ('-id',), TRACKS_PER_PAGE)
+    page = paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
     context = {
         'page_title' : 'Our Tracks',
-        'tracks' : tracks,
+        'tracks' : page,
+        'filter_form' : form,
+        **page_links(request, page),
     }
     return render(request, 'core/tracks.html', context)
 
+def page_last_modified(*timestamps):
+    """Latest of the given datetimes and the navigation menu every page renders."""
+    timestamps = [timestamp for timestamp in timestamps if timestamp]
+    if not timestamps:
+        return None
+    navigation = datetime.fromtimestamp(get_cache_version(NAVIGATION_CACHE), tz=dt_timezone.utc)
+    return max(*timestamps, navigation)
+
+def track_last_modified(request, track_id):
+    row = Track.objects.filter(id=track_id).aggregate(
+        Max('updated_at'), Max('created_at'), Max('courses__updated_at'),
+    )
+    return page_last_modified(*row.values())
+
+def course_last_modified(request, course_id):
+    return page_last_modified(Course.objects.filter(id=course_id).values_list('updated_at', flat=True).first())
+
 # Single Track
+@conditional_page(track_last_modified)
 def track(request, track_id):
     track = get_object_or_404(Track, id=track_id)
     context = {
@@ -31,16 +88,25 @@ def track(request, track_id):
 
 # All Courses
 def courses(request):
-    courses = Course.objects.all()
+    form = CourseFilterForm(request.GET)
+    # Only staff may list drafts and archived courses
+    courses = Course.objects.for_listing()
+    if not request.user.is_staff:
+        courses = courses.published()
+    paginator = KeysetPaginator(form.filter(courses), form.ordering(), COURSES_PER_PAGE)
+    page = paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
     context = {
         'page_title' : 'Our Courses',
-        'courses' : courses,
+        'courses' : page,
+        'filter_form' : form,
+        **page_links(request, page),
     }
     return render(request, 'core/courses.html', context)
 
 # Single Course
+@conditional_page(course_last_modified)
 def course(request, course_id):
-    course = get_object_or_404(Course, id=course_id)
+    course = get_object_or_404(Course.objects.with_detail(), id=course_id)
     context = {
         'page_title' : course.title,
         'course' : course,
@@ -48,12 +114,43 @@ def course(request, course_id):
     return render(request, 'core/course.html', context)
 
 
+# Full-text search over courses and tracks
+def search(request):
+    query = request.GET.get('q', '').strip()[:200]
+    context = {
+        'page_title' : 'Search',
+        'query' : query,
+        'results' : search_index.search(query) if query else [],
+    }
+    return render(request, 'core/search.html', context)
+
+# Responsive image variants, rendered on first request then served from disk
+def image_variant(request, digest, width, ext):
+    if width not in images.VARIANT_WIDTHS or ext not in images.variant_formats() or not re.fullmatch(r'[0-9a-f]{64}', digest):
+        raise Http404
+    name = images.variant_name(digest, width, ext)
+    if not default_storage.exists(name):
+        spec, source = images.find_source(digest)
+        if source is None:
+            raise Http404
+        try:
+            images.render_variant(spec, source, digest, width, ext)
+        except OSError:
+            raise Http404
+    response = FileResponse(default_storage.open(name, 'rb'), content_type=images.VARIANT_FORMATS[ext][1])
+    # The name is derived from the content, so it never changes
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+@cache_public_page
 def about(request):
     context = {
         'page_title' : 'About Us'
     }
     return render(request, 'core/about.html', context)
     
+@cache_public_page
 def faqs(request):
     context = {
         'page_title' : 'FAQs'
@@ -66,6 +163,7 @@ def contact(request):
     }
     return render(request, 'core/contact.html', context)
 
+@cache_public_page
 def corporate(request):
     context = {
         'page_title' : 'Corporate Trainig'
@@ -73,21 +171,49 @@ def corporate(request):
     return render(request, 'core/corporate.html', context)
 
 
+@retry_on_lock
+def save_and_notify(form, topic):
+    # Staff are notified by the outbox worker, not in this request
+    with transaction.atomic():
+        instance = form.save()
+        outbox.enqueue(topic, id=instance.pk)
+    return instance
+
+
+@shed_form_posts('need_talents')
 def talent_request_view(request):
     form = TalentRequestForm(request.POST or None)
     if form.is_valid():
-        form.save()
+        save_and_notify(form, 'talent_requested')
         messages.success(request, "Request submitted successfully, our team will contact you soon.")
         return redirect('home')
     return render(request, 'core/talent.html', {'form': form, 'page_title': 'Request Talents'})
 
 
+@shed_form_posts('contact')
 def contact(request):
     form = ContactForm()
     if request.method == 'POST':
         form = ContactForm(request.POST)
         if form.is_valid():
-            form.save()
+            save_and_notify(form, 'contact_received')
             messages.success(request, "Your message was submitted successfully. We will contact you soon.")
             return redirect('home') 
-    return render(request, 'core/contact.html', {'form': form, 'page_title': 'Contact Us'})
\ No newline at end of file
+    return render(request, 'core/contact.html', {'form': form, 'page_title': 'Contact Us'})
+
+# Paymob transaction callback: verify, store, acknowledge. process_payment_events applies it.
+@csrf_exempt
+@require_POST
+def paymob_webhook(request):
+    try:
+        body = json.loads(request.body)
+    except ValueError:
+        return HttpResponseBadRequest()
+    transaction_data = body.get('obj') if isinstance(body, dict) else None
+    if not isinstance(transaction_data, dict) or 'id' not in transaction_data:
+        return HttpResponseBadRequest()
+    if not payments.verify_paymob(transaction_data, request.GET.get('hmac')):
+        return HttpResponseForbidden()
+    if body.get('type') == 'TRANSACTION':  # Token callbacks are acknowledged and ignored
+        payments.receive(transaction_data)
+    return HttpResponse(status=200)
@@ -10,6 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
+import tempfile
+from decimal import Decimal
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -96,14 +99,76 @@ WSGI_APPLICATION = 'learnit.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# SQLite tuned for several gunicorn workers on one file: WAL lets readers run
+# alongside the single writer and NORMAL sync is durable enough in WAL mode.
+# busy_timeout covers every write, well under gunicorn's 30 s worker timeout;
+# core.db.retry_on_lock adds jittered retries on top for the busiest writes.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 128 * 1024 * 1024,
+    'cache_size': -20000,  # In KiB when negative: about 20 MB per connection
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,  # Milliseconds
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000,
+            # Write transactions take the lock when they begin, so contention shows
+            # up there, where it can be retried, rather than when a read lock can't
+            # be upgraded
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+        },
+        # A file rather than the in-memory default, so tests can exercise
+        # several connections writing at once (seat allocation)
+        'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'learnit_test.sqlite3')},
     }
 }
 
 
+# Cache
+# File based so every gunicorn worker on the host shares the same entries
+# (navigation menus, cached pages). Process-local copies sit in front of it.
+# FileBasedCache culls a third of its files at random once MAX_ENTRIES is
+# reached, so it is sized for the cached pages; nothing that must survive
+# lives in it. Tests use their own directories (learnit.test_settings).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'learnit_cache'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # Cache versions (core.utils.get_cache_version): a handful of keys that never
+    # expire, apart from the pages so those can't push them out. Losing one
+    # would invalidate its namespace and move Last-Modified of every page.
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'learnit_versions'),
+        'TIMEOUT': None,
+    },
+    # Rate limit buckets and admission slots (core.throttle). In the database,
+    # where add() is one transaction, so two workers can't take the same slot,
+    # and entries are only culled past MAX_ENTRIES, expired ones first: a
+    # flood of new visitors can't evict a slot that is held. The table is
+    # created by migration 0021_throttle_cache.
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'core_throttle_cache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+
+# Sessions are written on most requests; this engine retries them when SQLite is busy
+SESSION_ENGINE = 'core.sessions'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -122,9 +187,21 @@ USE_I18N = True
 USE_TZ = True
 
 
+# Currencies
+# Rates used to compare course prices across currencies (1 unit = N BASE_CURRENCY)
+
+BASE_CURRENCY = 'EGP'
+
+CURRENCY_RATES = {
+    'EGP': Decimal('1'),
+    'USD': Decimal('48.50'),
+    'SAR': Decimal('12.90'),
+    'AED': Decimal('13.20'),
+}
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.1/howto/static-files/
-import os
 
 STATIC_URL = "/static/"
 STATICFILES_DIRS = [
@@ -135,6 +212,45 @@ STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")  # For collected static file
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, "media") 
 
+# Threads per process rendering thumbnails after uploads (0 renders inline)
+IMAGE_WORKERS = 2
+
+# Paymob transaction callbacks are signed with this key (Dashboard > Settings > HMAC)
+PAYMOB_HMAC_SECRET = os.environ.get('PAYMOB_HMAC_SECRET', '')
+# A payment event that keeps failing is retried with backoff this many times
+PAYMENT_EVENT_MAX_ATTEMPTS = 8
+
+# Outgoing mail, sent by the outbox worker (drain_outbox), never inside a request
+EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', '') == '1'
+EMAIL_TIMEOUT = 10
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'Learn it <no-reply@localhost>')
+# Staff addresses notified of contact messages and talent requests (comma separated)
+STAFF_NOTIFICATION_EMAILS = [address for address in os.environ.get('STAFF_NOTIFICATION_EMAILS', '').split(',') if address]
+# An outbox message that keeps failing is retried with backoff this many times
+OUTBOX_MAX_ATTEMPTS = 8
+
+# Load shedding for the public contact and need-talents forms (core.decorators.shed_form_posts)
+PUBLIC_FORM_RATE_PER_IP = (5, 60)  # POSTs per visitor, per seconds
+PUBLIC_FORM_RATE_GLOBAL = (120, 60)  # POSTs for the whole site, per seconds
+PUBLIC_FORM_CONCURRENCY = 2  # POSTs handled at once across all workers, per form
+PUBLIC_FORM_QUEUE = 4  # POSTs waiting for a slot, the rest get a 503
+PUBLIC_FORM_QUEUE_TIMEOUT = 2  # Seconds a queued POST waits before a 503
+# Header the trusted proxy appends the client address to, e.g. 'HTTP_X_FORWARDED_FOR';
+# its last entry is used. Leave empty when not behind a proxy.
+RATE_LIMIT_IP_HEADER = os.environ.get('RATE_LIMIT_IP_HEADER', '')
+
+# reCAPTCHA verification, see core.recaptcha
+RECAPTCHA_SECRET_KEY = os.environ.get('RECAPTCHA_SECRET_KEY', '')
+RECAPTCHA_VERIFY_URL = os.environ.get('RECAPTCHA_VERIFY_URL', 'https://www.google.com/recaptcha/api/siteverify')
+RECAPTCHA_TIMEOUT = (3.05, 5)  # Seconds to connect, then to read the answer
+RECAPTCHA_CACHE_TIMEOUT = 120  # Seconds a used or refused token is refused without asking Google
+RECAPTCHA_FAIL_OPEN = False  # Whether to let requests through when Google can't be reached
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
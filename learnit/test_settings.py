@@ -0,0 +1,12 @@
+"""
+Settings for test runs: the settings of the site, with file caches in their
+own directories, since tests call cache.clear() and must not wipe the cache
+of a server running on the same host.
+"""
+
+from .settings import *
+
+CACHES = {
+    alias: {**config, 'LOCATION': f"{config['LOCATION']}_test"} if 'filebased' in config['BACKEND'] else config
+    for alias, config in CACHES.items()
+}